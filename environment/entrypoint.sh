@@ -15,6 +15,11 @@ if [ "$1" = 'migrate' ]; then
     exec python manage.py migrate
 fi
 
+if [ "$1" = 'worker' ]; then
+    echo 'Launching transactions worker'
+    exec python manage.py process_transactions
+fi
+
 if [ "$1" = 'loaddata' ]; then
     exec python manage.py loaddata initial_data.json
 fi
@@ -1,19 +1,44 @@
 from django.contrib import admin
+
+from commons.pagination import EstimatedCountPaginator
 from .models import ClientWalletTransaction
 from .models import ClientAccount, ClientWallet
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelists of big tables: no full COUNT(*) next to filtered results and an estimated
+    count for unfiltered ones (PostgreSQL).
+
+    Model __str__ methods follow the relations up to the username and the changelist calls
+    them for every row, list_select_related must fetch those relations with the rows.
+    """
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
 @admin.register(ClientAccount)
-class ClientAccountAdmin(admin.ModelAdmin):
+class ClientAccountAdmin(LargeTableAdmin):
     list_display = [f.name for f in ClientAccount._meta.fields]
+    list_select_related = ("user_account",)
 
 
 @admin.register(ClientWallet)
-class ClientWalletAdmin(admin.ModelAdmin):
-    list_display = [f.name for f in ClientWallet._meta.fields]
+class ClientWalletAdmin(LargeTableAdmin):
+    list_display = [f.name for f in ClientWallet._meta.fields] + ["username"]
+    list_select_related = ("client_account__user_account",)
     readonly_fields = ("balance", "last_update")
 
+    @admin.display(ordering="client_account__user_account__username")
+    def username(self, obj):
+        return obj.client_account.user_account.username
+
 
 @admin.register(ClientWalletTransaction)
-class ClientMoneyTransactionAdmin(admin.ModelAdmin):
-    list_display = [f.name for f in ClientWalletTransaction._meta.fields]
+class ClientMoneyTransactionAdmin(LargeTableAdmin):
+    list_display = [f.name for f in ClientWalletTransaction._meta.fields] + ["username"]
+    list_select_related = ("client_wallet_account__client_account__user_account",)
+
+    @admin.display(ordering="client_wallet_account__client_account__user_account__username")
+    def username(self, obj):
+        return obj.client_wallet_account.client_account.user_account.username
@@ -3,3 +3,18 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from . import cache, ownership
+        from .models import ClientAccount, ClientWallet
+
+        post_save.connect(cache.wallet_changed, sender=ClientWallet, dispatch_uid='wallet_cache_save')
+        post_delete.connect(cache.wallet_changed, sender=ClientWallet, dispatch_uid='wallet_cache_delete')
+        post_save.connect(cache.client_account_changed, sender=ClientAccount, dispatch_uid='wallet_cache_account')
+        post_save.connect(ownership.client_account_changed, sender=ClientAccount, dispatch_uid='ownership_account_save')
+        post_delete.connect(ownership.client_account_changed, sender=ClientAccount,
+                            dispatch_uid='ownership_account_delete')
+        post_save.connect(ownership.wallet_changed, sender=ClientWallet, dispatch_uid='ownership_wallet_save')
+        post_delete.connect(ownership.wallet_changed, sender=ClientWallet, dispatch_uid='ownership_wallet_delete')
@@ -0,0 +1,144 @@
+"""
+Async versions of the lightweight read endpoints, served natively by the ASGI application
+(uvicorn) without the sync_to_async hop that wraps every synchronous view.
+
+Rest framework views are synchronous, so these are plain Django async views with the same
+authentication (session or HTTP basic), permissions and response bodies as their
+synchronous counterparts in api.views. Queries use the async ORM; the rest framework
+cursor pagination has no async interface and runs its single query with sync_to_async,
+which is what the async ORM does internally too.
+
+* Docs
+** Async views: https://docs.djangoproject.com/en/5.2/topics/async/#async-views
+** Async queries: https://docs.djangoproject.com/en/5.2/topics/db/queries/#asynchronous-queries
+"""
+import base64
+import binascii
+from functools import wraps
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.http import HttpRequest, HttpResponse
+from rest_framework import exceptions
+from rest_framework.pagination import CursorPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from commons.pagination import DateCreatedCursorPagination, IdCursorPagination
+from .models import ClientAccount, ClientWallet
+from .serializers import ClientWalletSerializer
+from .views import get_user_accounts
+
+NOT_FOUND = {"detail": exceptions.NotFound.default_detail}
+
+
+async def get_user(request: HttpRequest) -> Optional[User]:
+    """
+    Session user or HTTP basic credentials, like the rest framework authentication
+    classes of the synchronous views.
+    """
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(auth[1]).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    user = await aauthenticate(request, username=username, password=password)
+    return user if user is not None and user.is_active else None
+
+
+def render(data, status: int = 200) -> HttpResponse:
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def async_api_view(staff_only: bool = False):
+    """
+    GET only async view with an authenticated user (request.user), 403 otherwise.
+    The view returns (data, status), rendered with the rest framework JSON renderer.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            if request.method != 'GET':
+                return render({"detail": exceptions.MethodNotAllowed.default_detail.format(method=request.method)}, 405)
+            request.user = await get_user(request)
+            if request.user is None:
+                return render({"detail": exceptions.NotAuthenticated.default_detail}, 403)
+            if staff_only and not request.user.is_staff:
+                return render({"detail": exceptions.PermissionDenied.default_detail}, 403)
+            return render(*await view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+@async_api_view()
+async def get_current_user_username(request: HttpRequest):
+    return {"username": request.user.username}, 200
+
+
+@async_api_view()
+async def get_current_user_id(request: HttpRequest):
+    return {"id": request.user.pk}, 200
+
+
+@async_api_view()
+async def get_current_client_id(request: HttpRequest):
+    client_account_id = await ClientAccount.objects.filter(
+        user_account_id=request.user.pk
+    ).values_list('id', flat=True).afirst()
+    if client_account_id is None:
+        return NOT_FOUND, 404
+    return {"id": client_account_id}, 200
+
+
+async def paginate(paginator: CursorPagination, queryset: QuerySet, request: HttpRequest, serialize=None):
+    """
+    Rest framework cursor pagination, its single query runs with sync_to_async.
+
+    :param serialize: representation of the page rows, the rows themselves by default
+    """
+    try:
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, Request(request))
+    except exceptions.NotFound as error:
+        return {"detail": error.detail}, 404
+    return paginator.get_paginated_response(serialize(page) if serialize else page).data, 200
+
+
+@async_api_view(staff_only=True)
+async def get_num_client_accounts(request: HttpRequest):
+    try:
+        users = get_user_accounts(request.GET)
+    except exceptions.ValidationError as error:
+        return error.detail, 400
+    return await paginate(IdCursorPagination(), users, request)
+
+
+def get_wallets(user: User):
+    wallets = ClientWallet.objects.with_total_balance()
+    if user.is_staff:
+        return wallets
+    return wallets.filter(client_account__user_account_id=user.pk)
+
+
+@async_api_view()
+async def client_wallet_list(request: HttpRequest):
+    return await paginate(
+        DateCreatedCursorPagination(), get_wallets(request.user), request,
+        lambda page: ClientWalletSerializer(page, many=True).data
+    )
+
+
+@async_api_view()
+async def client_wallet_detail(request: HttpRequest, pk):
+    try:
+        client_wallet = await get_wallets(request.user).aget(pk=pk)
+    except ClientWallet.DoesNotExist:
+        return NOT_FOUND, 404
+    return ClientWalletSerializer(client_wallet).data, 200
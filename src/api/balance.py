@@ -0,0 +1,339 @@
+"""
+Wallet balance updates.
+
+There are two update modes, selected with the WALLET_BALANCE_UPDATE_MODE setting:
+    - lock: the wallet row is fetched with select_for_update, the amount is added in Python
+      and only the balance columns are saved. The row lock is held from the SELECT until
+      the commit, so concurrent writers of the same wallet are serialized.
+    - atomic: the amount is added by the database with a single
+      UPDATE ... SET balance = balance + amount statement. Withdraws are guarded in the same
+      statement so the balance never goes negative. The row lock is only taken by that
+      statement, which runs as late as possible before the commit.
+
+Sharded wallets (ClientWallet.shard_count > 0) never lock the wallet row for deposits:
+the amount is added with a single UPDATE to one of the wallet shards chosen at random.
+Withdraws need the whole balance, so they lock the wallet and all its shards and move the
+shards balance back into the wallet balance (collapse_shards).
+
+The cached wallet representation (api.cache) is deleted after the commit of every
+balance change: UPDATE statements call cache.invalidate_wallet, wallet saves are handled
+by the post_save receiver.
+
+Balances can also be recomputed from the ledger (set_ledger_balances), ex. after a bulk
+import of transactions that did not update them row by row.
+
+Transfers between two wallets always lock both wallets, in id order, whatever the update
+mode, and never leave the source wallet with a negative balance.
+
+What the writes of the requests do when a wallet is already locked is the lock strategy,
+see api.locking. Wallets locked without a strategy (ex. by management commands) wait.
+
+* Docs
+** F() expressions: https://docs.djangoproject.com/en/5.2/ref/models/expressions/#f-expressions
+** select_for_update: https://docs.djangoproject.com/en/5.2/ref/models/querysets/#select-for-update
+"""
+import random
+from decimal import Decimal
+from typing import Callable, Iterable, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cache, ledger, locking, profiling
+from .models import ClientWallet, ClientWalletShard, ClientWalletTransaction, WalletTransaction
+
+LOCK = 'lock'
+ATOMIC = 'atomic'
+UPDATE_MODES = (LOCK, ATOMIC)
+
+T = TypeVar('T')
+
+
+class NegativeBalanceError(Exception):
+    """
+    Raised when a withdraw would leave a wallet with a negative balance.
+    """
+    message = "Transaction error: negative balance"
+
+    def __init__(self, wallet_id: Optional[UUID] = None):
+        super().__init__(self.message)
+        self.wallet_id = wallet_id
+
+
+def get_update_mode(mode: Optional[str] = None) -> str:
+    mode = mode or settings.WALLET_BALANCE_UPDATE_MODE
+    if mode not in UPDATE_MODES:
+        raise ImproperlyConfigured(
+            f"Unknown wallet balance update mode '{mode}', use one of: {', '.join(UPDATE_MODES)}"
+        )
+    return mode
+
+
+def lock_wallets(wallets: QuerySet, strategy: str = locking.WAIT) -> QuerySet:
+    """
+    Lock the wallets always in the same order (by id) to avoid deadlocks between
+    requests that lock more than one wallet. Only the wallet rows are locked, not the
+    rows of the tables joined by the filters (ex. the owner account).
+
+    :param strategy: lock strategy, see api.locking
+    """
+    return locking.lock(wallets, strategy).order_by("id")
+
+
+def get_wallet(wallet_id: UUID, mode: str, owner_id: Optional[int] = None,
+               strategy: str = locking.WAIT) -> ClientWallet:
+    """
+    Fetch the wallet of a new transaction. In lock mode a wallet that is not sharded is
+    locked by the same query. Must be called inside an atomic block.
+
+    :param owner_id: only match a wallet of this user, checked by the same query
+    :raise ClientWallet.DoesNotExist: there is no wallet with this id (owned by owner_id)
+    """
+    wallets = ClientWallet.objects.filter(id=wallet_id)
+    if owner_id is not None:
+        wallets = wallets.filter(client_account__user_account_id=owner_id)
+    if mode == LOCK:
+        try:
+            return lock_wallets(wallets.filter(shard_count=0), strategy).get()
+        except ClientWallet.DoesNotExist:
+            pass
+    return wallets.get()
+
+
+def add_to_locked_wallet(client_wallet: ClientWallet, amount: Decimal) -> None:
+    """
+    Lock mode: the wallet must be locked by the current transaction.
+    """
+    client_wallet.balance += amount
+    client_wallet.save(update_fields=["balance", "last_update"])
+
+
+def add_atomically(wallet_id: UUID, amount: Decimal) -> None:
+    """
+    Atomic mode: a single UPDATE statement, withdraws only match the row if the balance
+    is enough.
+
+    :raise NegativeBalanceError: the balance is not enough for this withdraw
+    :raise ClientWallet.DoesNotExist: there is no wallet with this id
+    """
+    wallets = ClientWallet.objects.filter(id=wallet_id)
+    if amount < 0:
+        wallets = wallets.filter(balance__gte=-amount)
+    if wallets.update(balance=F("balance") + amount, last_update=timezone.now()):
+        cache.invalidate_wallet(wallet_id)
+        return
+    if not ClientWallet.objects.filter(id=wallet_id).exists():
+        raise ClientWallet.DoesNotExist
+    raise NegativeBalanceError(wallet_id)
+
+
+def add_to_shard(client_wallet: ClientWallet, amount: Decimal) -> bool:
+    """
+    Sharded mode: add the amount to a random shard with a single UPDATE.
+
+    :return: False if the shard does not exist (the wallet shards are being resized)
+    """
+    index = random.randrange(client_wallet.shard_count)
+    if ClientWalletShard.objects.filter(client_wallet_id=client_wallet.pk, index=index).update(
+        balance=F("balance") + amount, last_update=timezone.now()
+    ) != 1:
+        return False
+    cache.invalidate_wallet(client_wallet.pk)
+    return True
+
+
+def collapse_shards(wallet_id: UUID, amount: Decimal = Decimal(0), guard: bool = False,
+                    shard_count: Optional[int] = None, strategy: str = locking.WAIT) -> ClientWallet:
+    """
+    Lock a wallet and all its shards, move the shards balance into the wallet balance and
+    add the amount. Must be called inside an atomic block.
+
+    :param guard: raise NegativeBalanceError instead of leaving a negative balance
+    :param shard_count: resize the wallet shards, 0 disables the sharded mode
+    :param strategy: lock strategy of the wallet, see api.locking
+    :return: the updated wallet
+    """
+    client_wallet = lock_wallets(ClientWallet.objects.filter(id=wallet_id), strategy).get()
+    shards = ClientWalletShard.objects.filter(client_wallet_id=wallet_id)
+    shards_balance = sum(shard.balance for shard in shards.select_for_update().order_by("index"))
+    total_balance = client_wallet.balance + shards_balance + amount
+    if guard and amount < 0 and total_balance < 0:
+        raise NegativeBalanceError(wallet_id)
+
+    client_wallet.balance = total_balance
+    if shard_count is not None:
+        client_wallet.shard_count = shard_count
+    client_wallet.save(update_fields=["balance", "shard_count", "last_update"])
+
+    shards.filter(index__gte=client_wallet.shard_count).delete()
+    shards.exclude(balance=0).update(balance=0, last_update=timezone.now())
+    ClientWalletShard.objects.bulk_create(
+        [ClientWalletShard(client_wallet_id=wallet_id, index=index) for index in range(client_wallet.shard_count)],
+        ignore_conflicts=True
+    )
+    return client_wallet
+
+
+def add_to_sharded_wallet(client_wallet: ClientWallet, amount: Decimal, guard: bool = False,
+                          strategy: str = locking.WAIT) -> None:
+    """
+    Deposits go to a random shard, withdraws collapse the shards.
+    """
+    if amount > 0 and add_to_shard(client_wallet, amount):
+        return
+    collapse_shards(client_wallet.pk, amount, guard=guard, strategy=strategy)
+
+
+def add_amount(client_wallet: ClientWallet, amount: Decimal, mode: Optional[str] = None,
+               strategy: str = locking.WAIT) -> None:
+    """
+    Add an amount to a wallet using the given update mode. In lock mode the wallet
+    must have been locked with lock_wallets.
+
+    :param strategy: lock strategy of the sharded wallet withdraws, see api.locking
+    """
+    mode = get_update_mode(mode)
+    if client_wallet.shard_count:
+        add_to_sharded_wallet(client_wallet, amount, guard=mode == ATOMIC, strategy=strategy)
+    elif mode == LOCK:
+        add_to_locked_wallet(client_wallet, amount)
+    else:
+        add_atomically(client_wallet.pk, amount)
+
+
+def record_transaction(wallet_id: UUID, amount: Decimal, insert: Callable[[ClientWallet], T],
+                       mode: Optional[str] = None, owner_id: Optional[int] = None,
+                       profile: Optional[profiling.WriteProfile] = None, lock_strategy: Optional[str] = None) -> T:
+    """
+    Insert a transaction and update its wallet balance inside one atomic block.
+
+    :param wallet_id: the wallet of the transaction, see get_wallet
+    :param amount: the transaction amount, it only changes the balance of deposits and withdraws
+    :param insert: function that saves the transaction of the given wallet, its value is returned
+    :param mode: balance update mode, WALLET_BALANCE_UPDATE_MODE setting by default
+    :param owner_id: only allow a wallet of this user
+    :param profile: timing of the lock, balance, insert and commit phases, see api.profiling
+    :param lock_strategy: WALLET_LOCK_STRATEGY setting by default, see api.locking
+    :raise ClientWallet.DoesNotExist: unknown wallet or not owned by owner_id
+    :raise NegativeBalanceError: atomic mode only, the withdraw was rolled back
+    :raise locking.WalletLockedError: the wallet lock was not acquired, nothing was changed
+    """
+    mode = get_update_mode(mode)
+    strategy = locking.get_strategy(lock_strategy)
+    profile = profile or profiling.WriteProfile()
+    affects_balance = WalletTransaction.Type.from_amount(amount).affects_balance
+
+    def attempt() -> T:
+        with transaction.atomic():
+            profile.mark(profiling.LOCK)
+            client_wallet = get_wallet(wallet_id, mode, owner_id, strategy)
+            if mode == LOCK and not client_wallet.shard_count:
+                if affects_balance:
+                    profile.mark(profiling.BALANCE)
+                    add_to_locked_wallet(client_wallet, amount)
+                profile.mark(profiling.INSERT)
+                result = insert(client_wallet)
+            else:
+                # The insert goes first so the row lock taken by the UPDATE is only held until the commit
+                profile.mark(profiling.INSERT)
+                result = insert(client_wallet)
+                if affects_balance:
+                    profile.mark(profiling.BALANCE)
+                    add_amount(client_wallet, amount, mode=mode, strategy=strategy)
+            profile.mark(profiling.COMMIT)
+        return result
+
+    result = locking.run(attempt, strategy)
+    profile.stop()
+    return result
+
+
+def transfer(source_id: UUID, target_id: UUID, amount: Decimal, description: Optional[str] = None,
+             owner_id: Optional[int] = None,
+             lock_strategy: Optional[str] = None) -> Tuple[ClientWalletTransaction, ClientWalletTransaction]:
+    """
+    Move a positive amount from the source wallet to the target wallet in one atomic block:
+    both wallets are locked with a single query, always in id order, so concurrent transfers
+    in opposite directions wait for each other instead of deadlocking.
+
+    :param owner_id: only allow a source wallet of this user, checked by the locking query
+    :param lock_strategy: WALLET_LOCK_STRATEGY setting by default, see api.locking
+    :return: the withdraw of the source wallet and the deposit of the target wallet
+    :raise ClientWallet.DoesNotExist: unknown target wallet, unknown source wallet or not owned by owner_id
+    :raise NegativeBalanceError: the source balance is not enough, nothing was changed
+    :raise locking.WalletLockedError: a wallet lock was not acquired, nothing was changed
+    """
+    if source_id == target_id:
+        raise ValueError("The source and target wallets of a transfer must be different")
+    strategy = locking.get_strategy(lock_strategy)
+    source = Q(id=source_id)
+    if owner_id is not None:
+        source &= Q(client_account__user_account_id=owner_id)
+
+    def attempt() -> Tuple[ClientWalletTransaction, ClientWalletTransaction]:
+        with transaction.atomic():
+            wallets = lock_wallets(ClientWallet.objects.filter(source | Q(id=target_id)), strategy)
+            wallets = {wallet.id: wallet for wallet in wallets}
+            if source_id not in wallets or target_id not in wallets:
+                raise ClientWallet.DoesNotExist
+
+            source_wallet = wallets[source_id]
+            if source_wallet.shard_count:
+                collapse_shards(source_id, -amount, guard=True, strategy=strategy)
+            elif source_wallet.balance < amount:
+                raise NegativeBalanceError(source_id)
+            else:
+                add_to_locked_wallet(source_wallet, -amount)
+
+            target_wallet = wallets[target_id]
+            if target_wallet.shard_count:
+                add_to_sharded_wallet(target_wallet, amount)
+            else:
+                add_to_locked_wallet(target_wallet, amount)
+
+            return tuple(ClientWalletTransaction.objects.bulk_create([
+                ClientWalletTransaction(
+                    client_wallet_account=source_wallet, amount=-amount, description=description,
+                    transaction_type=WalletTransaction.Type.WITHDRAW.value
+                ),
+                ClientWalletTransaction(
+                    client_wallet_account=target_wallet, amount=amount, description=description,
+                    transaction_type=WalletTransaction.Type.DEPOSIT.value
+                ),
+            ]))
+
+    return locking.run(attempt, strategy)
+
+
+def set_ledger_balances(wallet_ids: Iterable[UUID]) -> int:
+    """
+    Set the balance of the wallets to the sum of their completed deposits and withdraws,
+    with one UPDATE for every wallet, and empty their shards. Must be called inside an
+    atomic block.
+
+    The wallets and shards are locked by statements of their own before the UPDATE, so
+    its aggregate also sees the transactions of the writers it waited for.
+
+    :return: number of updated wallets
+    """
+    wallet_ids = list(wallet_ids)
+    list(lock_wallets(ClientWallet.objects.filter(id__in=wallet_ids)).values_list("id", flat=True))
+    ClientWalletShard.objects.filter(client_wallet_id__in=wallet_ids).exclude(balance=0).update(
+        balance=0, last_update=timezone.now()
+    )
+    balance_field = ClientWallet._meta.get_field("balance")
+    ledger_balance = ledger.ledger_transactions(OuterRef("pk")).values("client_wallet_account").annotate(
+        total=Sum("amount")
+    ).values("total")
+    updated = ClientWallet.objects.filter(id__in=wallet_ids).update(
+        balance=Coalesce(Subquery(ledger_balance), Value(Decimal(0)), output_field=balance_field),
+        last_update=timezone.now()
+    )
+    for wallet_id in wallet_ids:
+        cache.invalidate_wallet(wallet_id)
+    return updated
@@ -0,0 +1,299 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks create their own users, accounts and wallets (usernames starting with
+BENCHMARK_USERNAME_PREFIX) and remove them when they finish. The ids of the users created
+by the helpers below are recorded and only those are deleted, never other users whose
+username happens to start with the prefix.
+
+Concurrency numbers are only meaningful against PostgreSQL: SQLite serializes every
+write and ignores select_for_update.
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+from uuid import UUID, uuid4
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from faker import Faker
+
+from . import balance
+from .models import ClientAccount, ClientWallet, ClientWalletTransaction
+
+BENCHMARK_USERNAME_PREFIX = 'benchmark_'
+DELETE_BATCH_SIZE = 500
+
+# Ids of the users created by this process, see delete_benchmark_data
+created_user_ids: Set[int] = set()
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile, 0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    queries: int = 0
+
+    @property
+    def operations(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def per_second(self) -> float:
+        return self.operations / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def queries_per_operation(self) -> float:
+        return self.queries / self.operations if self.operations else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "operations": self.operations,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.elapsed, 4),
+            "per_second": round(self.per_second, 2),
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(self.latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 3),
+            "queries_per_operation": round(self.queries_per_operation, 2),
+        }
+
+    def __str__(self) -> str:
+        data = self.as_dict()
+        return (
+            f"{data['name']}: {data['operations']} ops in {data['elapsed_seconds']}s "
+            f"({data['per_second']} ops/s, {data['errors']} errors) "
+            f"p50={data['p50_ms']}ms p95={data['p95_ms']}ms p99={data['p99_ms']}ms"
+            + (f" {data['queries_per_operation']} queries/op" if self.queries else "")
+        )
+
+
+def run_concurrently(name: str, operation: Callable[[int, int], None], threads: int = 1,
+                     iterations: int = 1, count_queries: bool = False) -> BenchmarkResult:
+    """
+    Run operation(thread_index, iteration) iterations times in each thread, all the threads
+    start at the same time. Each thread uses its own database connection, closed at the end.
+    With a single thread the operation runs in the current thread and connection.
+
+    Exceptions raised by the operation are counted as errors.
+
+    :param count_queries: count the queries of every operation (BenchmarkResult.queries),
+        it adds some overhead to each query
+    """
+    result = BenchmarkResult(name)
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(thread_index: int) -> None:
+        latencies = []
+        errors = 0
+        queries = 0
+        if threads > 1:
+            barrier.wait()
+        try:
+            for iteration in range(iterations):
+                start = time.perf_counter()
+                try:
+                    with CaptureQueriesContext(connection) if count_queries else nullcontext() as captured:
+                        operation(thread_index, iteration)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                queries += len(captured) if count_queries else 0
+        finally:
+            if threads > 1:
+                connection.close()
+        with lock:
+            result.latencies.extend(latencies)
+            result.errors += errors
+            result.queries += queries
+
+    start = time.perf_counter()
+    if threads == 1:
+        worker(0)
+    else:
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+async def run_async_concurrently(name: str, operation: Callable[[int], Awaitable[None]], concurrency: int = 1,
+                                 iterations: int = 1) -> BenchmarkResult:
+    """
+    Await operation(iteration) iterations times in the running event loop, with at most
+    concurrency operations in flight. Exceptions raised by the operation are counted as errors.
+    """
+    result = BenchmarkResult(name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(iteration: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await operation(iteration)
+            except Exception:
+                result.errors += 1
+                return
+            result.latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(iteration) for iteration in range(iterations)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def track_users(users: Iterable[User]) -> None:
+    created_user_ids.update(user.pk for user in users)
+
+
+def create_benchmark_user(**kwargs) -> User:
+    user = User.objects.create_user(username=f'{BENCHMARK_USERNAME_PREFIX}{uuid4().hex}', **kwargs)
+    track_users([user])
+    return user
+
+
+def create_benchmark_wallet(balance: Decimal = Decimal(0)) -> ClientWallet:
+    user = create_benchmark_user()
+    client_account = ClientAccount.objects.create(name='Benchmark', surname='Benchmark', user_account=user)
+    client_wallet = ClientWallet.objects.create(client_account=client_account)
+    if balance:
+        ClientWallet.objects.filter(pk=client_wallet.pk).update(balance=balance)
+        client_wallet.refresh_from_db()
+    return client_wallet
+
+
+def create_benchmark_users(count: int, account_every: int = 2, batch_size: int = 10000) -> None:
+    """
+    Bulk create count users without a usable password, one of every account_every has a
+    client account.
+    """
+    for start in range(0, count, batch_size):
+        users = User.objects.bulk_create([
+            User(username=f'{BENCHMARK_USERNAME_PREFIX}{uuid4().hex}', password='!')
+            for _ in range(min(batch_size, count - start))
+        ])
+        track_users(users)
+        ClientAccount.objects.bulk_create([
+            ClientAccount(name='Benchmark', surname='Benchmark', user_account=user)
+            for index, user in enumerate(users, start) if index % account_every == 0
+        ])
+
+
+@dataclass
+class BenchmarkUser:
+    user: User
+    wallet_ids: List[UUID] = field(default_factory=list)
+    # One transaction of each wallet
+    transaction_ids: List[UUID] = field(default_factory=list)
+
+
+def seed_benchmark_data(users: int, wallets_per_user: int, transactions_per_wallet: int,
+                        seed: Optional[int] = None, batch_size: int = 2000) -> List[BenchmarkUser]:
+    """
+    Bulk create users with a client account (Faker names and addresses), their wallets
+    and transactions. The first transaction of each wallet is an opening deposit of 1000,
+    the rest are small deposits and withdraws. Balances are set from the ledger at the end.
+    """
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    with transaction.atomic():
+        benchmark_users = [
+            BenchmarkUser(user) for user in User.objects.bulk_create([
+                User(username=f'{BENCHMARK_USERNAME_PREFIX}{uuid4().hex}', password='!',
+                     first_name=fake.first_name(), last_name=fake.last_name(), email=fake.email())
+                for _ in range(users)
+            ], batch_size=batch_size)
+        ]
+        track_users(benchmark_user.user for benchmark_user in benchmark_users)
+        client_accounts = ClientAccount.objects.bulk_create([
+            ClientAccount(
+                user_account=benchmark_user.user, name=benchmark_user.user.first_name,
+                surname=benchmark_user.user.last_name, city=fake.city(), postal_code=fake.postcode(),
+                state=fake.state(), public_username=fake.user_name(),
+            ) for benchmark_user in benchmark_users
+        ], batch_size=batch_size)
+        wallets = ClientWallet.objects.bulk_create([
+            ClientWallet(client_account=client_account)
+            for client_account in client_accounts for _ in range(wallets_per_user)
+        ], batch_size=batch_size)
+        for index, wallet in enumerate(wallets):
+            benchmark_users[index // wallets_per_user].wallet_ids.append(wallet.pk)
+
+        pending = []
+        for benchmark_user in benchmark_users:
+            for wallet_id in benchmark_user.wallet_ids:
+                for index in range(transactions_per_wallet):
+                    amount = Decimal(1000) if index == 0 else Decimal(rng.randint(1, 5000)) / 100
+                    if index % 3 == 2:
+                        amount = -amount
+                    pending.append(ClientWalletTransaction(
+                        client_wallet_account_id=wallet_id, amount=amount, description=fake.sentence(nb_words=4),
+                        transaction_type=ClientWalletTransaction.Type.from_amount(amount).value,
+                    ))
+                    if index == 0:
+                        benchmark_user.transaction_ids.append(pending[-1].pk)
+                if len(pending) >= batch_size:
+                    ClientWalletTransaction.objects.bulk_create(pending)
+                    pending = []
+        ClientWalletTransaction.objects.bulk_create(pending)
+        balance.set_ledger_balances(wallet.pk for wallet in wallets)
+    return benchmark_users
+
+
+def compare_results(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Regressions of results (BenchmarkResult.as_dict by name) against a baseline: lower
+    throughput or higher p95 latency beyond tolerance (ex. 0.2 = 20%), or half a query per
+    operation more (cached lookups make the average vary a little between runs).
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["per_second"] < previous["per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['per_second']} ops/s, baseline {previous['per_second']}")
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms, baseline {previous['p95_ms']}ms")
+        if result["queries_per_operation"] >= previous["queries_per_operation"] + 0.5:
+            regressions.append(
+                f"{name}: {result['queries_per_operation']} queries/op, baseline {previous['queries_per_operation']}"
+            )
+    return regressions
+
+
+def delete_benchmark_data() -> None:
+    """
+    Delete the users created by this process, their accounts, wallets and transactions are
+    deleted in cascade.
+    """
+    user_ids = sorted(created_user_ids)
+    for start in range(0, len(user_ids), DELETE_BATCH_SIZE):
+        User.objects.filter(pk__in=user_ids[start:start + DELETE_BATCH_SIZE]).delete()
+    created_user_ids.clear()
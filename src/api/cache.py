@@ -0,0 +1,111 @@
+"""
+Read-through cache of the wallet representation returned by the wallet detail endpoint.
+
+Entries are keyed by wallet id and store the owner user id, so the owner check of
+non-staff requests does not need the database either. Any change of a wallet deletes its
+entry when the database transaction commits (transaction.on_commit), the next read
+populates it again:
+    - balance updates, see api.balance.
+    - wallet saves and deletes, and owner account changes (signal receivers connected by
+      ApiConfig.ready).
+
+The cache backend is the WALLET_CACHE_ALIAS entry of the CACHES setting and must be
+shared by every process that changes wallets (web workers, the transactions worker, the
+management commands), ex. Redis. The invalidation only reaches the backend of the process
+that made the change, so with a per-process backend (local memory, the default) other
+processes would serve stale balances: the cache stays disabled until a shared backend is
+configured. WALLET_CACHE_TIMEOUT = 0 disables it too. Writes that skip the invalidation
+(raw SQL, another service) are served stale for up to WALLET_CACHE_TIMEOUT seconds.
+Hits and misses are counted in the same backend, see stats.
+
+* Docs
+** Cache framework: https://docs.djangoproject.com/en/5.2/topics/cache/
+** on_commit: https://docs.djangoproject.com/en/5.2/topics/db/transactions/#performing-actions-after-commit
+"""
+from typing import Optional
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+KEY_PREFIX = 'wallet:v1:'
+# Backends whose entries are private to each process
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+HITS_KEY = 'wallet:hits'
+MISSES_KEY = 'wallet:misses'
+
+
+def get_cache():
+    return caches[settings.WALLET_CACHE_ALIAS]
+
+
+def is_shared() -> bool:
+    return settings.CACHES[settings.WALLET_CACHE_ALIAS]['BACKEND'] not in LOCAL_BACKENDS
+
+
+def is_enabled() -> bool:
+    return bool(settings.WALLET_CACHE_TIMEOUT) and is_shared()
+
+
+def wallet_key(wallet_id: UUID) -> str:
+    return f'{KEY_PREFIX}{wallet_id}'
+
+
+def count(key: str) -> None:
+    try:
+        get_cache().incr(key)
+    except ValueError:
+        # First hit or miss, or the counter was evicted
+        get_cache().add(key, 1, timeout=None)
+
+
+def get_wallet(wallet_id: UUID) -> Optional[dict]:
+    """
+    :return: {"owner_id": user id, "data": wallet representation} or None on a miss
+    """
+    if not is_enabled():
+        return None
+    entry = get_cache().get(wallet_key(wallet_id))
+    count(MISSES_KEY if entry is None else HITS_KEY)
+    return entry
+
+
+def set_wallet(wallet_id: UUID, owner_id: int, data: dict) -> None:
+    if is_enabled():
+        get_cache().set(wallet_key(wallet_id), {"owner_id": owner_id, "data": data}, settings.WALLET_CACHE_TIMEOUT)
+
+
+def invalidate_wallet(wallet_id: UUID) -> None:
+    """
+    Delete the wallet entry when the current transaction commits (right away outside a
+    transaction), so readers can not cache the uncommitted balance. A read that fetched the
+    wallet just before the commit may still store the old one, WALLET_CACHE_TIMEOUT bounds
+    how long it is served.
+    """
+    if is_enabled():
+        transaction.on_commit(lambda: get_cache().delete(wallet_key(wallet_id)))
+
+
+def stats() -> dict:
+    counters = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return {
+        "enabled": is_enabled(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+    }
+
+
+def wallet_changed(sender, instance, **kwargs) -> None:
+    invalidate_wallet(instance.pk)
+
+
+def client_account_changed(sender, instance, created: bool = False, **kwargs) -> None:
+    if not created and is_enabled():
+        for wallet_id in instance.clientwallet_set.values_list('id', flat=True):
+            invalidate_wallet(wallet_id)
@@ -0,0 +1,115 @@
+"""
+Idempotency-Key header for POST endpoints.
+
+The first request with a key claims it (a row of IdempotencyKey, unique by user and key)
+inside the same atomic block as the view, and stores the response if it is a success:
+its status, body and the STORED_HEADERS it has (ex. the Location of a 202).
+A retry with the same key gets the stored response back without running the view, so it
+never touches the wallets again:
+    - a retry after the first request finished reads the stored response (one query).
+    - a concurrent retry waits on the unique key insert, not on the wallet lock, and then
+      reads the response stored by the first request.
+Error responses are not stored: the claim is rolled back and the key can be used again.
+Reusing a key with a different request body is rejected with a 422.
+
+Keys are kept at least WALLET_IDEMPOTENCY_KEY_TTL seconds, the purge_idempotency_keys
+command deletes the older ones.
+
+* Docs
+** Header draft: https://datatracker.ietf.org/doc/draft-ietf-httpapi-idempotency-key-header/
+"""
+import hashlib
+import json
+from functools import wraps
+from typing import Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+# Response headers replayed with the stored response
+STORED_HEADERS = ('Location', 'Content-Location', 'Retry-After', 'Preference-Applied')
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = f"This {HEADER} was already used with a different request."
+    default_code = 'idempotency_key_reused'
+
+
+def get_key(request: Request) -> Optional[str]:
+    """
+    :raise ValidationError: the key is too long
+    """
+    key = request.headers.get(HEADER)
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValidationError({HEADER: [f"Ensure this header has no more than {MAX_KEY_LENGTH} characters."]})
+    return key
+
+
+def request_hash(request: Request) -> str:
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def replay(request: Request, key: str) -> Optional[Response]:
+    """
+    :return: the stored response of this key, None if the key was not used
+    :raise IdempotencyKeyReused: the key was used with a different request
+    """
+    stored = IdempotencyKey.objects.filter(user_account_id=request.user.pk, key=key).only(
+        'request_hash', 'response_status', 'response_body', 'response_headers'
+    ).first()
+    if stored is None:
+        return None
+    if stored.request_hash != request_hash(request):
+        raise IdempotencyKeyReused
+    return Response(stored.response_body, status=stored.response_status, headers={
+        **(stored.response_headers or {}), REPLAYED_HEADER: 'true'
+    })
+
+
+def idempotent(view_method):
+    """
+    Decorator of viewset POST methods (create and actions), requests without the header
+    run as usual.
+    """
+    @wraps(view_method)
+    def wrapper(self, request: Request, *args, **kwargs) -> Response:
+        key = get_key(request)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        response = replay(request, key)
+        if response is not None:
+            return response
+
+        try:
+            with transaction.atomic():
+                claim = IdempotencyKey.objects.create(
+                    user_account_id=request.user.pk, key=key, request_hash=request_hash(request)
+                )
+                response = view_method(self, request, *args, **kwargs)
+                if status.is_success(response.status_code):
+                    IdempotencyKey.objects.filter(pk=claim.pk).update(
+                        response_status=response.status_code, response_body=response.data,
+                        response_headers={name: response[name] for name in STORED_HEADERS if response.has_header(name)},
+                    )
+                else:
+                    transaction.set_rollback(True)
+        except IntegrityError:
+            # A concurrent request with the same key committed first
+            response = replay(request, key)
+            if response is None:
+                raise
+        return response
+    return wrapper
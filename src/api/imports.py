@@ -0,0 +1,118 @@
+"""
+Transaction imports from CSV or JSON Lines (NDJSON), the formats written by api.exports,
+used by the import_transactions command to load the history of new customers.
+
+Rows are read lazily and handled in chunks: each chunk is validated with
+ClientWalletTransactionImportSerializer, its wallets are checked with one query and it is
+inserted with bulk inserts. Balances are not updated row by row: the balance of every
+touched wallet is recomputed once at the end from its ledger (balance.set_ledger_balances)
+and the snapshots that the imported rows made stale are deleted, build_wallet_snapshots
+takes them again.
+
+The creation date of ClientWalletTransaction is a default (not auto_now_add), so each
+row is written once by bulk_create with its imported date, or the import date.
+"""
+import csv
+import json
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, TextIO
+from uuid import UUID
+
+from . import balance
+from .exports import CHUNK_SIZE, FORMATS
+from .models import ClientWallet, ClientWalletSnapshot, ClientWalletTransaction
+from .serializers import ClientWalletTransactionImportSerializer, PrimaryKeyOnlyRelatedField
+
+
+class ImportRowError(Exception):
+    """
+    Raised for an invalid row, nothing of the import is saved when it is raised inside
+    the import transaction.
+    """
+
+    def __init__(self, row_number: int, errors):
+        super().__init__(f"Row {row_number}: {errors}")
+        self.row_number = row_number
+        self.errors = errors
+
+
+def read_rows(file: TextIO, input_format: str) -> Iterator[dict]:
+    """
+    Rows as dicts of field name to text. Empty CSV values are left out, so nullable
+    fields exported as empty values are imported as null.
+    """
+    if input_format not in FORMATS:
+        raise ValueError(f"Unknown import format '{input_format}', use one of: {', '.join(FORMATS)}")
+    if input_format == 'csv':
+        for row in csv.DictReader(file):
+            yield {name: value for name, value in row.items() if value != ''}
+        return
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def chunks(rows: Iterable[dict], chunk_size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_chunk(rows: List[dict], first_row_number: int) -> List[ClientWalletTransaction]:
+    """
+    :raise ImportRowError: the first invalid row, or a row of an unknown wallet
+    """
+    serializer = ClientWalletTransactionImportSerializer(data=rows, many=True)
+    if not serializer.is_valid():
+        index, errors = next((index, errors) for index, errors in enumerate(serializer.errors) if errors)
+        raise ImportRowError(first_row_number + index, errors)
+
+    transactions = [ClientWalletTransaction(**data) for data in serializer.validated_data]
+    wallet_ids = {transaction.client_wallet_account_id for transaction in transactions}
+    unknown_ids = wallet_ids - set(ClientWallet.objects.filter(id__in=wallet_ids).values_list('id', flat=True))
+    for index, transaction in enumerate(transactions):
+        if transaction.client_wallet_account_id in unknown_ids:
+            raise ImportRowError(first_row_number + index, {'client_wallet_account': [
+                PrimaryKeyOnlyRelatedField.default_error_messages['does_not_exist'].format(
+                    pk_value=transaction.client_wallet_account_id
+                )
+            ]})
+    return transactions
+
+
+def import_transactions(rows: Iterable[dict], chunk_size: int = CHUNK_SIZE, on_chunk=None) -> Dict[UUID, datetime]:
+    """
+    Validate and insert the rows, then recompute the balance of the touched wallets.
+    Must be called inside an atomic block, so an invalid row rolls the whole import back.
+
+    :param on_chunk: called with the number of rows imported so far after each chunk
+    :return: earliest imported creation date of each touched wallet
+    :raise ImportRowError: invalid row
+    """
+    earliest = {}
+    imported = 0
+    for chunk in chunks(rows, chunk_size):
+        transactions = validate_chunk(chunk, imported + 1)
+        ClientWalletTransaction.objects.bulk_create(transactions)
+        for transaction in transactions:
+            wallet_id = transaction.client_wallet_account_id
+            if wallet_id not in earliest or transaction.date_created < earliest[wallet_id]:
+                earliest[wallet_id] = transaction.date_created
+        imported += len(transactions)
+        if on_chunk is not None:
+            on_chunk(imported)
+
+    wallet_ids = list(earliest)
+    for start in range(0, len(wallet_ids), chunk_size):
+        batch = wallet_ids[start:start + chunk_size]
+        balance.set_ledger_balances(batch)
+        # Snapshots taken after an imported transaction do not include it
+        ClientWalletSnapshot.objects.filter(
+            client_wallet_id__in=batch, taken_at__gte=min(earliest[wallet_id] for wallet_id in batch)
+        ).delete()
+    return earliest
@@ -0,0 +1,91 @@
+"""
+Wallet ledger: the completed deposits and withdraws of a wallet, plus periodic balance
+snapshots so the balance at any date reads one snapshot and a bounded tail of transactions
+instead of every transaction of the wallet.
+
+Snapshots are built by the build_wallet_snapshots command, meant to run periodically
+(ex. a daily cron). The verify_wallet_ledger command compares the wallet balance with its
+ledger to detect drift.
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+from uuid import UUID
+
+from django.db.models import QuerySet, Sum
+from django.utils import timezone
+
+from .models import ClientWalletSnapshot, ClientWalletTransaction
+
+BALANCE_TYPES = [choice.value for choice in ClientWalletTransaction.Type if choice.affects_balance]
+
+
+def ledger_transactions(wallet_id: UUID) -> QuerySet:
+    return ClientWalletTransaction.objects.filter(
+        client_wallet_account_id=wallet_id, done=True, transaction_type__in=BALANCE_TYPES
+    )
+
+
+def latest_snapshot(wallet_id: UUID, moment: Optional[datetime] = None) -> Optional[ClientWalletSnapshot]:
+    snapshots = ClientWalletSnapshot.objects.filter(client_wallet_id=wallet_id)
+    if moment is not None:
+        snapshots = snapshots.filter(taken_at__lte=moment)
+    return snapshots.order_by('-taken_at').first()
+
+
+def balance_at(wallet_id: UUID, moment: Optional[datetime] = None) -> Decimal:
+    """
+    Balance of a wallet including every transaction created until moment (now by default).
+    """
+    moment = moment or timezone.now()
+    snapshot = latest_snapshot(wallet_id, moment)
+    tail = ledger_transactions(wallet_id).filter(date_created__lte=moment)
+    if snapshot is not None:
+        tail = tail.filter(date_created__gt=snapshot.taken_at)
+    amount = tail.aggregate(total=Sum('amount'))['total'] or Decimal(0)
+    return (snapshot.balance if snapshot is not None else Decimal(0)) + amount
+
+
+def build_snapshots(wallet_id: UUID, until: datetime, every: int = 0, daily: bool = False,
+                    chunk_size: int = 2000) -> List[ClientWalletSnapshot]:
+    """
+    Walk the transactions created after the latest snapshot and until the given date and
+    take a snapshot each time `every` transactions were added and/or, with daily, at the end
+    of each day. The transactions of the last snapshot are streamed with iterator, never
+    loaded all at once.
+
+    :return: the created snapshots
+    """
+    snapshot = latest_snapshot(wallet_id)
+    running_balance = snapshot.balance if snapshot else Decimal(0)
+    transaction_count = snapshot.transaction_count if snapshot else 0
+    transactions = ledger_transactions(wallet_id).filter(date_created__lte=until)
+    if snapshot is not None:
+        transactions = transactions.filter(date_created__gt=snapshot.taken_at)
+
+    snapshots = []
+    pending = 0
+    previous_date = None
+    for date_created, amount in transactions.order_by('date_created').values_list(
+        'date_created', 'amount'
+    ).iterator(chunk_size=chunk_size):
+        # Transactions created at the same time always belong to the same snapshot
+        if pending and date_created != previous_date and (
+            (every and pending >= every) or (daily and date_created.date() != previous_date.date())
+        ):
+            snapshots.append(ClientWalletSnapshot(
+                client_wallet_id=wallet_id, balance=running_balance,
+                transaction_count=transaction_count, taken_at=previous_date
+            ))
+            pending = 0
+        running_balance += amount
+        transaction_count += 1
+        pending += 1
+        previous_date = date_created
+
+    if pending and (pending >= every or daily):
+        snapshots.append(ClientWalletSnapshot(
+            client_wallet_id=wallet_id, balance=running_balance,
+            transaction_count=transaction_count, taken_at=previous_date
+        ))
+    return ClientWalletSnapshot.objects.bulk_create(snapshots)
@@ -0,0 +1,139 @@
+"""
+What a request does when the wallet it locks is already locked by another transaction.
+
+The strategy is the WALLET_LOCK_STRATEGY setting:
+    - wait: select_for_update waits until the lock is released, without a bound.
+    - timeout: the wait is bounded by WALLET_LOCK_TIMEOUT_MS (SET LOCAL lock_timeout, the
+      setting lasts until the end of the database transaction).
+    - nowait: select_for_update(nowait=True) fails right away.
+    - retry: like nowait, then the whole atomic block is run again up to
+      WALLET_LOCK_RETRIES times, after a random delay (full jitter) of up to
+      WALLET_LOCK_RETRY_DELAY_MS doubled on every attempt.
+A lock that is not acquired rolls the atomic block back and raises WalletLockedError,
+answered with a 409 and a Retry-After header of WALLET_LOCK_RETRY_AFTER seconds
+(WalletLocked). Request threads and database connections are released instead of piling
+up behind a hot wallet.
+
+Only the wallet locks of the request paths (record_transaction, transfer and bulk, see
+api.balance) follow the strategy, management commands always wait. The UPDATE statements
+of the atomic update mode still wait for the row lock, except under the timeout strategy
+when a lock_timeout was set by an earlier lock of the same transaction.
+
+The outcome of every write run by run_locked is counted in the wallet_lock_outcomes_total
+metric, by strategy: acquired, retried (an attempt failed and the block runs again) and
+locked (the request got a 409), see commons.instrumentation.
+
+Only PostgreSQL reports lock errors (SQLSTATE 55P03), SQLite has no row locks.
+
+* Docs
+** select_for_update: https://docs.djangoproject.com/en/5.2/ref/models/querysets/#select-for-update
+** lock_timeout: https://www.postgresql.org/docs/current/runtime-config-client.html#GUC-LOCK-TIMEOUT
+"""
+import random
+import time
+from typing import Callable, Optional, TypeVar
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connections
+from django.db.models import QuerySet
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from commons.instrumentation import metrics
+
+WAIT = 'wait'
+TIMEOUT = 'timeout'
+NOWAIT = 'nowait'
+RETRY = 'retry'
+STRATEGIES = (WAIT, TIMEOUT, NOWAIT, RETRY)
+
+ACQUIRED = 'acquired'
+RETRIED = 'retried'
+LOCKED = 'locked'
+
+# PostgreSQL lock_not_available, raised by NOWAIT and by lock_timeout
+LOCK_NOT_AVAILABLE = '55P03'
+
+T = TypeVar('T')
+
+metrics.describe('wallet_lock_outcomes_total', 'counter', 'Outcomes of the wallet writes by lock strategy.')
+
+
+class WalletLockedError(Exception):
+    """
+    Raised when a wallet lock was not acquired, after the retries of the retry strategy.
+    """
+    message = "The wallet is locked by another transaction, try again later"
+
+    def __init__(self):
+        super().__init__(self.message)
+
+
+class WalletLocked(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = WalletLockedError.message
+    default_code = 'wallet_locked'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # Sent as the Retry-After header by the rest framework exception handler
+        self.wait = settings.WALLET_LOCK_RETRY_AFTER
+
+
+def get_strategy(strategy: Optional[str] = None) -> str:
+    strategy = strategy or settings.WALLET_LOCK_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ImproperlyConfigured(
+            f"Unknown wallet lock strategy '{strategy}', use one of: {', '.join(STRATEGIES)}"
+        )
+    return strategy
+
+
+def lock(queryset: QuerySet, strategy: str = WAIT) -> QuerySet:
+    """
+    select_for_update of the queryset rows with the strategy. Must be called inside an
+    atomic block, the timeout strategy sets the lock_timeout of the transaction right away.
+    """
+    if strategy == TIMEOUT:
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT set_config('lock_timeout', %s, true)", [f'{settings.WALLET_LOCK_TIMEOUT_MS}ms']
+                )
+    return queryset.select_for_update(of=("self",), nowait=strategy in (NOWAIT, RETRY))
+
+
+def is_lock_error(error: OperationalError) -> bool:
+    cause = error.__cause__
+    # psycopg 3, then psycopg2
+    return LOCK_NOT_AVAILABLE in (getattr(cause, 'sqlstate', None), getattr(cause, 'pgcode', None))
+
+
+def count(strategy: str, outcome: str) -> None:
+    metrics.increment('wallet_lock_outcomes_total', (('strategy', strategy), ('outcome', outcome)))
+
+
+def run(function: Callable[[], T], strategy: str) -> T:
+    """
+    Run an atomic block that locks wallets with the strategy, see lock. Its atomic block
+    must be inside function, the retry strategy runs it again from the start.
+
+    :raise WalletLockedError: a wallet lock was not acquired
+    """
+    attempts = 1 + settings.WALLET_LOCK_RETRIES if strategy == RETRY else 1
+    for attempt in range(attempts):
+        try:
+            result = function()
+        except OperationalError as error:
+            if not is_lock_error(error):
+                raise
+            if attempt + 1 == attempts:
+                count(strategy, LOCKED)
+                raise WalletLockedError from error
+            count(strategy, RETRIED)
+            time.sleep(random.uniform(0, settings.WALLET_LOCK_RETRY_DELAY_MS * 2 ** attempt) / 1000)
+        else:
+            count(strategy, ACQUIRED)
+            return result
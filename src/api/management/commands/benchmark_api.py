@@ -0,0 +1,184 @@
+import json
+import platform
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.reverse import reverse
+
+from api.benchmarks import (
+    BenchmarkResult, BenchmarkUser, compare_results, create_benchmark_user, delete_benchmark_data,
+    run_concurrently, seed_benchmark_data,
+)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    A request of a benchmark user: request(user, iteration) returns (method, url, json body).
+    """
+    request: Callable[[BenchmarkUser, int], tuple]
+    status: int = 200
+    staff: bool = False
+
+
+def wallet(user: BenchmarkUser, iteration: int):
+    return user.wallet_ids[iteration % len(user.wallet_ids)]
+
+
+SCENARIOS = {
+    'username': Scenario(lambda user, iteration: ('get', reverse('get_username'), None)),
+    'client_id': Scenario(lambda user, iteration: ('get', reverse('get_client_id'), None)),
+    'num_accounts': Scenario(lambda user, iteration: ('get', reverse('get_num_accounts'), None), staff=True),
+    'wallet_list': Scenario(lambda user, iteration: ('get', reverse('api:client_wallet_api-list'), None)),
+    'wallet_detail': Scenario(lambda user, iteration: (
+        'get', reverse('api:client_wallet_api-detail', kwargs={'pk': wallet(user, iteration)}), None
+    )),
+    'balance_at': Scenario(lambda user, iteration: (
+        'get', reverse('api:client_wallet_api-balance-at', kwargs={'pk': wallet(user, iteration)}), None
+    )),
+    'transaction_list': Scenario(lambda user, iteration: (
+        'get', f"{reverse('api:client_wallet_transaction_api-list')}?client_wallet_account={wallet(user, iteration)}",
+        None
+    )),
+    'transaction_list_staff': Scenario(
+        lambda user, iteration: ('get', reverse('api:client_wallet_transaction_api-list'), None), staff=True
+    ),
+    'transaction_detail': Scenario(lambda user, iteration: (
+        'get', reverse('api:client_wallet_transaction_api-detail', kwargs={
+            'pk': user.transaction_ids[iteration % len(user.transaction_ids)]
+        }), None
+    )),
+    'transaction_export': Scenario(lambda user, iteration: (
+        'get', f"{reverse('api:client_wallet_transaction_api-export')}?output=ndjson"
+               f"&client_wallet_account={wallet(user, iteration)}", None
+    )),
+    'transaction_create': Scenario(lambda user, iteration: (
+        'post', reverse('api:client_wallet_transaction_api-list'),
+        {"amount": "1.00", "client_wallet_account": str(wallet(user, iteration)), "description": "Benchmark"}
+    ), status=201),
+    'transaction_bulk': Scenario(lambda user, iteration: (
+        'post', reverse('api:client_wallet_transaction_api-bulk'),
+        [{"amount": "1.00", "client_wallet_account": str(wallet_id)} for wallet_id in user.wallet_ids * 5]
+    ), status=201),
+    'transfer': Scenario(lambda user, iteration: (
+        'post', reverse('api:client_wallet_transaction_api-transfer'),
+        {"source_wallet": str(wallet(user, iteration)), "target_wallet": str(wallet(user, iteration + 1)),
+         "amount": "0.01"}
+    ), status=201),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark suite of the wallet api: seeds users, accounts, wallets and transactions "
+        "(Faker data), then sends each scenario from concurrent clients through the whole "
+        "Django stack (middlewares, urls, views). Reports requests/s, p50/p95/p99 latency and "
+        "queries per request, optionally stores them as JSON and compares them with a "
+        "previous JSON run. Seeded data is deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help="Seeded users, each with a client account")
+        parser.add_argument('--wallets-per-user', type=int, default=2)
+        parser.add_argument('--transactions-per-wallet', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=None, help="Faker and random seed")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent clients")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per client and scenario")
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument('--output', help="Store the results in this JSON file")
+        parser.add_argument('--compare', help="JSON file of a previous run, fail on regressions")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed throughput and p95 regression against --compare, 0.2 = 20%%")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['wallets_per_user'] < 2 or options['transactions_per_wallet'] < 1:
+            raise CommandError("At least 1 user, 2 wallets per user (transfers) and 1 transaction per wallet")
+        if connection.vendor != 'postgresql' and options['threads'] > 1:
+            self.stderr.write(self.style.WARNING(
+                f"Running against {connection.vendor}: concurrency results are not meaningful"
+            ))
+        baseline = self.load(options['compare']) if options['compare'] else None
+
+        started = time.perf_counter()
+        try:
+            users = seed_benchmark_data(
+                options['users'], options['wallets_per_user'], options['transactions_per_wallet'], options['seed']
+            )
+            self.stdout.write(f"Seeded {len(users)} users in {time.perf_counter() - started:.2f}s")
+            staff_user = create_benchmark_user(is_staff=True)
+            # The test client sends requests to the testserver host
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                results = [
+                    self.run_scenario(name, users, staff_user, options) for name in options['scenarios']
+                ]
+        finally:
+            delete_benchmark_data()
+
+        report = {
+            "meta": {
+                "date": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "django": django.get_version(),
+                "python": platform.python_version(),
+                **{name: options[name] for name in (
+                    'users', 'wallets_per_user', 'transactions_per_wallet', 'threads', 'requests'
+                )},
+            },
+            "results": {result.name: result.as_dict() for result in results},
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results stored in {options['output']}")
+        if baseline is not None:
+            self.compare(report, baseline, options['tolerance'])
+
+    def run_scenario(self, name: str, users: List[BenchmarkUser], staff_user: User, options: dict) -> BenchmarkResult:
+        scenario = SCENARIOS[name]
+        threads = options['threads']
+        # One logged in client per thread, each one a different benchmark user
+        thread_users = [users[index % len(users)] for index in range(threads)]
+        clients = []
+        for benchmark_user in thread_users:
+            client = Client()
+            client.force_login(staff_user if scenario.staff else benchmark_user.user)
+            clients.append(client)
+
+        def send(thread_index: int, iteration: int) -> None:
+            method, url, data = scenario.request(thread_users[thread_index], iteration)
+            if method == 'get':
+                response = clients[thread_index].get(url)
+            else:
+                response = clients[thread_index].post(url, data, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            if response.status_code != scenario.status:
+                raise RuntimeError(f"{name}: unexpected response {response.status_code}")
+
+        result = run_concurrently(name, send, threads, options['requests'], count_queries=True)
+        self.stdout.write(str(result))
+        return result
+
+    def load(self, path: str) -> Optional[dict]:
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Can not read the baseline {path}: {error}")
+
+    def compare(self, report: dict, baseline: dict, tolerance: float) -> None:
+        if baseline.get("meta", {}).get("database") != report["meta"]["database"]:
+            self.stderr.write(self.style.WARNING("The baseline ran against another database"))
+        regressions = compare_results(report["results"], baseline.get("results", {}), tolerance)
+        for regression in regressions:
+            self.stderr.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f"{len(regressions)} regressions against the baseline")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
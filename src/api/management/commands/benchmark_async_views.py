@@ -0,0 +1,68 @@
+import asyncio
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from rest_framework.reverse import reverse
+
+from api.benchmarks import BenchmarkResult, create_benchmark_wallet, delete_benchmark_data, run_async_concurrently
+
+# name: (sync url name, async url name, uses the benchmark wallet id)
+ENDPOINTS = {
+    'username': ('get_username', 'async_get_username', False),
+    'user_id': ('get_user_id', 'async_get_user_id', False),
+    'client_id': ('get_client_id', 'async_get_client_id', False),
+    'num_accounts': ('get_num_accounts', 'async_get_num_accounts', False),
+    'wallet_list': ('api:client_wallet_api-list', 'async_client_wallet_list', False),
+    'wallet_detail': ('api:client_wallet_api-detail', 'async_client_wallet_detail', True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests per second of the sync and the async version of each read endpoint, sent "
+        "concurrently to the ASGI application (the one uvicorn serves) from a single event loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint version")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight")
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+
+    def handle(self, *args, **options):
+        client_wallet = create_benchmark_wallet()
+        user = client_wallet.client_account.user_account
+        # Staff, so it can also call get_num_accounts
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                asyncio.run(self.run_endpoints(user, client_wallet.pk, options))
+        finally:
+            delete_benchmark_data()
+
+    async def run_endpoints(self, user: User, wallet_id, options: dict) -> None:
+        client = AsyncClient()
+        await client.aforce_login(user)
+        for name in options['endpoints']:
+            sync_name, async_name, with_wallet = ENDPOINTS[name]
+            kwargs = {'pk': wallet_id} if with_wallet else None
+            sync_result = await self.run_endpoint(
+                client, f"{name} sync", reverse(sync_name, kwargs=kwargs), options
+            )
+            async_result = await self.run_endpoint(
+                client, f"{name} async", reverse(async_name, kwargs=kwargs), options
+            )
+            if sync_result.per_second:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{name} async / sync throughput: {async_result.per_second / sync_result.per_second:.2f}x"
+                ))
+
+    async def run_endpoint(self, client: AsyncClient, name: str, url: str, options: dict) -> BenchmarkResult:
+        async def get(iteration: int) -> None:
+            response = await client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url}: unexpected response {response.status_code}")
+
+        result = await run_async_concurrently(name, get, options['concurrency'], options['requests'])
+        self.stdout.write(str(result))
+        return result
@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api import balance
+from api.benchmarks import BenchmarkResult, create_benchmark_wallet, delete_benchmark_data, run_concurrently
+from api.models import ClientWalletTransaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent deposits on a single hot wallet with each balance update mode "
+        "(lock: select_for_update + save, atomic: UPDATE ... SET balance = balance + amount)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent writers")
+        parser.add_argument('--transactions', type=int, default=200, help="Transactions per thread")
+        parser.add_argument('--modes', nargs='+', choices=balance.UPDATE_MODES, default=list(balance.UPDATE_MODES))
+        parser.add_argument('--shards', type=int, default=0,
+                            help="Also run each mode against a sharded wallet with this number of shards")
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        if connection.vendor != 'postgresql' and threads > 1:
+            self.stderr.write(self.style.WARNING(
+                f"Running against {connection.vendor}: concurrency results are not meaningful"
+            ))
+
+        scenarios = [(mode, 0) for mode in options['modes']]
+        if options['shards']:
+            scenarios += [(mode, options['shards']) for mode in options['modes']]
+        results = {}
+        try:
+            for mode, shard_count in scenarios:
+                results[(mode, shard_count)] = self.run_scenario(mode, shard_count, threads, options['transactions'])
+        finally:
+            delete_benchmark_data()
+
+        baseline = results.get((balance.LOCK, 0))
+        if baseline and baseline.per_second:
+            for scenario, result in results.items():
+                if scenario != (balance.LOCK, 0):
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{result.name} / {baseline.name} throughput: {result.per_second / baseline.per_second:.2f}x"
+                    ))
+
+    def run_scenario(self, mode: str, shard_count: int, threads: int, transactions: int) -> BenchmarkResult:
+        amount = Decimal('1.00')
+        client_wallet = create_benchmark_wallet()
+        if shard_count:
+            with transaction.atomic():
+                client_wallet = balance.collapse_shards(client_wallet.pk, shard_count=shard_count)
+        name = f"{mode}{f' {shard_count} shards' if shard_count else ''} x{threads}"
+
+        def deposit(thread_index: int, iteration: int) -> None:
+            balance.record_transaction(
+                client_wallet.pk, amount,
+                lambda locked_wallet: ClientWalletTransaction.objects.create(
+                    amount=amount, client_wallet_account=locked_wallet,
+                    transaction_type=ClientWalletTransaction.Type.DEPOSIT.value
+                ),
+                mode=mode
+            )
+
+        result = run_concurrently(name, deposit, threads, transactions)
+        self.stdout.write(str(result))
+
+        client_wallet.refresh_from_db()
+        expected = amount * result.operations
+        if client_wallet.total_balance != expected:
+            self.stderr.write(self.style.ERROR(
+                f"{name}: lost updates, balance {client_wallet.total_balance} != {expected}"
+            ))
+        return result
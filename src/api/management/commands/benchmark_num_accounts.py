@@ -0,0 +1,77 @@
+import time
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.benchmarks import (
+    BenchmarkResult, create_benchmark_user, create_benchmark_users, created_user_ids, delete_benchmark_data,
+    run_concurrently,
+)
+from api.views import GetNumClientAccounts
+
+
+class Command(BaseCommand):
+    help = (
+        "Pages of the get_num_accounts endpoint with a growing number of users: latency and "
+        "queries of the first page, with and without the has_account filter, and the time to "
+        "walk every page. Users are added between sizes, not recreated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help="Number of benchmark users of each run")
+        parser.add_argument('--requests', type=int, default=50, help="First page requests per scenario")
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--skip-walk', action='store_true', help="Do not request every page")
+
+    def handle(self, *args, **options):
+        self.view = GetNumClientAccounts.as_view()
+        self.factory = APIRequestFactory()
+        self.staff_user = create_benchmark_user(is_staff=True)
+        try:
+            # Pages link to the next one with an absolute url of the request host
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for users in sorted(options['users']):
+                    benchmark_users = len(created_user_ids)
+                    create_benchmark_users(users - benchmark_users)
+                    self.run_size(users, options)
+        finally:
+            delete_benchmark_data()
+
+    def get(self, data: dict) -> dict:
+        request = self.factory.get('/', data)
+        force_authenticate(request, user=self.staff_user)
+        response = self.view(request)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unexpected response {response.status_code}: {response.data}")
+        return response.data
+
+    def run_size(self, users: int, options: dict) -> None:
+        for name, data in (('first page', {}), ('has_account first page', {'has_account': 'true'})):
+            data = {'page_size': options['page_size'], **data}
+            result = run_concurrently(
+                f"{users} users {name}", lambda thread_index, iteration: self.get(data),
+                iterations=options['requests'], count_queries=True
+            )
+            self.stdout.write(str(result))
+        if not options['skip_walk']:
+            self.walk(users, options['page_size'])
+
+    def walk(self, users: int, page_size: int) -> BenchmarkResult:
+        result = BenchmarkResult(f"{users} users every page")
+        data = {'page_size': page_size}
+        rows = 0
+        started = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            page = self.get(data)
+            result.latencies.append(time.perf_counter() - start)
+            rows += len(page['results'])
+            if not page['next']:
+                break
+            data['cursor'] = parse_qs(urlparse(page['next']).query)['cursor'][0]
+        result.elapsed = time.perf_counter() - started
+        self.stdout.write(f"{result}, {rows} rows ({rows / result.elapsed if result.elapsed else 0:.0f} rows/s)")
+        return result
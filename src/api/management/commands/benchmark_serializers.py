@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.benchmarks import create_benchmark_wallet, delete_benchmark_data, run_concurrently
+from api.models import ClientWalletTransaction
+from api.serializers import ClientWalletTransactionSerializer
+from commons.serializers import ValuesSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serialization throughput of a list of transactions: ClientWalletTransactionSerializer over "
+        "model instances against ValuesSerializer over values() rows. Rows are fetched once, only "
+        "serialization (and JSON rendering) is timed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5, help="Serializations of the whole list per scenario")
+
+    def handle(self, *args, **options):
+        client_wallet = create_benchmark_wallet()
+        try:
+            ClientWalletTransaction.objects.bulk_create([
+                ClientWalletTransaction(
+                    client_wallet_account=client_wallet, amount=Decimal(index % 100) - Decimal('49.5'),
+                    transaction_type=ClientWalletTransaction.Type.DEPOSIT.value,
+                    description=f"Benchmark {index}" if index % 2 else None,
+                ) for index in range(options['transactions'])
+            ], batch_size=2000)
+            transactions = ClientWalletTransaction.objects.filter(client_wallet_account=client_wallet)
+            values_serializer = ValuesSerializer(ClientWalletTransactionSerializer)
+            instances = list(transactions)
+            rows = list(values_serializer.values(transactions))
+
+            model_result = self.run_scenario(
+                'model serializer', lambda: ClientWalletTransactionSerializer(instances, many=True).data, options
+            )
+            values_result = self.run_scenario('values serializer', lambda: values_serializer.many(rows), options)
+            if values_result.per_second:
+                speedup = values_result.per_second / model_result.per_second
+                self.stdout.write(self.style.SUCCESS(f"values / model serializer with render: {speedup:.2f}x"))
+        finally:
+            delete_benchmark_data()
+
+    def run_scenario(self, name: str, serialize, options: dict):
+        for render in (False, True):
+            result = run_concurrently(
+                f"{name}{' + render' if render else ''} x{options['transactions']}",
+                lambda thread_index, iteration: JSONRenderer().render(serialize()) if render else serialize(),
+                iterations=options['repeat']
+            )
+            self.stdout.write(f"{result} ({result.per_second * options['transactions']:.0f} rows/s)")
+        return result
@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api import balance
+from api.benchmarks import BenchmarkResult, create_benchmark_wallet, delete_benchmark_data, run_concurrently
+from api.views import ClientWalletTransactionSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Transactions created through the api create view by the wallet owner, with the "
+        "number of database queries of each request (authentication excluded)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=200, help="Transactions per mode")
+        parser.add_argument('--modes', nargs='+', choices=balance.UPDATE_MODES, default=list(balance.UPDATE_MODES))
+
+    def handle(self, *args, **options):
+        try:
+            for mode in options['modes']:
+                self.run_scenario(mode, options['transactions'])
+        finally:
+            delete_benchmark_data()
+
+    def run_scenario(self, mode: str, transactions: int) -> BenchmarkResult:
+        client_wallet = create_benchmark_wallet()
+        user = client_wallet.client_account.user_account
+        view = ClientWalletTransactionSet.as_view({'post': 'create'}, balance_update_mode=mode)
+        factory = APIRequestFactory()
+        payload = {"amount": "1.00", "client_wallet_account": str(client_wallet.pk)}
+
+        def create(thread_index: int, iteration: int) -> None:
+            request = factory.post('/', payload, format='json')
+            force_authenticate(request, user=user)
+            response = view(request)
+            if response.status_code != 201:
+                raise RuntimeError(f"Unexpected response {response.status_code}: {response.data}")
+
+        result = run_concurrently(f"create {mode}", create, iterations=transactions, count_queries=True)
+        self.stdout.write(str(result))
+
+        client_wallet.refresh_from_db()
+        expected = Decimal('1.00') * result.operations
+        if client_wallet.total_balance != expected:
+            self.stderr.write(self.style.ERROR(
+                f"{result.name}: lost updates, balance {client_wallet.total_balance} != {expected}"
+            ))
+        return result
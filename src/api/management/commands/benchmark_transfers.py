@@ -0,0 +1,70 @@
+import random
+import threading
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from api import balance
+from api.benchmarks import create_benchmark_wallet, delete_benchmark_data, run_concurrently
+from api.models import ClientWallet
+
+DEADLOCK_SQLSTATE = '40P01'
+
+
+def is_deadlock(error: OperationalError) -> bool:
+    cause = error.__cause__
+    return DEADLOCK_SQLSTATE in (getattr(cause, 'pgcode', None), getattr(cause, 'sqlstate', None))
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent transfers between a few wallets, in both directions, to check the "
+        "throughput of api.balance.transfer and that its ordered locking never deadlocks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent writers")
+        parser.add_argument('--transfers', type=int, default=200, help="Transfers per thread")
+        parser.add_argument('--wallets', type=int, default=2,
+                            help="Wallets shared by all the threads, fewer wallets means more contention")
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        if connection.vendor != 'postgresql' and threads > 1:
+            self.stderr.write(self.style.WARNING(
+                f"Running against {connection.vendor}: concurrency results are not meaningful"
+            ))
+        initial_balance = Decimal(options['transfers'] * threads)
+        try:
+            wallet_ids = [create_benchmark_wallet(initial_balance).pk for _ in range(max(options['wallets'], 2))]
+            self.run_transfers(wallet_ids, threads, options['transfers'], initial_balance)
+        finally:
+            delete_benchmark_data()
+
+    def run_transfers(self, wallet_ids: list, threads: int, transfers: int, initial_balance: Decimal) -> None:
+        deadlocks = []
+        lock = threading.Lock()
+
+        def transfer(thread_index: int, iteration: int) -> None:
+            source_id, target_id = random.sample(wallet_ids, 2)
+            try:
+                balance.transfer(source_id, target_id, Decimal('1.00'))
+            except OperationalError as error:
+                if is_deadlock(error):
+                    with lock:
+                        deadlocks.append(error)
+                raise
+
+        result = run_concurrently(f"transfer {len(wallet_ids)} wallets x{threads}", transfer, threads, transfers)
+        self.stdout.write(str(result))
+
+        total = ClientWallet.objects.filter(id__in=wallet_ids).aggregate(total=Sum('balance'))['total']
+        expected = initial_balance * len(wallet_ids)
+        if total != expected:
+            self.stderr.write(self.style.ERROR(f"{result.name}: money was lost, total {total} != {expected}"))
+        if deadlocks:
+            self.stderr.write(self.style.ERROR(f"{result.name}: {len(deadlocks)} deadlocks"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{result.name}: 0 deadlocks"))
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api import ledger
+from api.models import ClientWallet
+
+
+class Command(BaseCommand):
+    help = (
+        "Build wallet balance snapshots from the transactions created after the latest "
+        "snapshot of each wallet. Run it periodically, the first run builds the history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('wallets', nargs='*', help="Wallet ids, every wallet by default")
+        parser.add_argument('--every', type=int, default=settings.WALLET_SNAPSHOT_EVERY,
+                            help="Transactions between two snapshots")
+        parser.add_argument('--daily', action='store_true', help="Also take a snapshot at the end of each day")
+        parser.add_argument('--delay-seconds', type=int, default=60,
+                            help="Leave the newest transactions to the next run, they could still be committing")
+
+    def handle(self, *args, **options):
+        until = timezone.now() - timedelta(seconds=options['delay_seconds'])
+        wallets = ClientWallet.objects.order_by('id')
+        if options['wallets']:
+            wallets = wallets.filter(id__in=options['wallets'])
+
+        total = 0
+        for wallet_id in wallets.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                snapshots = ledger.build_snapshots(
+                    wallet_id, until, every=options['every'], daily=options['daily']
+                )
+            total += len(snapshots)
+            if snapshots:
+                self.stdout.write(f"{wallet_id}: {len(snapshots)} snapshots, balance {snapshots[-1].balance}")
+        self.stdout.write(self.style.SUCCESS(f"{total} snapshots created"))
@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily wallet statistics (deposits and withdraws per wallet and day) of "
+        "a range of days from their transactions, see api.stats. Run it periodically for "
+        "today and yesterday (default), with --since for the history and after backlogs of "
+        "the process_transactions worker older than yesterday."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help="First day (YYYY-MM-DD), the day before --until by default")
+        parser.add_argument('--until', type=date.fromisoformat, help="Last day (YYYY-MM-DD), today by default")
+
+    def handle(self, *args, **options):
+        until = options['until'] or timezone.localdate()
+        since = options['since'] or until - timedelta(days=1)
+        if since > until:
+            raise CommandError("--since must not be after --until")
+
+        total = 0
+        for day in stats.days(since, until):
+            wallets = stats.rebuild_day(day)
+            total += wallets
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{day}: {wallets} wallets")
+        self.stdout.write(self.style.SUCCESS(f"{total} wallet days built from {since} to {until}"))
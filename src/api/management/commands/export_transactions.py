@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import exports
+from api.models import ClientWalletTransaction
+from api.serializers import ClientWalletTransactionFilterSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Export transactions as CSV or JSON Lines, oldest first, with the filters of the "
+        "transactions api. Rows are streamed, memory use does not depend on the export size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--file', help="Output file, standard output by default")
+        parser.add_argument('--wallet', dest='client_wallet_account', help="Wallet id")
+        parser.add_argument('--type', dest='transaction_type', type=int,
+                            choices=ClientWalletTransaction.Type.values, help="Transaction type")
+        parser.add_argument('--after', dest='date_created_after', help="Created at or after this ISO 8601 date")
+        parser.add_argument('--before', dest='date_created_before', help="Created before this ISO 8601 date")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE, help="Rows fetched at once")
+
+    def handle(self, *args, **options):
+        filters = ClientWalletTransactionFilterSerializer(data={
+            name: options[name] for name in ClientWalletTransactionFilterSerializer.lookups
+            if options[name] is not None
+        })
+        if not filters.is_valid():
+            raise CommandError(filters.errors)
+        lines = exports.iter_lines(
+            filters.filter_queryset(ClientWalletTransaction.objects.all()), options['output'], options['chunk_size']
+        )
+        if not options['file']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['file'], 'w', newline='') as file:
+            file.writelines(lines)
+        self.stderr.write(self.style.SUCCESS(f"Transactions exported to {options['file']}"))
@@ -0,0 +1,52 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from api import exports, imports
+
+
+class Command(BaseCommand):
+    help = (
+        "Import transactions from CSV or JSON Lines (the export_transactions formats) in one "
+        "database transaction. Rows are streamed and inserted in chunks, the balance of each "
+        "touched wallet is recomputed once at the end. Run build_wallet_snapshots afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Input file, - for standard input")
+        parser.add_argument('--input', choices=list(exports.FORMATS),
+                            help="Input format, from the file extension by default (csv otherwise)")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE,
+                            help="Rows validated and inserted at once")
+
+    def handle(self, *args, **options):
+        input_format = options['input'] or (
+            'ndjson' if options['file'].endswith(('.ndjson', '.jsonl')) else 'csv'
+        )
+        self.verbosity = options['verbosity']
+        self.imported = 0
+        started = time.perf_counter()
+        file = sys.stdin if options['file'] == '-' else open(options['file'], newline='')
+        try:
+            with transaction.atomic():
+                wallets = imports.import_transactions(
+                    imports.read_rows(file, input_format), options['chunk_size'], on_chunk=self.report_chunk
+                )
+        except (imports.ImportRowError, IntegrityError, ValueError) as error:
+            raise CommandError(f"Nothing imported: {error}")
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.imported} transactions imported in {elapsed:.2f}s "
+            f"({self.imported / elapsed if elapsed else 0:.0f} rows/s), {len(wallets)} wallet balances recomputed"
+        ))
+
+    def report_chunk(self, imported: int) -> None:
+        self.imported = imported
+        if self.verbosity > 1:
+            self.stdout.write(f"{imported} transactions validated and inserted")
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import processing
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker of the asynchronous transactions (Prefer: respond-async): claims pending "
+        "transactions in batches with SELECT ... FOR UPDATE SKIP LOCKED, applies them to the "
+        "wallet balances and marks them done, see api.processing. Run one process per core "
+        "to scale, workers never claim the same transactions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=processing.BATCH_SIZE,
+                            help="Transactions claimed and applied in one database transaction")
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help="Seconds to wait when there are no pending transactions")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit when there are no pending transactions instead of waiting")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be 1 or greater")
+        processed = rejected = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                batch, batch_rejected = processing.process_batch(options['batch_size'])
+                processed += batch
+                rejected += batch_rejected
+                if batch and options['verbosity'] > 1:
+                    self.stdout.write(f"{batch} transactions processed, {batch_rejected} rejected")
+                if not batch:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} transactions processed in {elapsed:.2f}s "
+            f"({processed / elapsed if elapsed else 0:.0f}/s), {rejected} withdraws rejected"
+        ))
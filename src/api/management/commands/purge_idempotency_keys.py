@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the idempotency keys older than the TTL. Run it periodically so the key "
+        "table stays small, rows are deleted in batches to keep each statement short."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=settings.WALLET_IDEMPOTENCY_KEY_TTL,
+                            help="Seconds a key is kept")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Keys deleted by each statement")
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(date_created__lt=timezone.now() - timedelta(seconds=options['ttl']))
+        total = 0
+        while True:
+            batch = list(expired.values_list('id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted, _ = IdempotencyKey.objects.filter(id__in=batch).delete()
+            total += deleted
+        self.stdout.write(self.style.SUCCESS(f"{total} idempotency keys deleted"))
@@ -0,0 +1,39 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import balance
+from api.models import ClientWallet
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the balance of the wallet shards into the wallet balance. "
+        "With --shards it also enables (N > 0), resizes or disables (0) the sharded mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('wallets', nargs='*', help="Wallet ids")
+        parser.add_argument('--all', action='store_true', help="Every sharded wallet")
+        parser.add_argument('--shards', type=int, default=None, help="New number of shards, 0 disables sharding")
+
+    def handle(self, *args, **options):
+        shard_count = options['shards']
+        if shard_count is not None and shard_count < 0:
+            raise CommandError("--shards must be 0 or greater")
+        if options['all']:
+            wallet_ids = list(ClientWallet.objects.filter(shard_count__gt=0).values_list('id', flat=True))
+        elif options['wallets']:
+            wallet_ids = options['wallets']
+        else:
+            raise CommandError("Set wallet ids or --all")
+
+        for wallet_id in wallet_ids:
+            try:
+                with transaction.atomic():
+                    client_wallet = balance.collapse_shards(wallet_id, shard_count=shard_count)
+            except (ClientWallet.DoesNotExist, ValidationError) as error:
+                raise CommandError(f"Wallet {wallet_id}: {error}")
+            self.stdout.write(
+                f"{client_wallet.id}: balance {client_wallet.balance}, {client_wallet.shard_count} shards"
+            )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import ledger
+from api.models import ClientWallet
+
+
+class Command(BaseCommand):
+    help = "Compare each wallet balance with the balance of its ledger (snapshot plus transactions)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('wallets', nargs='*', help="Wallet ids, every wallet by default")
+
+    def handle(self, *args, **options):
+        wallets = ClientWallet.objects.with_total_balance().order_by('id')
+        if options['wallets']:
+            wallets = wallets.filter(id__in=options['wallets'])
+
+        checked = 0
+        drifted = 0
+        for client_wallet in wallets.iterator():
+            checked += 1
+            ledger_balance = ledger.balance_at(client_wallet.id)
+            if ledger_balance != client_wallet.total_balance:
+                drifted += 1
+                self.stdout.write(self.style.WARNING(
+                    f"{client_wallet.id}: balance {client_wallet.total_balance}, ledger {ledger_balance}, "
+                    f"drift {client_wallet.total_balance - ledger_balance}"
+                ))
+        if drifted:
+            raise CommandError(f"{drifted} of {checked} wallets drifted from their ledger")
+        self.stdout.write(self.style.SUCCESS(f"{checked} wallets match their ledger"))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:36
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_clientwallettransaction_transaction_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientwallet',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Number of balance shards, 0 disables the sharded mode'),
+        ),
+        migrations.CreateModel(
+            name='ClientWalletShard',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=65)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+                ('client_wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='api.clientwallet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('client_wallet', 'index'), name='unique_client_wallet_shard_index')],
+            },
+        ),
+    ]
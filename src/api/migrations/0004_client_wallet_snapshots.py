@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:38
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_client_wallet_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientWalletSnapshot',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('balance', models.DecimalField(decimal_places=2, editable=False, max_digits=65)),
+                ('transaction_count', models.PositiveIntegerField(editable=False, help_text='Number of transactions included in this snapshot')),
+                ('taken_at', models.DateTimeField(help_text='Transactions created until this date are included')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('client_wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='api.clientwallet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('client_wallet', 'taken_at'), name='unique_client_wallet_snapshot')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_client_wallet_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientwallettransaction',
+            index=models.Index(fields=['client_wallet_account', 'date_created', 'id'], name='api_tx_wallet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientwallettransaction',
+            index=models.Index(fields=['transaction_type', 'date_created', 'id'], name='api_tx_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientwallettransaction',
+            index=models.Index(fields=['date_created', 'id'], name='api_tx_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientwallettransaction',
+            index=models.Index(condition=models.Q(('done', False)), fields=['date_created'], name='api_tx_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientwallettransaction',
+            index=models.Index(condition=models.Q(('transaction_type', 0)), fields=['client_wallet_account', 'date_created'], name='api_tx_error_idx'),
+        ),
+        migrations.AlterField(
+            model_name='clientwallettransaction',
+            name='client_wallet_account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.clientwallet'),
+        ),
+    ]
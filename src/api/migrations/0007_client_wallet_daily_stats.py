@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:17
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientWalletDailyStats',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('deposits_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('deposits_total', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=65)),
+                ('withdrawals_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('withdrawals_total', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=65)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+                ('client_wallet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='api.clientwallet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='api_wallet_stats_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('client_wallet', 'day'), name='unique_client_wallet_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_idempotency_key_response_headers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='clientwallettransaction',
+            name='date_created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
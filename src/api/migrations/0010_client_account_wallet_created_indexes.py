@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_client_wallet_transaction_date_created_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientaccount',
+            index=models.Index(fields=['date_created', 'id'], name='api_account_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientwallet',
+            index=models.Index(fields=['date_created', 'id'], name='api_wallet_created_idx'),
+        ),
+    ]
@@ -1,7 +1,12 @@
+from decimal import Decimal
 from uuid import uuid4
 
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 
 class Account(models.Model):
@@ -33,6 +38,12 @@ class ClientAccount(Account):
     name = models.CharField(max_length=50, unique=False, help_text="Ex. John")
     surname = models.CharField(max_length=100, unique=False, help_text="Ex. Doe")
 
+    class Meta:
+        indexes = [
+            # Cursor pagination of the account lists, see commons.pagination
+            models.Index(fields=('date_created', 'id'), name='api_account_created_idx'),
+        ]
+
 
 class Wallet(models.Model):
     """
@@ -51,15 +62,77 @@ class Wallet(models.Model):
         abstract = True
 
 
+class ClientWalletQuerySet(models.QuerySet):
+
+    def with_total_balance(self):
+        """
+        Annotate the total balance (wallet balance plus shards balance) as computed_balance,
+        so total_balance does not need a query per sharded wallet.
+        """
+        balance_field = ClientWallet._meta.get_field('balance')
+        shards_balance = ClientWalletShard.objects.filter(
+            client_wallet=OuterRef('pk')
+        ).values('client_wallet').annotate(total=Sum('balance')).values('total')
+        return self.annotate(computed_balance=ExpressionWrapper(
+            F('balance') + Coalesce(Subquery(shards_balance), Value(Decimal(0)), output_field=balance_field),
+            output_field=balance_field
+        ))
+
+
 class ClientWallet(Wallet):
     """
     Client account is the only required field, the other will be filled from transactions.
+
+    Sharded mode (shard_count > 0) is meant for wallets with many concurrent deposits:
+    deposits are added to one of the wallet shards chosen at random instead of to the wallet
+    row, so they do not wait for each other. The wallet balance is the balance field plus
+    the balance of its shards. See api.balance.
     """
     client_account = models.ForeignKey(ClientAccount, on_delete=models.CASCADE)
+    shard_count = models.PositiveSmallIntegerField(
+        default=0, editable=False, help_text="Number of balance shards, 0 disables the sharded mode"
+    )
+
+    objects = ClientWalletQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Cursor pagination of the wallet lists, see commons.pagination
+            models.Index(fields=('date_created', 'id'), name='api_wallet_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.client_account.user_account.username} - {self.id}'
 
+    @property
+    def total_balance(self) -> Decimal:
+        computed_balance = getattr(self, 'computed_balance', None)
+        if computed_balance is not None:
+            return computed_balance
+        if not self.shard_count:
+            return self.balance
+        return self.balance + (self.shards.aggregate(total=Sum('balance'))['total'] or 0)
+
+
+class ClientWalletShard(models.Model):
+    """
+    Sub-balance of a sharded wallet. Rows are managed by api.balance and the
+    rebalance_wallet_shards command.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    client_wallet = models.ForeignKey(ClientWallet, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=65, decimal_places=2, default=0, editable=False)
+    last_update = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('client_wallet', 'index'), name='unique_client_wallet_shard_index'),
+        ]
+
+    def __str__(self):
+        return f'{self.client_wallet_id} - {self.index}'
+
 
 class WalletTransaction(models.Model):
     """
@@ -73,6 +146,23 @@ class WalletTransaction(models.Model):
         TESTING = 1
         DEPOSIT = 2
         WITHDRAW = 3
+
+        @classmethod
+        def from_amount(cls, amount) -> 'WalletTransaction.Type':
+            """
+            Positive amounts are deposits, negative amounts are withdraws and
+            zero amounts are only used for testing.
+            """
+            if amount > 0:
+                return cls.DEPOSIT
+            if amount < 0:
+                return cls.WITHDRAW
+            return cls.TESTING
+
+        @property
+        def affects_balance(self) -> bool:
+            return self not in (self.TESTING, self.ERROR)
+
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     description = models.CharField(max_length=250, null=True, blank=True, unique=False,
                                    help_text="Transaction description")
@@ -86,8 +176,10 @@ class WalletTransaction(models.Model):
     extra_info = models.TextField(
         null=True, blank=True, unique=False, help_text="Extra info about this transaction"
     )
-    date_created = models.DateTimeField(auto_now_add=True, unique=False)
-    client_wallet_account = models.ForeignKey(ClientWallet, on_delete=models.CASCADE)
+    # Not auto_now_add, so imported transactions are inserted once with their own date (see api.imports)
+    date_created = models.DateTimeField(default=timezone.now, editable=False)
+    # Not indexed alone, concrete models index it with date_created for the list access path
+    client_wallet_account = models.ForeignKey(ClientWallet, on_delete=models.CASCADE, db_index=False)
 
     def __str__(self):
         return f'{self.client_wallet_account.client_account.user_account.username} - {self.id}'
@@ -100,3 +192,98 @@ class ClientWalletTransaction(WalletTransaction):
 
     def __str__(self):
         return "%s" % (self.client_wallet_account.__str__())
+
+    class Meta:
+        # Access paths of the lists (newest first), filters and exports:
+        #   - wallet: regular users and ?client_wallet_account= filter.
+        #   - type: ?transaction_type= filter.
+        #   - date: staff list and date range filters.
+        #   - pending (done=False) and error transactions are few, partial indexes keep them small.
+        indexes = [
+            models.Index(fields=('client_wallet_account', 'date_created', 'id'), name='api_tx_wallet_created_idx'),
+            models.Index(fields=('transaction_type', 'date_created', 'id'), name='api_tx_type_created_idx'),
+            models.Index(fields=('date_created', 'id'), name='api_tx_created_idx'),
+            models.Index(fields=('date_created',), name='api_tx_pending_idx', condition=models.Q(done=False)),
+            models.Index(
+                fields=('client_wallet_account', 'date_created'), name='api_tx_error_idx',
+                condition=models.Q(transaction_type=WalletTransaction.Type.ERROR)
+            ),
+        ]
+
+
+class ClientWalletSnapshot(models.Model):
+    """
+    Balance checkpoint of a wallet: the sum of its completed deposits and withdraws created
+    until taken_at. The balance at any date is the latest snapshot before that date plus the
+    transactions created after it, see api.ledger.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    client_wallet = models.ForeignKey(ClientWallet, on_delete=models.CASCADE, related_name='snapshots')
+    balance = models.DecimalField(max_digits=65, decimal_places=2, editable=False)
+    transaction_count = models.PositiveIntegerField(
+        editable=False, help_text="Number of transactions included in this snapshot"
+    )
+    taken_at = models.DateTimeField(help_text="Transactions created until this date are included")
+    date_created = models.DateTimeField(auto_now_add=True, unique=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('client_wallet', 'taken_at'), name='unique_client_wallet_snapshot'),
+        ]
+
+    def __str__(self):
+        return f'{self.client_wallet_id} - {self.taken_at}'
+
+
+class ClientWalletDailyStats(models.Model):
+    """
+    Completed deposits and withdraws of a wallet created during a day (TIME_ZONE setting),
+    rolled up by the build_wallet_stats command, see api.stats. Withdraw totals are
+    positive amounts.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    # Indexed by unique_client_wallet_day
+    client_wallet = models.ForeignKey(
+        ClientWallet, on_delete=models.CASCADE, related_name='daily_stats', db_index=False
+    )
+    day = models.DateField()
+    deposits_count = models.PositiveIntegerField(default=0, editable=False)
+    deposits_total = models.DecimalField(max_digits=65, decimal_places=2, default=0, editable=False)
+    withdrawals_count = models.PositiveIntegerField(default=0, editable=False)
+    withdrawals_total = models.DecimalField(max_digits=65, decimal_places=2, default=0, editable=False)
+    last_update = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('client_wallet', 'day'), name='unique_client_wallet_day'),
+        ]
+        # Rollups of every wallet by day, for the staff dashboards and the rebuild of a day
+        indexes = [models.Index(fields=('day',), name='api_wallet_stats_day_idx')]
+
+    def __str__(self):
+        return f'{self.client_wallet_id} - {self.day}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response of a POST sent with an Idempotency-Key header. A retry with the same key
+    gets this response back without running the request again, see api.idempotency.
+    Keys are deleted by the purge_idempotency_keys command.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    # Indexed by unique_user_idempotency_key
+    user_account = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the request method, path and body")
+    response_status = models.PositiveSmallIntegerField(null=True, editable=False)
+    response_body = models.JSONField(null=True, editable=False, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(null=True, editable=False)
+    date_created = models.DateTimeField(auto_now_add=True, unique=False, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('user_account', 'key'), name='unique_user_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_account_id} - {self.key}'
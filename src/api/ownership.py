@@ -0,0 +1,135 @@
+"""
+Client account and wallets owned by the request user, resolved once per request with a
+single query (ClientOwnershipMiddleware sets request.client_ownership, evaluated lazily)
+instead of joining the account table in every query that filters by owner.
+
+Optionally, the ownership is also cached across requests for WALLET_OWNERSHIP_CACHE_TIMEOUT
+seconds (0, the default, disables it) in the WALLET_CACHE_ALIAS cache. It needs a backend
+shared by every process (ex. Redis): the invalidation only reaches the backend of the
+process that made the change, so it stays disabled with a per-process backend (local
+memory). Otherwise other processes would answer 404 for new accounts and wallets, and
+let the previous owner reach a reassigned wallet. Cached ownerships are discarded when:
+    - creating an account or a wallet deletes the cached ownership of its owner.
+    - changes that could move accounts or wallets to another user (account saves and
+      deletes, wallet saves of all fields and deletes) bump a generation number that is
+      part of every key, so every cached ownership is discarded. They are rare.
+The receivers are connected by ApiConfig.ready and run when the transaction commits.
+"""
+from dataclasses import dataclass, field
+from typing import FrozenSet, Optional
+from uuid import UUID
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+
+from . import cache
+from .models import ClientAccount, ClientWallet
+
+GENERATION_KEY = 'ownership:generation'
+
+
+@dataclass(frozen=True)
+class ClientOwnership:
+    client_account_id: Optional[UUID] = None
+    wallet_ids: FrozenSet[UUID] = field(default_factory=frozenset)
+
+
+def is_cached() -> bool:
+    return bool(settings.WALLET_OWNERSHIP_CACHE_TIMEOUT) and cache.is_shared()
+
+
+def ownership_key(user_id: int, generation: int) -> str:
+    return f'ownership:{generation}:{user_id}'
+
+
+def load_ownership(user_id: int) -> ClientOwnership:
+    rows = ClientAccount.objects.filter(user_account_id=user_id).values_list('id', 'clientwallet__id')
+    if not rows:
+        return ClientOwnership()
+    return ClientOwnership(
+        client_account_id=rows[0][0], wallet_ids=frozenset(wallet_id for _, wallet_id in rows if wallet_id)
+    )
+
+
+def get_ownership(user_id: Optional[int]) -> ClientOwnership:
+    if user_id is None:
+        return ClientOwnership()
+    if not is_cached():
+        return load_ownership(user_id)
+    generation = cache.get_cache().get(GENERATION_KEY, 0)
+    key = ownership_key(user_id, generation)
+    ownership = cache.get_cache().get(key)
+    if ownership is None:
+        ownership = load_ownership(user_id)
+        cache.get_cache().set(key, ownership, settings.WALLET_OWNERSHIP_CACHE_TIMEOUT)
+    return ownership
+
+
+def for_request(request) -> ClientOwnership:
+    """
+    Ownership of the request user, requests that did not go through the middleware
+    (ex. built with a request factory) resolve it here.
+    """
+    ownership = getattr(request, 'client_ownership', None)
+    if ownership is None:
+        ownership = get_ownership(request.user.pk)
+        request.client_ownership = ownership
+    return ownership
+
+
+def invalidate_user(user_id: int) -> None:
+    if is_cached():
+        transaction.on_commit(lambda: cache.get_cache().delete(
+            ownership_key(user_id, cache.get_cache().get(GENERATION_KEY, 0))
+        ))
+
+
+def invalidate_all() -> None:
+    def bump():
+        try:
+            cache.get_cache().incr(GENERATION_KEY)
+        except ValueError:
+            cache.get_cache().set(GENERATION_KEY, 1, timeout=None)
+    if is_cached():
+        transaction.on_commit(bump)
+
+
+def client_account_changed(sender, instance, created: bool = False, **kwargs) -> None:
+    if created:
+        invalidate_user(instance.user_account_id)
+    else:
+        invalidate_all()
+
+
+def wallet_changed(sender, instance, created: bool = False, update_fields=None, **kwargs) -> None:
+    if created:
+        if ClientWallet.client_account.is_cached(instance):
+            invalidate_user(instance.client_account.user_account_id)
+        else:
+            invalidate_user(ClientAccount.objects.filter(id=instance.client_account_id).values_list(
+                'user_account_id', flat=True
+            ).first())
+    elif update_fields is None or 'client_account' in update_fields:
+        invalidate_all()
+
+
+class ClientOwnershipMiddleware:
+    """
+    Must be placed after the AuthenticationMiddleware. The ownership is resolved on first
+    access, after the rest framework authentication replaced request.user.
+    It supports async requests, so it does not add a thread hop to the async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.client_ownership = SimpleLazyObject(lambda: get_ownership(request.user.pk))
+        # The response of an async get_response is a coroutine, awaited by the caller
+        return self.get_response(request)
@@ -0,0 +1,135 @@
+"""
+Asynchronous transaction processing: accept transactions fast, apply balances later.
+
+A transaction POST with the `Prefer: respond-async` header (RFC 7240) is only validated,
+its wallet owner checked and the row inserted with done=False, without locking the wallet;
+the response is a 202 with the pending transaction and its Location. Pending transactions
+are not in the ledger (api.ledger) until they are done.
+
+The process_transactions command is the worker. Each batch, in one atomic block:
+    - claims up to batch_size pending transactions, oldest first, with
+      SELECT ... FOR UPDATE SKIP LOCKED: concurrent workers claim disjoint batches instead
+      of waiting for each other, so workers scale with the number of processes (one per
+      core) until they contend on the same wallets.
+    - locks the wallets of the batch with one query, in id order (see balance.lock_wallets).
+    - applies the sum of each wallet amounts with one balance update per wallet. Like the
+      synchronous writes (see api.balance), in atomic mode (WALLET_BALANCE_UPDATE_MODE)
+      withdraws that would leave the wallet with a negative balance are rejected one by
+      one, in creation order: they become ERROR transactions with an error message. In
+      lock mode they are applied, so the balance may go negative.
+    - flips the batch to done=True with bulk_update and deletes the snapshots of the
+      wallets taken after their oldest processed transaction (they did not include it),
+      build_wallet_snapshots takes them again.
+
+Withdraws of different batches are checked in the order the batches commit, which is the
+creation order when a single worker runs.
+
+* Docs
+** Prefer header: https://www.rfc-editor.org/rfc/rfc7240#section-4.1
+** SKIP LOCKED: https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.request import Request
+
+from . import balance
+from .models import ClientWallet, ClientWalletSnapshot, ClientWalletTransaction
+
+PREFER_HEADER = 'Prefer'
+RESPOND_ASYNC = 'respond-async'
+PREFERENCE_APPLIED_HEADER = 'Preference-Applied'
+
+BATCH_SIZE = 500
+
+
+def prefers_async(request: Request) -> bool:
+    """
+    The Prefer header has the respond-async preference, ex. `Prefer: respond-async, wait=5`.
+    """
+    preferences = request.headers.get(PREFER_HEADER, '')
+    return any(
+        preference.split(';')[0].split('=')[0].strip().lower() == RESPOND_ASYNC
+        for preference in preferences.split(',')
+    )
+
+
+def claim_pending(batch_size: int) -> List[ClientWalletTransaction]:
+    """
+    Lock the oldest pending transactions not claimed by other workers. Must be called
+    inside an atomic block.
+    """
+    return list(
+        ClientWalletTransaction.objects.filter(done=False).order_by('date_created').only(
+            'id', 'client_wallet_account_id', 'amount', 'transaction_type', 'done', 'error_msg', 'date_created'
+        ).select_for_update(skip_locked=True)[:batch_size]
+    )
+
+
+def apply_wallet(client_wallet: ClientWallet, transactions: List[ClientWalletTransaction], guard: bool = True) -> int:
+    """
+    Apply the transactions of a locked wallet, oldest first, and mark them done.
+
+    :param guard: reject the withdraws that would leave a negative balance
+    :return: number of rejected withdraws
+    """
+    if guard and client_wallet.shard_count and any(pending.amount < 0 for pending in transactions):
+        # The whole balance is needed to check the withdraws
+        client_wallet = balance.collapse_shards(client_wallet.pk)
+    delta = Decimal(0)
+    rejected = 0
+    for pending in transactions:
+        pending.done = True
+        if not ClientWalletTransaction.Type(pending.transaction_type).affects_balance:
+            continue
+        if guard and pending.amount < 0 and client_wallet.balance + delta + pending.amount < 0:
+            pending.transaction_type = ClientWalletTransaction.Type.ERROR.value
+            pending.error_msg = balance.NegativeBalanceError.message
+            rejected += 1
+            continue
+        delta += pending.amount
+    if delta:
+        balance.add_amount(client_wallet, delta, mode=balance.LOCK)
+    return rejected
+
+
+def process_batch(batch_size: int = BATCH_SIZE, mode: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Claim and apply a batch of pending transactions in one atomic block.
+
+    :param mode: balance update mode whose negative balance rule is applied,
+        WALLET_BALANCE_UPDATE_MODE setting by default
+    :return: number of processed transactions and number of rejected withdraws
+    """
+    guard = balance.get_update_mode(mode) == balance.ATOMIC
+    with transaction.atomic():
+        pending = claim_pending(batch_size)
+        if not pending:
+            return 0, 0
+        by_wallet: Dict[UUID, List[ClientWalletTransaction]] = defaultdict(list)
+        for pending_transaction in pending:
+            by_wallet[pending_transaction.client_wallet_account_id].append(pending_transaction)
+        wallets = balance.lock_wallets(ClientWallet.objects.filter(id__in=by_wallet))
+        rejected = sum(
+            apply_wallet(client_wallet, by_wallet[client_wallet.pk], guard) for client_wallet in wallets
+        )
+
+        ClientWalletTransaction.objects.bulk_update(pending, ['done', 'transaction_type', 'error_msg'])
+        earliest: Dict[UUID, datetime] = {
+            wallet_id: transactions[0].date_created for wallet_id, transactions in by_wallet.items()
+        }
+        ClientWalletSnapshot.objects.filter(reduce(or_, (
+            Q(client_wallet_id=wallet_id, taken_at__gte=date_created) for wallet_id, date_created in earliest.items()
+        ))).delete()
+    return len(pending), rejected
+
+
+def pending_count() -> int:
+    return ClientWalletTransaction.objects.filter(done=False).count()
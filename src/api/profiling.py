@@ -0,0 +1,133 @@
+"""
+Phase timing of the wallet write path, aggregated per wallet to find contention hotspots.
+
+A transaction POST (ClientWalletTransactionSet.create) goes through these phases, timed
+one after the other by a WriteProfile:
+    - validation: the request serializer.
+    - lock: the query that fetches the wallet and checks its owner. In lock mode it also
+      locks the wallet row, so it includes the wait for concurrent writers of the wallet.
+    - balance: the balance update. In atomic mode, and for sharded wallets, the row lock is
+      taken here by the UPDATE statement instead.
+    - insert: the transaction INSERT.
+    - commit: the commit (a savepoint release when the request has an Idempotency-Key).
+
+Successful writes are aggregated per wallet in the memory of each process, at most
+WALLET_PROFILE_MAX_WALLETS wallets (0 disables it): when full, the wallet with the least
+total time is dropped. Staff users get the hottest wallets from the hot_wallets endpoint,
+a wallet spending most of its time waiting for the lock is a candidate for the atomic mode
+or for shards, see api.balance. The phase durations of all the wallets are also exposed as
+the wallet_write_phase_seconds histogram, see commons.instrumentation.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from django.conf import settings
+
+from commons.instrumentation import metrics
+
+VALIDATION = 'validation'
+LOCK = 'lock'
+BALANCE = 'balance'
+INSERT = 'insert'
+COMMIT = 'commit'
+PHASES = (VALIDATION, LOCK, BALANCE, INSERT, COMMIT)
+
+PHASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+metrics.describe('wallet_write_phase_seconds', 'histogram', 'Duration of each phase of the transaction writes.')
+
+
+class WriteProfile:
+    """
+    Durations of the sequential phases of a write: mark starts a phase and ends the
+    previous one.
+    """
+
+    def __init__(self):
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.phase: Optional[str] = None
+        self.started = 0.0
+
+    def mark(self, phase: Optional[str]) -> None:
+        now = time.perf_counter()
+        if self.phase is not None:
+            self.durations[self.phase] += now - self.started
+        self.phase, self.started = phase, now
+
+    def stop(self) -> None:
+        self.mark(None)
+
+
+class WalletStats:
+
+    def __init__(self):
+        self.transactions = 0
+        self.total = 0.0
+        self.phase_totals = dict.fromkeys(PHASES, 0.0)
+        self.phase_max = dict.fromkeys(PHASES, 0.0)
+
+    def add(self, durations: Dict[str, float]) -> None:
+        self.transactions += 1
+        for phase, duration in durations.items():
+            self.total += duration
+            self.phase_totals[phase] += duration
+            self.phase_max[phase] = max(self.phase_max[phase], duration)
+
+    def as_dict(self, wallet_id: UUID) -> dict:
+        return {
+            "wallet_id": str(wallet_id),
+            "transactions": self.transactions,
+            "total_seconds": round(self.total, 6),
+            "phases": {
+                phase: {
+                    "total_seconds": round(self.phase_totals[phase], 6),
+                    "max_seconds": round(self.phase_max[phase], 6),
+                    "share": round(self.phase_totals[phase] / self.total, 4) if self.total else 0.0,
+                } for phase in PHASES
+            },
+        }
+
+
+lock = threading.Lock()
+wallets: Dict[UUID, WalletStats] = {}
+
+
+def record(wallet_id: UUID, profile: WriteProfile) -> None:
+    """
+    Aggregate the phases of a finished write of the wallet.
+    """
+    profile.stop()
+    for phase, duration in profile.durations.items():
+        metrics.observe('wallet_write_phase_seconds', (('phase', phase),), duration, buckets=PHASE_BUCKETS)
+    max_wallets = settings.WALLET_PROFILE_MAX_WALLETS
+    if not max_wallets:
+        return
+    with lock:
+        stats = wallets.get(wallet_id)
+        if stats is None:
+            if len(wallets) >= max_wallets:
+                del wallets[min(wallets, key=lambda key: wallets[key].total)]
+            stats = wallets[wallet_id] = WalletStats()
+        stats.add(profile.durations)
+
+
+def hot_wallets(limit: int = 20, order: str = 'total') -> List[dict]:
+    """
+    :param order: total, or a phase: the wallets with the most time spent in it first
+    """
+    if order != 'total' and order not in PHASES:
+        raise ValueError(f"Unknown order '{order}', use total or one of: {', '.join(PHASES)}")
+    with lock:
+        items = list(wallets.items())
+    if order == 'total':
+        items.sort(key=lambda item: item[1].total, reverse=True)
+    else:
+        items.sort(key=lambda item: item[1].phase_totals[order], reverse=True)
+    return [stats.as_dict(wallet_id) for wallet_id, stats in items[:limit]]
+
+
+def reset() -> None:
+    with lock:
+        wallets.clear()
@@ -1,13 +1,52 @@
+from datetime import timedelta
+from decimal import Decimal
 from typing import Optional
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.http import Http404
+from django.utils import timezone
 from rest_framework import serializers
-from rest_framework.fields import empty
 
+from commons.serializers import CachedFieldsMixin
 from .models import ClientAccount, ClientWallet, ClientWalletTransaction
 
 
+class QueryParamsFilterSerializer(serializers.Serializer):
+    """
+    Validate list filters from the query params, see commons.filters.QueryParamsFilterBackend.
+    Subclasses map each field to a queryset lookup in `lookups`. Null values do not filter
+    (boolean fields must allow null, a missing query param would be False otherwise).
+    """
+    lookups = {}
+
+    def filter_queryset(self, queryset):
+        return queryset.filter(**{
+            self.lookups[name]: value for name, value in self.validated_data.items() if value is not None
+        })
+
+    @classmethod
+    def filter_from_query_params(cls, queryset, query_params):
+        serializer = cls(data=query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.filter_queryset(queryset)
+
+
+class PrimaryKeyOnlyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Related field that only validates the primary key format, it does not fetch the
+    related instance. The caller must check the related object exists, for example
+    locking it with select_for_update.
+    """
+
+    def to_internal_value(self, data):
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (ValidationError, TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=data)
+
+
 class UserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """
@@ -22,16 +61,11 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ("pk",)
 
 
-class ClientAccountSerializer(serializers.ModelSerializer):
-
-    def __init__(self, instance=None, data=empty, **kwargs):
-        super().__init__(instance, data, **kwargs)
-        request = self.context.get('request')
-
-        if request and request.user.is_staff:
-            self.Meta.exclude = ()
-        else:
-            self.Meta.exclude = ('user_account',)
+class ClientAccountSerializer(CachedFieldsMixin, serializers.ModelSerializer):
+    """
+    Regular users do not see the account owner, it is always the request user.
+    Staff users get StaffClientAccountSerializer, see ClientAccountViewSet.get_serializer_class.
+    """
 
     def create(self, validated_data):
         if not validated_data.get('user_account'):
@@ -50,7 +84,22 @@ class ClientAccountSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
 
 
+class StaffClientAccountSerializer(ClientAccountSerializer):
+    """
+    Staff users also see and choose the account owner.
+    """
+
+    class Meta(ClientAccountSerializer.Meta):
+        exclude = None
+        fields = "__all__"
+
+
 class ClientWalletSerializer(serializers.ModelSerializer):
+    # Sharded wallets report the balance of the wallet plus the balance of its shards
+    balance = serializers.DecimalField(
+        source="total_balance", max_digits=65, decimal_places=2, read_only=True
+    )
+
     def create(self, validated_data):
         """
         This method only allows to create a wallet if user is_staff or
@@ -62,7 +111,7 @@ class ClientWalletSerializer(serializers.ModelSerializer):
             user = None
         if user and not user.is_staff:
             try:
-                if user.clientaccount.id != validated_data.get('client_account').id:
+                if validated_data.get('client_account').user_account_id != user.pk:
                     raise Http404
             except (TypeError, AttributeError):
                 raise Http404
@@ -77,31 +126,142 @@ class ClientWalletSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ClientWallet
-        fields = "__all__"
+        exclude = ("shard_count",)
         read_only_fields = ("pk",)
+        # The owner check of create only needs the account owner id
+        extra_kwargs = {
+            "client_account": {"queryset": ClientAccount.objects.only("id", "user_account_id")},
+        }
 
 
 class ClientWalletTransactionSerializer(serializers.ModelSerializer):
+    """
+    The wallet is only validated as a primary key: the view fetches it, checks its owner
+    and locks it with a single query (see api.balance.get_wallet) and saves the
+    transaction with that wallet.
+    """
+    serializer_related_field = PrimaryKeyOnlyRelatedField
 
-    def create(self, validated_data):
+    class Meta:
+        model = ClientWalletTransaction
+        fields = "__all__"
+        read_only_fields = ("pk", "date_created", "transaction_type", "done")
+
+
+class ClientWalletTransactionBulkSerializer(ClientWalletTransactionSerializer):
+    """
+    Used to validate each item of a bulk request, it is never saved: the view fetches and
+    locks the wallets once per batch and creates the transactions with bulk_create.
+    """
+
+
+class ClientWalletTransactionImportSerializer(serializers.ModelSerializer):
+    """
+    Used to validate each row of an import, see api.imports, it is never saved. The id and
+    the creation date are kept when given. The wallets are checked and the rows inserted
+    once per chunk by the importer.
+    """
+    client_wallet_account = PrimaryKeyOnlyRelatedField(
+        source="client_wallet_account_id", queryset=ClientWallet.objects.all()
+    )
+    id = serializers.UUIDField(required=False)
+    date_created = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
         """
-        This method only allows to create a transaction if user is_staff or
-        if it is his own wallet.
+        The ledger and the statistics classify rows by type while balances sum amounts, so a
+        deposit or withdraw must match the sign of its amount. Errors and tests are kept as given.
         """
-        try:
-            user: Optional[User] = self.context.get("request").user
-        except (TypeError, AttributeError):
-            user = None
-        if user and not user.is_staff:
-            try:
-                user.clientaccount.clientwallet_set.get(
-                    id=validated_data.get('client_wallet_account').id
-                )
-            except ClientWallet.DoesNotExist:
-                raise Http404
-        return super().create(validated_data)
+        Type = ClientWalletTransaction.Type
+        amount_type = Type.from_amount(attrs["amount"])
+        if "transaction_type" not in attrs:
+            attrs["transaction_type"] = amount_type.value
+        elif attrs["transaction_type"] not in (Type.ERROR, Type.TESTING, amount_type):
+            raise serializers.ValidationError({"transaction_type": [
+                f"Does not match the amount, expected {amount_type.value} ({amount_type.label})."
+            ]})
+        return attrs
 
     class Meta:
         model = ClientWalletTransaction
         fields = "__all__"
-        read_only_fields = ("pk", "date_created", "transaction_type", "done")
+
+
+class ClientWalletTransferSerializer(serializers.Serializer):
+    """
+    Wallets are only validated as primary keys, the view locks them (see api.balance.transfer).
+    """
+    source_wallet = PrimaryKeyOnlyRelatedField(queryset=ClientWallet.objects.all())
+    target_wallet = PrimaryKeyOnlyRelatedField(queryset=ClientWallet.objects.all())
+    amount = serializers.DecimalField(max_digits=7, decimal_places=2, min_value=Decimal('0.01'))
+    description = serializers.CharField(max_length=250, required=False, allow_null=True, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs["source_wallet"] == attrs["target_wallet"]:
+            raise serializers.ValidationError({"target_wallet": ["Must be different from the source wallet."]})
+        return attrs
+
+
+class ClientWalletFilterSerializer(QueryParamsFilterSerializer):
+    client_account = serializers.UUIDField(required=False)
+    date_created_after = serializers.DateTimeField(required=False)
+    date_created_before = serializers.DateTimeField(required=False)
+
+    lookups = {
+        "client_account": "client_account_id",
+        "date_created_after": "date_created__gte",
+        "date_created_before": "date_created__lt",
+    }
+
+
+class ClientWalletTransactionFilterSerializer(QueryParamsFilterSerializer):
+    client_wallet_account = serializers.UUIDField(required=False)
+    transaction_type = serializers.ChoiceField(choices=ClientWalletTransaction.Type.choices, required=False)
+    date_created_after = serializers.DateTimeField(required=False)
+    date_created_before = serializers.DateTimeField(required=False)
+
+    lookups = {
+        "client_wallet_account": "client_wallet_account_id",
+        "transaction_type": "transaction_type",
+        "date_created_after": "date_created__gte",
+        "date_created_before": "date_created__lt",
+    }
+
+
+class UserAccountsFilterSerializer(QueryParamsFilterSerializer):
+    has_account = serializers.BooleanField(required=False, allow_null=True)
+
+    lookups = {
+        "has_account": "has_account",
+    }
+
+
+class WalletStatsRangeSerializer(serializers.Serializer):
+    """
+    ?since= and ?until= dates of the wallet statistics, both included. The last 30 days by
+    default, at most WALLET_STATS_MAX_DAYS days.
+    """
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault("until", timezone.localdate())
+        attrs.setdefault("since", attrs["until"] - timedelta(days=29))
+        if attrs["since"] > attrs["until"]:
+            raise serializers.ValidationError({"since": ["Must not be after until."]})
+        if (attrs["until"] - attrs["since"]).days >= settings.WALLET_STATS_MAX_DAYS:
+            raise serializers.ValidationError({"since": [
+                f"Ensure the range has no more than {settings.WALLET_STATS_MAX_DAYS} days."
+            ]})
+        return attrs
+
+
+class WalletDailyStatsSerializer(serializers.Serializer):
+    """
+    Representation of the rows of api.stats, see ClientWalletDailyStats.
+    """
+    day = serializers.DateField(required=False)
+    deposits_count = serializers.IntegerField()
+    deposits_total = serializers.DecimalField(max_digits=65, decimal_places=2)
+    withdrawals_count = serializers.IntegerField()
+    withdrawals_total = serializers.DecimalField(max_digits=65, decimal_places=2)
@@ -0,0 +1,101 @@
+"""
+Daily statistics of the wallets: number and total of the completed deposits and withdraws
+of each wallet per day, read by the staff dashboards from ClientWalletDailyStats rollups
+instead of aggregating the transactions table on every request.
+
+The rollups are maintained by the build_wallet_stats command, meant to run periodically
+(ex. every few minutes): it rebuilds whole days, today and yesterday by default, with one
+aggregate query per day that reads only the transactions of that day (api_tx_created_idx),
+then replaces the day rows. Rebuilding a day is idempotent, so it also picks up the
+transactions of that day that committed late or that the asynchronous worker
+(api.processing) processed later. Transactions are counted in the day they were created,
+so the default run misses the ones processed more than a day after their creation: after
+a worker backlog run the command with --since the creation day of the oldest transaction
+of the backlog. The statistics of today lag the transactions by the command interval.
+
+Days follow the TIME_ZONE setting.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Count, Q, QuerySet, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ClientWalletDailyStats, ClientWalletTransaction
+
+DEPOSIT = ClientWalletTransaction.Type.DEPOSIT.value
+WITHDRAW = ClientWalletTransaction.Type.WITHDRAW.value
+COUNTERS = ('deposits_count', 'deposits_total', 'withdrawals_count', 'withdrawals_total')
+BATCH_SIZE = 2000
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def days(since: date, until: date) -> Iterable[date]:
+    for offset in range((until - since).days + 1):
+        yield since + timedelta(days=offset)
+
+
+def aggregate_day(day: date) -> QuerySet:
+    """
+    values() rows of the day statistics of each wallet, from its transactions.
+    """
+    start, end = day_bounds(day)
+    deposits, withdraws = Q(transaction_type=DEPOSIT), Q(transaction_type=WITHDRAW)
+    return ClientWalletTransaction.objects.filter(
+        done=True, transaction_type__in=(DEPOSIT, WITHDRAW), date_created__gte=start, date_created__lt=end
+    ).order_by().values('client_wallet_account_id').annotate(
+        deposits_count=Count('id', filter=deposits),
+        deposits_total=Coalesce(Sum('amount', filter=deposits), Value(Decimal(0))),
+        withdrawals_count=Count('id', filter=withdraws),
+        withdrawals_total=-Coalesce(Sum('amount', filter=withdraws), Value(Decimal(0))),
+    )
+
+
+def rebuild_day(day: date) -> int:
+    """
+    Replace the statistics of the day in one atomic block.
+
+    :return: number of wallets with transactions that day
+    """
+    with transaction.atomic():
+        ClientWalletDailyStats.objects.filter(day=day).delete()
+        rows = [
+            ClientWalletDailyStats(
+                client_wallet_id=row['client_wallet_account_id'], day=day, **{name: row[name] for name in COUNTERS}
+            ) for row in aggregate_day(day).iterator(chunk_size=BATCH_SIZE)
+        ]
+        ClientWalletDailyStats.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+def wallet_days(wallet_id, since: date, until: date) -> List[dict]:
+    """
+    Statistics of a wallet for each day with transactions, oldest first.
+    """
+    return list(
+        ClientWalletDailyStats.objects.filter(client_wallet_id=wallet_id, day__gte=since, day__lte=until).order_by(
+            'day'
+        ).values('day', *COUNTERS)
+    )
+
+
+def all_wallets_days(since: date, until: date) -> List[dict]:
+    """
+    Statistics of every wallet summed by day, oldest first.
+    """
+    return list(
+        ClientWalletDailyStats.objects.filter(day__gte=since, day__lte=until).order_by('day').values('day').annotate(
+            **{name: Sum(name) for name in COUNTERS}
+        )
+    )
+
+
+def totals(rows: List[dict]) -> dict:
+    return {name: sum((row[name] for row in rows), Decimal(0) if name.endswith('_total') else 0) for name in COUNTERS}
@@ -1,13 +1,50 @@
+import base64
+import csv
+import json
 import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 from typing import List, Optional
+from uuid import uuid4
+
+from io import StringIO
 
 from django.contrib.auth.models import User
-from django.test import TransactionTestCase
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from faker import Faker
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
-
-from api.models import ClientAccount, ClientWallet, ClientWalletTransaction
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+
+from api import balance, ledger
+from api import cache as wallet_cache
+from api import locking
+from api import ownership
+from api import processing
+from api import profiling
+from api.models import (
+    ClientAccount, ClientWallet, ClientWalletDailyStats, ClientWalletShard, ClientWalletTransaction, IdempotencyKey,
+)
+from api.views import ClientAccountViewSet, ClientWalletTransactionSet, ClientWalletViewSet
+from commons import instrumentation
+
+
+# The wallet and ownership caches need a backend shared between processes, local memory disables them
+shared_cache = override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.gettempdir() + '/wallet_api_tests_cache',
+    },
+})
 
 
 # api.tests.ClientAccountApiTests.test_create_regular_user_and_sign_in
@@ -15,6 +52,11 @@ class CommonApiTests(APITestCase):
     default_user_username = 'testuser'
     default_user_password = 'aaa'
 
+    def setUp(self) -> None:
+        # Cached wallets and ownerships belong to the rows of previous tests
+        wallet_cache.get_cache().clear()
+        super().setUp()
+
     def create_user_auth(
         self, username: str = default_user_username, password: str = default_user_password,
         is_staff: bool = False
@@ -57,6 +99,17 @@ class CommonApiTests(APITestCase):
             client_wallet_account=client_wallet, **kwargs
         )
 
+    @contextmanager
+    def assertMaxQueries(self, max_queries: int):
+        """
+        Fail if the block runs more than max_queries database queries
+        """
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+        self.assertLessEqual(len(queries), max_queries, msg='\n'.join(
+            [f'{len(queries)} queries, budget {max_queries}:'] + [query['sql'] for query in queries]
+        ))
+
     def set_url(self, name: str, kwargs: object = None) -> None:
         self.url = reverse(name, kwargs=kwargs)
         self.full_url = 'http://testserver' + self.url
@@ -366,14 +419,33 @@ class ClientAccountApiTests(CommonApiTests):
         self.set_url('api:client_api-list')
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
-        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(len(response.json()['results']), 1)
 
     def test_list_as_staff_user(self):
         self.client.login(username=self.staff_user_username, password=self.default_user_password)
         self.set_url('api:client_api-list')
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
-        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_concurrent_staff_and_regular_serializers(self):
+        """
+        The owner is only visible to staff users, whatever other requests run at the same time.
+        """
+        # Every thread creates its serializer before any of them builds its fields
+        barrier = threading.Barrier(8, timeout=10)
+
+        def representation(iteration: int) -> bool:
+            user = self.staff_user if iteration % 2 else self.regular_user
+            view = ClientAccountViewSet(action='list', request=Request(APIRequestFactory().get('/')), format_kwarg=None)
+            view.request.user = user
+            serializer = view.get_serializer(self.regular_user_account)
+            barrier.wait()
+            data = serializer.data
+            return ('user_account' in data) == user.is_staff and data['id'] == str(self.regular_user_account.id)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(list(executor.map(representation, range(800)))))
 
 
 class ClientWalletApiTests(CommonApiTests):
@@ -557,7 +629,7 @@ class ClientWalletApiTests(CommonApiTests):
         self.set_url(f'{self.api_reverse_url}-list')
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
-        self.assertTrue(len(response.json()) > 0)
+        self.assertTrue(len(response.json()['results']) > 0)
 
     def test_regular_user_wallet_retrieve(self):
         self.assertTrue(
@@ -581,7 +653,7 @@ class ClientWalletApiTests(CommonApiTests):
         self.set_url(f'{self.api_reverse_url}-list')
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
-        self.assertTrue(len(response.json()) > 1)
+        self.assertTrue(len(response.json()['results']) > 1)
 
     def test_staff_user_wallet_retrieve(self):
         self.assertTrue(
@@ -719,6 +791,17 @@ class ClientWalletTransactionApiTests(CommonApiTests, TransactionTestCase):
         self.assertEqual(404, response.status_code)
         self.client.logout()
 
+    def test_create_transaction_of_unknown_wallet(self):
+        self.assertTrue(
+            self.client.login(username=self.regular_user.username, password=self.default_user_password),
+            msg='Login error'
+        )
+        self.set_url('api:client_wallet_transaction_api-list')
+        payload = {"amount": "1.00", "client_wallet_account": str(uuid4())}
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('client_wallet_account', response.json())
+
     def test_create_regular_user_transactions_as_staff_user(self):
         self.assertTrue(
             self.client.login(
@@ -828,6 +911,240 @@ class ClientWalletTransactionApiTests(CommonApiTests, TransactionTestCase):
         self.assertEqual(404, response.status_code)
         self.client.logout()
 
+    def test_bulk_create_regular_user_transactions_as_regular_user(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.default_user_username, password=self.default_user_password
+            ),
+            msg='Login error'
+        )
+        second_wallet = self.create_client_wallet(self.regular_user_account)
+        payload = [
+            {"description": self.fake.pystr(), "amount": "100.50",
+             "client_wallet_account": self.regular_user_wallet.id},
+            {"description": self.fake.pystr(), "amount": "-20.25",
+             "client_wallet_account": self.regular_user_wallet.id},
+            {"description": self.fake.pystr(), "amount": "0",
+             "client_wallet_account": self.regular_user_wallet.id},
+            {"description": self.fake.pystr(), "amount": "10",
+             "client_wallet_account": second_wallet.id},
+        ]
+        self.set_url('api:client_wallet_transaction_api-bulk')
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(201, response.status_code)
+
+        results = response.json()
+        self.assertEqual([201] * len(payload), [result["status"] for result in results])
+        self.assertEqual(
+            [
+                ClientWalletTransaction.Type.DEPOSIT.value,
+                ClientWalletTransaction.Type.WITHDRAW.value,
+                ClientWalletTransaction.Type.TESTING.value,
+                ClientWalletTransaction.Type.DEPOSIT.value,
+            ],
+            [result["data"]["transaction_type"] for result in results]
+        )
+        self.regular_user_wallet.refresh_from_db()
+        second_wallet.refresh_from_db()
+        self.assertEqual(Decimal("80.25"), self.regular_user_wallet.balance)
+        self.assertEqual(Decimal("10"), second_wallet.balance)
+        self.client.logout()
+
+    def test_bulk_create_with_invalid_and_other_user_transactions(self):
+        """
+        Valid items must be created while the others get their own error
+        """
+        self.assertTrue(
+            self.client.login(
+                username=self.default_user_username, password=self.default_user_password
+            ),
+            msg='Login error'
+        )
+        payload = [
+            {"description": self.fake.pystr(), "amount": "15",
+             "client_wallet_account": self.regular_user_wallet.id},
+            {"description": self.fake.pystr(), "amount": "15",
+             "client_wallet_account": self.staff_user_wallet.id},
+            {"description": self.fake.pystr(), "amount": "not a number",
+             "client_wallet_account": self.regular_user_wallet.id},
+            {"description": self.fake.pystr(), "amount": "15",
+             "client_wallet_account": "not an uuid"},
+        ]
+        self.set_url('api:client_wallet_transaction_api-bulk')
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(207, response.status_code)
+        self.assertEqual([201, 404, 400, 400], [result["status"] for result in response.json()])
+
+        self.regular_user_wallet.refresh_from_db()
+        self.staff_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("15"), self.regular_user_wallet.balance)
+        self.assertEqual(Decimal("0"), self.staff_user_wallet.balance)
+        self.assertEqual(1, ClientWalletTransaction.objects.filter(amount=15).count())
+        self.client.logout()
+
+    def test_bulk_create_requires_a_list(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.staff_user_username, password=self.default_user_password
+            ),
+            msg='Login error'
+        )
+        self.set_url('api:client_wallet_transaction_api-bulk')
+        payload = {"amount": "15", "client_wallet_account": self.regular_user_wallet.id}
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(400, response.status_code)
+        response = self.client.post(self.url, data=[], format='json')
+        self.assertEqual(400, response.status_code)
+        self.client.logout()
+
+    @override_settings(WALLET_BALANCE_UPDATE_MODE='atomic')
+    def test_atomic_mode_rejects_negative_balance(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.default_user_username, password=self.default_user_password
+            ),
+            msg='Login error'
+        )
+        self.set_url('api:client_wallet_transaction_api-list')
+        payload = {"amount": "50", "client_wallet_account": self.regular_user_wallet.id}
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(201, response.status_code)
+
+        payload = {"amount": "-50.01", "client_wallet_account": self.regular_user_wallet.id}
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(ClientWalletTransaction.objects.filter(amount=Decimal("-50.01")).exists())
+
+        payload = {"amount": "-50", "client_wallet_account": self.regular_user_wallet.id}
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(201, response.status_code)
+
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("0"), self.regular_user_wallet.balance)
+        self.client.logout()
+
+    @override_settings(WALLET_BALANCE_UPDATE_MODE='atomic')
+    def test_atomic_mode_bulk_create_rejects_negative_wallet(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.staff_user_username, password=self.default_user_password
+            ),
+            msg='Login error'
+        )
+        payload = [
+            {"amount": "30", "client_wallet_account": self.regular_user_wallet.id},
+            {"amount": "-10", "client_wallet_account": self.regular_user_wallet.id},
+            {"amount": "-10", "client_wallet_account": self.staff_user_wallet.id},
+        ]
+        self.set_url('api:client_wallet_transaction_api-bulk')
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(207, response.status_code)
+        self.assertEqual([201, 201, 400], [result["status"] for result in response.json()])
+
+        self.regular_user_wallet.refresh_from_db()
+        self.staff_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("20"), self.regular_user_wallet.balance)
+        self.assertEqual(Decimal("0"), self.staff_user_wallet.balance)
+        self.client.logout()
+
+    def test_bulk_deltas_of_deleted_wallet(self):
+        initial_balance = self.regular_user_wallet.balance
+        client_wallet = self.create_client_wallet(self.regular_user_account)
+        ClientWallet.objects.filter(pk=client_wallet.pk).delete()
+        wallets = {client_wallet.pk: client_wallet, self.regular_user_wallet.pk: self.regular_user_wallet}
+        deltas = {client_wallet.pk: Decimal("5"), self.regular_user_wallet.pk: Decimal("5")}
+        self.assertEqual(
+            (set(), {client_wallet.pk}),
+            ClientWalletTransactionSet.apply_bulk_deltas(wallets, deltas, balance.ATOMIC)
+        )
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(initial_balance + Decimal("5"), self.regular_user_wallet.balance)
+
+    def test_sharded_wallet_transactions(self):
+        with transaction.atomic():
+            balance.collapse_shards(self.regular_user_wallet.id, shard_count=4)
+        self.assertEqual(4, ClientWalletShard.objects.filter(client_wallet=self.regular_user_wallet).count())
+        self.assertTrue(
+            self.client.login(
+                username=self.default_user_username, password=self.default_user_password
+            ),
+            msg='Login error'
+        )
+        self.set_url('api:client_wallet_transaction_api-list')
+        for amount in ["10", "20", "30", "40"]:
+            payload = {"amount": amount, "client_wallet_account": self.regular_user_wallet.id}
+            response = self.client.post(self.url, data=payload, format='json')
+            self.assertEqual(201, response.status_code)
+
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("0"), self.regular_user_wallet.balance)
+        self.assertEqual(Decimal("100"), self.regular_user_wallet.total_balance)
+
+        self.set_url('api:client_wallet_api-detail', kwargs={"pk": self.regular_user_wallet.id})
+        response = self.client.get(self.url, format='json')
+        self.assertEqual("100.00", response.json()["balance"])
+        self.assertNotIn("shard_count", response.json())
+
+        # Withdraws move the shards balance into the wallet balance
+        self.set_url('api:client_wallet_transaction_api-list')
+        payload = {"amount": "-25", "client_wallet_account": self.regular_user_wallet.id}
+        response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(201, response.status_code)
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("75"), self.regular_user_wallet.balance)
+        self.assertEqual(Decimal("75"), self.regular_user_wallet.total_balance)
+        self.assertFalse(
+            ClientWalletShard.objects.filter(client_wallet=self.regular_user_wallet).exclude(balance=0).exists()
+        )
+        self.client.logout()
+
+    def test_rebalance_wallet_shards_command(self):
+        with transaction.atomic():
+            balance.collapse_shards(self.regular_user_wallet.id, shard_count=2)
+        ClientWalletShard.objects.filter(client_wallet=self.regular_user_wallet).update(balance=Decimal("5"))
+
+        call_command('rebalance_wallet_shards', str(self.regular_user_wallet.id), shards=3, stdout=StringIO())
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(3, self.regular_user_wallet.shard_count)
+        self.assertEqual(Decimal("10"), self.regular_user_wallet.balance)
+        self.assertEqual(3, ClientWalletShard.objects.filter(client_wallet=self.regular_user_wallet).count())
+
+        call_command('rebalance_wallet_shards', all=True, shards=0, stdout=StringIO())
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(0, self.regular_user_wallet.shard_count)
+        self.assertEqual(Decimal("10"), self.regular_user_wallet.total_balance)
+        self.assertFalse(ClientWalletShard.objects.filter(client_wallet=self.regular_user_wallet).exists())
+
+    @override_settings(WALLET_LOCK_STRATEGY='nowait')
+    def test_nowait_strategy_rejects_locked_wallet(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest(f'{connection.vendor} has no row locks')
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(balance.lock_wallets(ClientWallet.objects.filter(id=self.regular_user_wallet.id)))
+                    locked.set()
+                    release.wait(timeout=10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(timeout=10))
+            self.client.login(username=self.default_user_username, password=self.default_user_password)
+            self.set_url('api:client_wallet_transaction_api-list')
+            payload = {"amount": "1.00", "client_wallet_account": self.regular_user_wallet.id}
+            response = self.client.post(self.url, data=payload, format='json')
+            self.assertEqual(409, response.status_code)
+            self.assertEqual('1', response['Retry-After'])
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(201, self.client.post(self.url, data=payload, format='json').status_code)
+
     def test_regular_user_transaction_list(self):
         self.assertTrue(
             self.client.login(
@@ -838,7 +1155,7 @@ class ClientWalletTransactionApiTests(CommonApiTests, TransactionTestCase):
         self.set_url('api:client_wallet_transaction_api-list')
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
-        self.assertTrue(len(response.json()) > 0)
+        self.assertTrue(len(response.json()['results']) > 0)
 
     def test_regular_user_transaction_retrieve(self):
         self.assertTrue(
@@ -863,7 +1180,7 @@ class ClientWalletTransactionApiTests(CommonApiTests, TransactionTestCase):
         self.set_url('api:client_wallet_transaction_api-list')
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
-        self.assertTrue(len(response.json()) > 1)
+        self.assertTrue(len(response.json()['results']) > 1)
 
     def test_staff_user_transaction_retrieve(self):
         self.assertTrue(
@@ -890,3 +1207,1277 @@ class ClientWalletTransactionApiTests(CommonApiTests, TransactionTestCase):
         response = self.client.get(self.url, format='json')
         self.assertEqual(200, response.status_code)
         self.assertTrue(len(response.json()) > 0)
+
+
+class ClientWalletTransactionListApiTests(CommonApiTests):
+    fake = None
+    staff_user = None
+    staff_user_username = 'test_staff'
+    regular_user_wallet = None
+    second_wallet = None
+
+    def setUp(self):
+        self.fake = Faker()
+        regular_user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username=self.staff_user_username, is_staff=True)
+        name_surname = self.generate_name_and_surname(self.fake)
+        regular_user_account = self.create_client_account(
+            name=name_surname[0], surname=name_surname[1], user_account=regular_user
+        )
+        self.regular_user_wallet = self.create_client_wallet(regular_user_account)
+        self.second_wallet = self.create_client_wallet(regular_user_account)
+        for amount in ["1", "-2", "3", "-4", "5"]:
+            self.create_client_transaction(
+                Decimal(amount), self.regular_user_wallet,
+                transaction_type=ClientWalletTransaction.Type.from_amount(Decimal(amount)).value
+            )
+        self.create_client_transaction(
+            Decimal("6"), self.second_wallet, transaction_type=ClientWalletTransaction.Type.DEPOSIT.value
+        )
+
+        super().setUp()
+
+    def get_all_pages(self, data: dict) -> List[dict]:
+        self.set_url('api:client_wallet_transaction_api-list')
+        response = self.client.get(self.url, data=data, format='json')
+        results = []
+        while True:
+            self.assertEqual(200, response.status_code)
+            results += response.json()["results"]
+            if not response.json()["next"]:
+                return results
+            response = self.client.get(response.json()["next"], format='json')
+
+    def test_cursor_pagination(self):
+        self.client.login(username=self.staff_user_username, password=self.default_user_password)
+        results = self.get_all_pages({"page_size": 2})
+        self.assertEqual(6, len(results))
+        self.assertEqual(6, len({result["id"] for result in results}))
+        self.assertEqual(
+            sorted((result["date_created"] for result in results), reverse=True),
+            [result["date_created"] for result in results]
+        )
+
+    def test_filters(self):
+        self.client.login(username=self.default_user_username, password=self.default_user_password)
+        results = self.get_all_pages({"client_wallet_account": self.regular_user_wallet.id, "page_size": 2})
+        self.assertEqual(5, len(results))
+
+        results = self.get_all_pages({"transaction_type": ClientWalletTransaction.Type.WITHDRAW.value})
+        self.assertEqual(["-2.00", "-4.00"], sorted(result["amount"] for result in results))
+
+        future = (timezone.now() + timedelta(days=1)).isoformat()
+        self.assertEqual(6, len(self.get_all_pages({"date_created_before": future})))
+        self.assertEqual(0, len(self.get_all_pages({"date_created_after": future})))
+
+        self.set_url('api:client_wallet_transaction_api-list')
+        response = self.client.get(self.url, data={"transaction_type": 9}, format='json')
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(self.url, data={"client_wallet_account": "wallet"}, format='json')
+        self.assertEqual(400, response.status_code)
+
+    def test_wallet_filters(self):
+        self.client.login(username=self.staff_user_username, password=self.default_user_password)
+        self.set_url('api:client_wallet_api-list')
+        response = self.client.get(
+            self.url, data={"client_account": self.regular_user_wallet.client_account_id}, format='json'
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(response.json()["results"]))
+
+    def export(self, data: dict) -> str:
+        self.set_url('api:client_wallet_transaction_api-export')
+        response = self.client.get(self.url, data=data)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export(self):
+        self.client.login(username=self.staff_user_username, password=self.default_user_password)
+        rows = list(csv.DictReader(StringIO(self.export({}))))
+        self.assertEqual(["1.00", "-2.00", "3.00", "-4.00", "5.00", "6.00"], [row["amount"] for row in rows])
+        self.assertEqual(str(self.second_wallet.pk), rows[-1]["client_wallet_account"])
+
+        lines = self.export({"output": "ndjson", "client_wallet_account": self.second_wallet.pk}).splitlines()
+        self.assertEqual(1, len(lines))
+        self.assertEqual("6.00", json.loads(lines[0])["amount"])
+
+        self.set_url('api:client_wallet_transaction_api-export')
+        self.assertEqual(400, self.client.get(self.url, data={"output": "xml"}).status_code)
+
+    async def test_async_export(self):
+        await self.async_client.aforce_login(self.staff_user)
+        response = await self.async_client.get(
+            reverse('api:client_wallet_transaction_api-export'), {"output": "ndjson"}
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(6, len(lines))
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_transactions', output='ndjson', transaction_type=ClientWalletTransaction.Type.WITHDRAW,
+                     chunk_size=1, stdout=out)
+        self.assertEqual(["-2.00", "-4.00"], [json.loads(line)["amount"] for line in out.getvalue().splitlines()])
+        with self.assertRaises(CommandError):
+            call_command('export_transactions', client_wallet_account='wallet', stdout=StringIO())
+
+
+class ClientWalletTransactionQueryPlanTests(CommonApiTests):
+    """
+    The list and retrieve queries of ClientWalletTransactionSet must use the transaction
+    indexes. PostgreSQL runs them with sequential scans disabled, so the planner picks an
+    index whenever one matches even on tiny test tables.
+    """
+    staff_user_username = 'test_staff'
+    table = ClientWalletTransaction._meta.db_table
+
+    def setUp(self):
+        self.regular_user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username=self.staff_user_username, is_staff=True)
+        regular_user_account = self.create_client_account(user_account=self.regular_user)
+        self.regular_user_wallet = self.create_client_wallet(regular_user_account)
+        for amount in range(1, 20):
+            self.regular_user_transaction = self.create_client_transaction(Decimal(amount), self.regular_user_wallet)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        super().setUp()
+
+    def get_view_queryset(self, user: User, action: str = 'list', query_params: Optional[dict] = None):
+        request = Request(APIRequestFactory().get('/', query_params or {}))
+        request.user = user
+        view = ClientWalletTransactionSet(request=request, action=action, format_kwarg=None, kwargs={})
+        queryset = view.filter_queryset(view.get_queryset())
+        if action == 'list':
+            pagination = view.pagination_class
+            # Same query as a page after the first one
+            queryset = queryset.filter(date_created__lt=timezone.now()).order_by(
+                *pagination.ordering
+            )[:pagination.page_size + 1]
+        return queryset
+
+    def assertUsesIndex(self, queryset, index_name: str) -> None:
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest(f'Query plans are not checked on {connection.vendor}')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn(f'Seq Scan on {self.table}', plan)
+        self.assertNotRegex(plan, rf'SCAN {self.table}(?! USING)')
+
+    def test_staff_list(self):
+        self.assertUsesIndex(self.get_view_queryset(self.staff_user), 'api_tx_created_idx')
+
+    def test_regular_user_list(self):
+        self.assertUsesIndex(self.get_view_queryset(self.regular_user), 'api_tx_wallet_created_idx')
+
+    def test_wallet_filter(self):
+        queryset = self.get_view_queryset(
+            self.staff_user, query_params={"client_wallet_account": self.regular_user_wallet.id}
+        )
+        self.assertUsesIndex(queryset, 'api_tx_wallet_created_idx')
+
+    def test_type_filter(self):
+        queryset = self.get_view_queryset(
+            self.staff_user, query_params={"transaction_type": ClientWalletTransaction.Type.DEPOSIT.value}
+        )
+        self.assertUsesIndex(queryset, 'api_tx_type_created_idx')
+
+    def test_retrieve(self):
+        queryset = self.get_view_queryset(self.regular_user, action='retrieve').filter(
+            pk=self.regular_user_transaction.pk
+        )
+        primary_key_index = 'pkey' if connection.vendor == 'postgresql' else 'sqlite_autoindex'
+        self.assertUsesIndex(queryset, primary_key_index)
+
+    def test_pending_transactions(self):
+        queryset = ClientWalletTransaction.objects.filter(done=False).order_by('date_created')
+        self.assertUsesIndex(queryset, 'api_tx_pending_idx')
+
+
+class QueryBudgetTests(CommonApiTests):
+    """
+    Maximum number of queries of each endpoint, including the session and user queries
+    of the authentication. Lists must not depend on the number of rows.
+    """
+    staff_username = 'test_staff'
+
+    def setUp(self):
+        self.regular_user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username=self.staff_username, is_staff=True)
+        self.regular_user_account = self.create_client_account(user_account=self.regular_user)
+        self.staff_user_account = self.create_client_account(user_account=self.staff_user)
+        self.regular_user_wallet = self.create_client_wallet(self.regular_user_account)
+        self.staff_user_wallet = self.create_client_wallet(self.staff_user_account)
+        for amount in (Decimal('10.00'), Decimal('-2.00'), Decimal('5.00')):
+            self.create_client_transaction(amount, self.regular_user_wallet)
+            self.create_client_transaction(amount, self.staff_user_wallet)
+        super().setUp()
+
+    def login(self, username: str) -> None:
+        self.assertTrue(self.client.login(username=username, password=self.default_user_password))
+
+    def assertGetBudget(self, max_queries: int, name: str, kwargs: object = None) -> None:
+        self.set_url(name, kwargs)
+        with self.assertMaxQueries(max_queries):
+            response = self.client.get(self.url)
+        self.assertEqual(200, response.status_code)
+
+    def assertReadBudgets(self, ownership_queries: int) -> None:
+        """
+        :param ownership_queries: queries of the endpoints filtered by the owned wallets of
+            regular users, see api.ownership
+        """
+        for username in (self.default_user_username, self.staff_username):
+            self.login(username)
+            owned = 0 if username == self.staff_username else ownership_queries
+            if username == self.staff_username:
+                self.assertGetBudget(3, 'api:user_api-list')
+            self.assertGetBudget(3, 'api:user_api-detail', {'pk': self.regular_user.pk})
+            self.assertGetBudget(3, 'api:client_api-list')
+            self.assertGetBudget(3, 'api:client_api-detail', {'pk': self.regular_user_account.pk})
+            self.assertGetBudget(3 + owned, 'api:client_wallet_api-list')
+            self.assertGetBudget(3 + owned, 'api:client_wallet_api-detail', {'pk': self.regular_user_wallet.pk})
+            self.assertGetBudget(3 + owned, 'api:client_wallet_transaction_api-list')
+            self.assertGetBudget(3 + owned, 'api:client_wallet_transaction_api-detail', {
+                'pk': self.regular_user_wallet.clientwallettransaction_set.first().pk
+            })
+            self.client.logout()
+
+    def test_read_endpoints(self):
+        # Default settings: the ownership is resolved once per request
+        self.assertReadBudgets(ownership_queries=1)
+
+    @shared_cache
+    @override_settings(WALLET_OWNERSHIP_CACHE_TIMEOUT=30)
+    def test_read_endpoints_with_ownership_cache(self):
+        wallet_cache.get_cache().clear()
+        # The first request of the user caches its ownership for the next ones
+        self.login(self.default_user_username)
+        self.client.get(reverse('get_client_id'))
+        self.assertReadBudgets(ownership_queries=0)
+
+    def test_create_wallet(self):
+        self.login(self.default_user_username)
+        self.set_url('api:client_wallet_api-list')
+        # session, user, account, insert
+        with self.assertMaxQueries(4):
+            response = self.client.post(self.url, data={'client_account': self.regular_user_account.pk}, format='json')
+        self.assertEqual(201, response.status_code)
+
+    def test_create_transaction(self):
+        self.login(self.default_user_username)
+        self.set_url('api:client_wallet_transaction_api-list')
+        payload = {'amount': '1.00', 'client_wallet_account': self.regular_user_wallet.pk}
+        # session, user, savepoint, owned wallet lock, update, insert, release
+        with self.assertMaxQueries(7):
+            response = self.client.post(self.url, data=payload, format='json')
+        self.assertEqual(201, response.status_code)
+
+
+class TransferApiTests(CommonApiTests):
+
+    def setUp(self):
+        self.regular_user = self.create_user_auth()
+        self.other_user = self.create_user_auth(username='other_user')
+        self.regular_user_wallet = self.create_client_wallet(
+            self.create_client_account(user_account=self.regular_user), balance=Decimal('100.00')
+        )
+        self.other_user_wallet = self.create_client_wallet(
+            self.create_client_account(user_account=self.other_user), balance=Decimal('50.00')
+        )
+        self.client.login(username=self.default_user_username, password=self.default_user_password)
+        self.set_url('api:client_wallet_transaction_api-transfer')
+        super().setUp()
+
+    def transfer(self, source: ClientWallet, target: ClientWallet, amount: str):
+        return self.client.post(self.url, data={
+            'source_wallet': str(source.pk), 'target_wallet': str(target.pk), 'amount': amount, 'description': 'rent'
+        }, format='json')
+
+    def assertBalances(self, regular_user_balance: str, other_user_balance: str) -> None:
+        self.regular_user_wallet.refresh_from_db()
+        self.other_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal(regular_user_balance), self.regular_user_wallet.total_balance)
+        self.assertEqual(Decimal(other_user_balance), self.other_user_wallet.total_balance)
+
+    def test_transfer(self):
+        response = self.transfer(self.regular_user_wallet, self.other_user_wallet, '30.00')
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('-30.00', response.json()['withdraw']['amount'])
+        self.assertEqual(ClientWalletTransaction.Type.DEPOSIT.value, response.json()['deposit']['transaction_type'])
+        self.assertBalances('70.00', '80.00')
+        self.assertEqual(2, ClientWalletTransaction.objects.filter(description='rent').count())
+
+    def test_transfer_to_sharded_wallet(self):
+        with transaction.atomic():
+            balance.collapse_shards(self.other_user_wallet.pk, shard_count=2)
+        self.assertEqual(201, self.transfer(self.regular_user_wallet, self.other_user_wallet, '30.00').status_code)
+        self.assertBalances('70.00', '80.00')
+
+    def test_transfer_from_other_user_wallet(self):
+        self.assertEqual(404, self.transfer(self.other_user_wallet, self.regular_user_wallet, '30.00').status_code)
+        self.assertBalances('100.00', '50.00')
+
+    def test_transfer_without_balance(self):
+        response = self.transfer(self.regular_user_wallet, self.other_user_wallet, '100.01')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('amount', response.json())
+        self.assertBalances('100.00', '50.00')
+        self.assertFalse(ClientWalletTransaction.objects.exists())
+
+    def test_invalid_transfers(self):
+        self.assertEqual(400, self.transfer(self.regular_user_wallet, self.regular_user_wallet, '1.00').status_code)
+        self.assertEqual(400, self.transfer(self.regular_user_wallet, self.other_user_wallet, '-1.00').status_code)
+        self.assertBalances('100.00', '50.00')
+
+
+@shared_cache
+class WalletCacheTests(CommonApiTests):
+
+    def setUp(self):
+        self.regular_user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username='test_staff', is_staff=True)
+        self.regular_user_wallet = self.create_client_wallet(self.create_client_account(user_account=self.regular_user))
+        self.client.login(username=self.default_user_username, password=self.default_user_password)
+        super().setUp()
+
+    def get_balance(self) -> str:
+        self.set_url('api:client_wallet_api-detail', {'pk': self.regular_user_wallet.pk})
+        response = self.client.get(self.url)
+        self.assertEqual(200, response.status_code)
+        return response.json()['balance']
+
+    def test_read_through(self):
+        self.assertEqual('0.00', self.get_balance())
+        # session and user
+        with self.assertMaxQueries(2):
+            self.assertEqual('0.00', self.get_balance())
+        self.assertEqual({'enabled': True, 'hits': 1, 'misses': 1, 'hit_ratio': 0.5}, wallet_cache.stats())
+
+    def test_balance_changes_invalidate(self):
+        self.get_balance()
+        self.set_url('api:client_wallet_transaction_api-list')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data={
+                'amount': '10.00', 'client_wallet_account': str(self.regular_user_wallet.pk)
+            }, format='json')
+        self.assertEqual('10.00', self.get_balance())
+        with self.captureOnCommitCallbacks(execute=True):
+            balance.add_atomically(self.regular_user_wallet.pk, Decimal('-5.00'))
+        self.assertEqual('5.00', self.get_balance())
+
+    def test_cached_wallet_of_other_user(self):
+        self.get_balance()
+        self.create_user_auth(username='other_user')
+        self.client.login(username='other_user', password=self.default_user_password)
+        self.set_url('api:client_wallet_api-detail', {'pk': self.regular_user_wallet.pk})
+        self.assertEqual(404, self.client.get(self.url).status_code)
+
+    @override_settings(WALLET_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.get_balance()
+        self.get_balance()
+        self.assertEqual(0, wallet_cache.stats()['misses'])
+
+    def test_disabled_with_local_memory(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.get_balance()
+            self.get_balance()
+            self.assertEqual({'enabled': False, 'hits': 0, 'misses': 0, 'hit_ratio': 0.0}, wallet_cache.stats())
+
+    def test_cache_stats_staff_only(self):
+        self.set_url('api:client_wallet_api-cache-stats')
+        self.assertEqual(403, self.client.get(self.url).status_code)
+        self.client.login(username='test_staff', password=self.default_user_password)
+        self.assertEqual(200, self.client.get(self.url).status_code)
+
+
+@shared_cache
+@override_settings(WALLET_OWNERSHIP_CACHE_TIMEOUT=30)
+class OwnershipTests(CommonApiTests):
+
+    def setUp(self):
+        self.regular_user = self.create_user_auth()
+        self.regular_user_account = self.create_client_account(user_account=self.regular_user)
+        self.regular_user_wallet = self.create_client_wallet(self.regular_user_account)
+        self.client.login(username=self.default_user_username, password=self.default_user_password)
+        super().setUp()
+
+    def test_resolved_once_and_cached(self):
+        self.set_url('get_client_id')
+        # session, user and ownership
+        with self.assertMaxQueries(3):
+            self.assertEqual(str(self.regular_user_account.pk), self.client.get(self.url).json()['id'])
+        with self.assertMaxQueries(2):
+            self.assertEqual(str(self.regular_user_account.pk), self.client.get(self.url).json()['id'])
+        self.set_url('api:client_wallet_transaction_api-list')
+        # session, user and transactions
+        with self.assertMaxQueries(3):
+            self.assertEqual(200, self.client.get(self.url).status_code)
+
+    def test_wallet_creation_invalidates(self):
+        self.assertEqual(
+            frozenset([self.regular_user_wallet.pk]), ownership.get_ownership(self.regular_user.pk).wallet_ids
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            client_wallet = self.create_client_wallet(self.regular_user_account)
+        self.assertEqual(
+            frozenset([self.regular_user_wallet.pk, client_wallet.pk]),
+            ownership.get_ownership(self.regular_user.pk).wallet_ids
+        )
+
+    def test_wallet_reassignment_invalidates(self):
+        other_user = self.create_user_auth(username='other_user')
+        other_user_account = self.create_client_account(user_account=other_user)
+        self.assertEqual(frozenset(), ownership.get_ownership(other_user.pk).wallet_ids)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.regular_user_wallet.client_account = other_user_account
+            self.regular_user_wallet.save()
+        self.assertEqual(frozenset(), ownership.get_ownership(self.regular_user.pk).wallet_ids)
+        self.assertEqual(frozenset([self.regular_user_wallet.pk]), ownership.get_ownership(other_user.pk).wallet_ids)
+
+    @override_settings(WALLET_OWNERSHIP_CACHE_TIMEOUT=0)
+    def test_request_scoped_only(self):
+        self.set_url('get_client_id')
+        for _ in range(2):
+            with self.assertMaxQueries(3):
+                self.assertEqual(200, self.client.get(self.url).status_code)
+
+    def test_request_scoped_with_local_memory(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertFalse(ownership.is_cached())
+            self.set_url('get_client_id')
+            for _ in range(2):
+                with self.assertNumQueries(3):
+                    self.assertEqual(200, self.client.get(self.url).status_code)
+
+
+class AsyncViewsTests(CommonApiTests):
+    """
+    Async views must answer like their synchronous versions.
+    """
+
+    def setUp(self):
+        self.staff_user = self.create_user_auth(is_staff=True)
+        self.staff_user_account = self.create_client_account(user_account=self.staff_user)
+        self.staff_user_wallet = self.create_client_wallet(self.staff_user_account, balance=Decimal('12.50'))
+        self.create_client_wallet(self.staff_user_account)
+        super().setUp()
+
+    def assertSameResponse(self, sync_name: str, async_name: str, kwargs: object = None, **headers) -> None:
+        sync_response = self.client.get(reverse(sync_name, kwargs=kwargs), headers=headers)
+        async_response = self.client.get(reverse(async_name, kwargs=kwargs), headers=headers)
+        self.assertEqual(sync_response.status_code, async_response.status_code, msg=async_name)
+        if sync_name.endswith('-list'):
+            self.assertEqual(sync_response.json()['results'], async_response.json()['results'], msg=async_name)
+        else:
+            self.assertEqual(sync_response.json(), async_response.json(), msg=async_name)
+
+    def test_same_responses(self):
+        for headers in ({}, {'Authorization': 'Basic ' + base64.b64encode(b'testuser:aaa').decode()}):
+            if not headers:
+                self.client.login(username=self.default_user_username, password=self.default_user_password)
+            self.assertSameResponse('get_username', 'async_get_username', **headers)
+            self.assertSameResponse('get_user_id', 'async_get_user_id', **headers)
+            self.assertSameResponse('get_client_id', 'async_get_client_id', **headers)
+            self.assertSameResponse('get_num_accounts', 'async_get_num_accounts', **headers)
+            self.assertSameResponse('api:client_wallet_api-list', 'async_client_wallet_list', **headers)
+            self.assertSameResponse('api:client_wallet_api-detail', 'async_client_wallet_detail',
+                                    {'pk': self.staff_user_wallet.pk}, **headers)
+            self.client.logout()
+
+    def test_permissions(self):
+        self.assertSameResponse('get_username', 'async_get_username')
+        self.create_user_auth(username='regular_user')
+        self.client.login(username='regular_user', password=self.default_user_password)
+        self.assertSameResponse('get_num_accounts', 'async_get_num_accounts')
+        self.assertSameResponse('get_client_id', 'async_get_client_id')
+        self.assertEqual(404, self.client.get(
+            reverse('async_client_wallet_detail', kwargs={'pk': self.staff_user_wallet.pk})
+        ).status_code)
+        self.assertEqual(405, self.client.post(reverse('async_get_username')).status_code)
+
+
+class GetNumClientAccountsTests(CommonApiTests):
+
+    def setUp(self):
+        self.staff_user = self.create_user_auth(username='staff_user', is_staff=True)
+        self.create_client_account(user_account=self.staff_user)
+        self.users = [self.create_user_auth(username=f'user_{index}') for index in range(3)]
+        self.create_client_account(user_account=self.users[0])
+        super().setUp()
+
+    def test_pages_and_filters(self):
+        self.client.force_login(self.staff_user)
+        response = self.client.get(reverse('get_num_accounts'), {'page_size': 2})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [{'id': self.staff_user.pk, 'username': 'staff_user', 'num_accounts': 1},
+             {'id': self.users[0].pk, 'username': 'user_0', 'num_accounts': 1}],
+            response.json()['results']
+        )
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(['user_1', 'user_2'], [user['username'] for user in response.json()['results']])
+        self.assertIsNone(response.json()['next'])
+
+        for has_account, usernames in (('true', ['staff_user', 'user_0']), ('false', ['user_1', 'user_2'])):
+            # Session and user, then a single query for the page
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('get_num_accounts'), {'has_account': has_account})
+            self.assertEqual(usernames, [user['username'] for user in response.json()['results']])
+        self.assertEqual(400, self.client.get(reverse('get_num_accounts'), {'has_account': 'maybe'}).status_code)
+        self.assertEqual(400, self.client.get(reverse('async_get_num_accounts'), {'has_account': 'maybe'}).status_code)
+
+
+class ValuesReadTests(CommonApiTests):
+    """
+    The values() read path must render the same bytes as the model serializers.
+    """
+
+    def setUp(self):
+        self.staff_user = self.create_user_auth(is_staff=True)
+        self.staff_user_account = self.create_client_account(user_account=self.staff_user)
+        self.wallet = self.create_client_wallet(self.staff_user_account)
+        self.sharded_wallet = self.create_client_wallet(self.staff_user_account)
+        balance.collapse_shards(self.sharded_wallet.pk, Decimal('1000000.5'), shard_count=2)
+        ClientWalletShard.objects.filter(client_wallet=self.sharded_wallet, index=0).update(balance=Decimal('0.25'))
+        for amount, description in ((Decimal('10'), None), (Decimal('-2.5'), 'Withdraw'), (Decimal('0'), '')):
+            self.create_client_transaction(amount, self.wallet, description=description)
+        super().setUp()
+
+    def render(self, viewset, actions: dict, values_read: bool, **kwargs) -> bytes:
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.staff_user)
+        initkwargs = {} if values_read else {'values_read_actions': ()}
+        response = viewset.as_view(actions, **initkwargs)(request, **kwargs)
+        self.assertEqual(200, response.status_code)
+        return response.render().content
+
+    def assertSameContent(self, viewset, actions: dict, **kwargs) -> None:
+        wallet_cache.get_cache().clear()
+        content = self.render(viewset, actions, values_read=True, **kwargs)
+        wallet_cache.get_cache().clear()
+        self.assertEqual(self.render(viewset, actions, values_read=False, **kwargs), content)
+
+    def test_same_content(self):
+        transaction = ClientWalletTransaction.objects.filter(description='Withdraw').get()
+        self.assertSameContent(ClientWalletViewSet, {'get': 'list'})
+        self.assertSameContent(ClientWalletViewSet, {'get': 'retrieve'}, pk=self.sharded_wallet.pk)
+        self.assertSameContent(ClientWalletTransactionSet, {'get': 'list'})
+        self.assertSameContent(ClientWalletTransactionSet, {'get': 'retrieve'}, pk=transaction.pk)
+
+    def test_not_found(self):
+        self.client.force_login(self.create_user_auth(username='regular_user'))
+        self.set_url('api:client_wallet_transaction_api-detail', kwargs={'pk': uuid4()})
+        self.assertEqual(404, self.client.get(self.url).status_code)
+        self.set_url('api:client_wallet_api-detail', kwargs={'pk': self.wallet.pk})
+        self.assertEqual(404, self.client.get(self.url).status_code)
+
+
+class IdempotencyKeyTests(CommonApiTests):
+
+    def setUp(self):
+        self.regular_user = self.create_user_auth()
+        self.regular_user_wallet = self.create_client_wallet(self.create_client_account(user_account=self.regular_user))
+        self.client.login(username=self.default_user_username, password=self.default_user_password)
+        self.payload = {'amount': '10.00', 'client_wallet_account': str(self.regular_user_wallet.pk)}
+        super().setUp()
+
+    def post(self, url_name: str, payload: object, key: str):
+        self.set_url(url_name)
+        return self.client.post(self.url, data=payload, format='json', headers={'Idempotency-Key': key})
+
+    def test_retry_replays_the_response(self):
+        response = self.post('api:client_wallet_transaction_api-list', self.payload, 'retry')
+        self.assertEqual(201, response.status_code)
+        # session, user and key, the wallet is not touched
+        with self.assertMaxQueries(3):
+            retry = self.post('api:client_wallet_transaction_api-list', self.payload, 'retry')
+        self.assertEqual(201, retry.status_code)
+        self.assertEqual('true', retry.headers['Idempotent-Replayed'])
+        self.assertEqual(response.json(), retry.json())
+        self.assertEqual(1, ClientWalletTransaction.objects.count())
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal('10.00'), self.regular_user_wallet.balance)
+
+    def test_async_retry_replays_the_headers(self):
+        self.set_url('api:client_wallet_transaction_api-list')
+        headers = {'Idempotency-Key': 'async', 'Prefer': 'respond-async'}
+        response = self.client.post(self.url, data=self.payload, format='json', headers=headers)
+        retry = self.client.post(self.url, data=self.payload, format='json', headers=headers)
+        self.assertEqual(202, retry.status_code)
+        self.assertEqual('true', retry.headers['Idempotent-Replayed'])
+        for name in ('Location', 'Preference-Applied'):
+            self.assertEqual(response.headers[name], retry.headers[name])
+        self.assertEqual(1, ClientWalletTransaction.objects.count())
+
+    def test_bulk_retry_replays_the_response(self):
+        response = self.post('api:client_wallet_transaction_api-bulk', [self.payload, self.payload], 'bulk')
+        retry = self.post('api:client_wallet_transaction_api-bulk', [self.payload, self.payload], 'bulk')
+        self.assertEqual(201, retry.status_code)
+        self.assertEqual(response.json(), retry.json())
+        self.assertEqual(2, ClientWalletTransaction.objects.count())
+
+    def test_key_reused_with_other_request(self):
+        self.post('api:client_wallet_transaction_api-list', self.payload, 'reused')
+        response = self.post('api:client_wallet_transaction_api-list', {**self.payload, 'amount': '5.00'}, 'reused')
+        self.assertEqual(422, response.status_code)
+        self.assertEqual(1, ClientWalletTransaction.objects.count())
+
+    def test_errors_are_not_stored(self):
+        response = self.post('api:client_wallet_transaction_api-list', {**self.payload, 'amount': 'x'}, 'error')
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = self.post('api:client_wallet_transaction_api-list', self.payload, 'error')
+        self.assertEqual(201, response.status_code)
+
+    def test_purge_idempotency_keys(self):
+        self.post('api:client_wallet_transaction_api-list', self.payload, 'old')
+        self.post('api:client_wallet_transaction_api-list', self.payload, 'new')
+        IdempotencyKey.objects.filter(key='old').update(date_created=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('purge_idempotency_keys', ttl=24 * 60 * 60, batch_size=1, stdout=out)
+        self.assertIn('1 idempotency keys deleted', out.getvalue())
+        self.assertEqual(['new'], list(IdempotencyKey.objects.values_list('key', flat=True)))
+
+
+class AdminChangelistTests(CommonApiTests):
+    """
+    The number of queries of each changelist must not depend on the number of rows.
+    """
+    admin_username = 'test_admin'
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username=self.admin_username, password=self.default_user_password
+        )
+        self.client.login(username=self.admin_username, password=self.default_user_password)
+        super().setUp()
+
+    def create_rows(self, num_rows: int) -> None:
+        for index in range(num_rows):
+            user = self.create_user_auth(username=f'{self.default_user_username}{ClientAccount.objects.count()}')
+            client_wallet = self.create_client_wallet(self.create_client_account(user_account=user))
+            self.create_client_transaction(Decimal(index), client_wallet)
+
+    def count_changelist_queries(self, url_name: str) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(200, response.status_code)
+        return len(queries)
+
+    def test_changelist_queries(self):
+        for url_name in (
+            'admin:api_clientaccount_changelist',
+            'admin:api_clientwallet_changelist',
+            'admin:api_clientwallettransaction_changelist',
+        ):
+            self.create_rows(2)
+            num_queries = self.count_changelist_queries(url_name)
+            self.create_rows(5)
+            self.assertEqual(num_queries, self.count_changelist_queries(url_name), msg=url_name)
+
+
+class WalletLedgerTests(CommonApiTests):
+    fake = None
+    regular_user = None
+    regular_user_account = None
+    regular_user_wallet = None
+
+    def setUp(self):
+        self.fake = Faker()
+        self.regular_user = self.create_user_auth()
+        name_surname = self.generate_name_and_surname(self.fake)
+        self.regular_user_account = self.create_client_account(
+            name=name_surname[0], surname=name_surname[1], user_account=self.regular_user
+        )
+        self.regular_user_wallet = self.create_client_wallet(self.regular_user_account)
+        self.start = timezone.now() - timedelta(days=10)
+        # One transaction per day: 10, -1, 10, -1...
+        for day in range(10):
+            amount = Decimal("10") if day % 2 == 0 else Decimal("-1")
+            transaction_type = ClientWalletTransaction.Type.from_amount(amount).value
+            wallet_transaction = self.create_client_transaction(
+                amount, self.regular_user_wallet, transaction_type=transaction_type
+            )
+            ClientWalletTransaction.objects.filter(pk=wallet_transaction.pk).update(
+                date_created=self.start + timedelta(days=day)
+            )
+        # Neither testing nor pending transactions are part of the ledger
+        self.create_client_transaction(Decimal("100"), self.regular_user_wallet)
+        self.create_client_transaction(
+            Decimal("100"), self.regular_user_wallet,
+            transaction_type=ClientWalletTransaction.Type.DEPOSIT.value, done=False
+        )
+        ClientWallet.objects.filter(pk=self.regular_user_wallet.pk).update(balance=Decimal("45"))
+
+        super().setUp()
+
+    def test_balance_at_with_and_without_snapshots(self):
+        moment = self.start + timedelta(days=3, hours=1)
+        self.assertEqual(Decimal("18"), ledger.balance_at(self.regular_user_wallet.id, moment))
+
+        call_command('build_wallet_snapshots', every=3, stdout=StringIO())
+        snapshots = list(self.regular_user_wallet.snapshots.order_by('taken_at'))
+        self.assertEqual([3, 6, 9], [snapshot.transaction_count for snapshot in snapshots])
+        self.assertEqual([Decimal("19"), Decimal("27"), Decimal("46")], [snapshot.balance for snapshot in snapshots])
+
+        self.assertEqual(Decimal("18"), ledger.balance_at(self.regular_user_wallet.id, moment))
+        self.assertEqual(Decimal("45"), ledger.balance_at(self.regular_user_wallet.id))
+
+        # Next runs only add snapshots for the new transactions
+        call_command('build_wallet_snapshots', every=3, stdout=StringIO())
+        self.assertEqual(3, self.regular_user_wallet.snapshots.count())
+        call_command('build_wallet_snapshots', every=1, stdout=StringIO())
+        self.assertEqual(4, self.regular_user_wallet.snapshots.count())
+
+    def test_balance_at_endpoint(self):
+        self.client.login(username=self.default_user_username, password=self.default_user_password)
+        self.set_url('api:client_wallet_api-balance-at', kwargs={"pk": self.regular_user_wallet.id})
+        moment = self.start + timedelta(days=3, hours=1)
+        response = self.client.get(self.url, data={"date": moment.isoformat()})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("18.00", response.json()["balance"])
+
+        response = self.client.get(self.url, data={"date": "yesterday"})
+        self.assertEqual(400, response.status_code)
+        self.client.logout()
+
+    def test_verify_wallet_ledger(self):
+        call_command('build_wallet_snapshots', daily=True, stdout=StringIO())
+        call_command('verify_wallet_ledger', stdout=StringIO())
+
+        ClientWallet.objects.filter(pk=self.regular_user_wallet.pk).update(balance=Decimal("50"))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_wallet_ledger', str(self.regular_user_wallet.id), stdout=out)
+        self.assertIn("drift 5.00", out.getvalue())
+
+    def import_file(self, content: str, suffix: str, **options) -> str:
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as file:
+            file.write(content)
+            file.flush()
+            out = StringIO()
+            call_command('import_transactions', file.name, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_transactions(self):
+        call_command('build_wallet_snapshots', every=3, stdout=StringIO())
+        imported_at = self.start + timedelta(days=4, hours=1)
+        out = self.import_file(
+            "client_wallet_account,amount,description,date_created\n"
+            f"{self.regular_user_wallet.id},20.00,Imported,{imported_at.isoformat()}\n"
+            f"{self.regular_user_wallet.id},-5.00,,{imported_at.isoformat()}\n",
+            '.csv', chunk_size=1
+        )
+        self.assertIn("2 transactions imported", out)
+
+        imported = ClientWalletTransaction.objects.filter(date_created=imported_at).order_by('-amount')
+        self.assertEqual(
+            [(Decimal("20"), ClientWalletTransaction.Type.DEPOSIT, "Imported"),
+             (Decimal("-5"), ClientWalletTransaction.Type.WITHDRAW, None)],
+            [(row.amount, row.transaction_type, row.description) for row in imported]
+        )
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("60"), self.regular_user_wallet.balance)
+        # Only the snapshot taken before the imported transactions is kept
+        self.assertEqual([3], [snapshot.transaction_count for snapshot in self.regular_user_wallet.snapshots.all()])
+        call_command('verify_wallet_ledger', stdout=StringIO())
+
+    def test_import_transactions_is_atomic(self):
+        count = ClientWalletTransaction.objects.count()
+        rows = [
+            {"client_wallet_account": str(self.regular_user_wallet.id), "amount": "1.00"},
+            {"client_wallet_account": str(uuid4()), "amount": "1.00"},
+        ]
+        with self.assertRaisesRegex(CommandError, "Row 2"):
+            self.import_file("".join(json.dumps(row) + "\n" for row in rows), '.ndjson', chunk_size=1)
+        with self.assertRaisesRegex(CommandError, "Row 1"):
+            self.import_file('{"amount": "1.00"}\n', '.ndjson')
+        with self.assertRaisesRegex(CommandError, "Row 1.*transaction_type"):
+            self.import_file(json.dumps({
+                "client_wallet_account": str(self.regular_user_wallet.id), "amount": "-1.00",
+                "transaction_type": ClientWalletTransaction.Type.DEPOSIT.value,
+            }) + "\n", '.ndjson')
+        self.assertEqual(count, ClientWalletTransaction.objects.count())
+        self.regular_user_wallet.refresh_from_db()
+        self.assertEqual(Decimal("45"), self.regular_user_wallet.balance)
+
+
+class AsyncTransactionTests(CommonApiTests):
+
+    def setUp(self):
+        self.user = self.create_user_auth()
+        self.other_user = self.create_user_auth(username='other_user')
+        self.wallet = self.create_client_wallet(self.create_client_account(user_account=self.user))
+        self.second_wallet = self.create_client_wallet(self.wallet.client_account)
+        self.other_wallet = self.create_client_wallet(self.create_client_account(user_account=self.other_user))
+        self.client.force_login(self.user)
+        super().setUp()
+
+    def post_async(self, amount: str, client_wallet: Optional[ClientWallet] = None, prefer: str = 'respond-async'):
+        return self.client.post(reverse('api:client_wallet_transaction_api-list'), data={
+            'amount': amount, 'client_wallet_account': str((client_wallet or self.wallet).pk)
+        }, format='json', HTTP_PREFER=prefer)
+
+    def process(self, **options) -> str:
+        stdout = StringIO()
+        call_command('process_transactions', once=True, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_accepted_transactions_are_pending(self):
+        response = self.post_async('10.00')
+        self.assertEqual(202, response.status_code)
+        self.assertEqual('respond-async', response['Preference-Applied'])
+        self.assertFalse(response.json()['done'])
+        detail_url = reverse('api:client_wallet_transaction_api-detail', kwargs={'pk': response.json()['id']})
+        self.assertEqual('http://testserver' + detail_url, response['Location'])
+        self.wallet.refresh_from_db()
+        self.assertEqual(Decimal("0"), self.wallet.balance)
+        self.assertEqual(Decimal("0"), ledger.balance_at(self.wallet.pk))
+        self.assertEqual(1, processing.pending_count())
+
+        self.assertEqual(404, self.post_async('10.00', self.other_wallet).status_code)
+        response = self.post_async('10.00', ClientWallet(pk=uuid4()))
+        self.assertEqual(400, response.status_code)
+        self.assertIn('client_wallet_account', response.json())
+        self.assertEqual(1, processing.pending_count())
+
+    @override_settings(WALLET_BALANCE_UPDATE_MODE='atomic')
+    def test_process_transactions(self):
+        for amount in ('10.00', '-4.00', '-7.00', '0', '3.00', '-9.00'):
+            self.assertEqual(202, self.post_async(amount).status_code)
+        self.assertEqual(202, self.post_async('5.00', self.second_wallet, prefer='wait=1, respond-async').status_code)
+        self.wallet.snapshots.create(balance=Decimal("0"), transaction_count=0, taken_at=timezone.now())
+
+        self.assertIn('7 transactions processed', self.process(batch_size=2))
+        self.assertEqual(0, processing.pending_count())
+        self.wallet.refresh_from_db()
+        self.second_wallet.refresh_from_db()
+        # 10 - 4 + 3 - 9, the -7.00 withdraw arrived when the balance was 6
+        self.assertEqual(Decimal("0"), self.wallet.balance)
+        self.assertEqual(Decimal("5"), self.second_wallet.balance)
+        rejected = ClientWalletTransaction.objects.get(amount=Decimal("-7.00"))
+        self.assertEqual(ClientWalletTransaction.Type.ERROR, rejected.transaction_type)
+        self.assertEqual(balance.NegativeBalanceError.message, rejected.error_msg)
+        # The snapshot taken while the transactions were pending is stale
+        self.assertFalse(self.wallet.snapshots.exists())
+        self.assertEqual(self.wallet.balance, ledger.balance_at(self.wallet.pk))
+        self.assertIn('0 transactions processed', self.process())
+
+    @override_settings(WALLET_BALANCE_UPDATE_MODE='atomic')
+    def test_process_sharded_wallet(self):
+        with transaction.atomic():
+            balance.collapse_shards(self.wallet.pk, shard_count=2)
+        for amount in ('10.00', '-4.00', '-7.00'):
+            self.post_async(amount)
+        self.assertIn('1 withdraws rejected', self.process())
+        self.wallet.refresh_from_db()
+        self.assertEqual(Decimal("6"), self.wallet.total_balance)
+
+    @override_settings(WALLET_BALANCE_UPDATE_MODE='lock')
+    def test_process_lock_mode_allows_negative_balance(self):
+        for amount in ('10.00', '-15.00'):
+            self.assertEqual(202, self.post_async(amount).status_code)
+        self.assertIn('0 withdraws rejected', self.process())
+        self.wallet.refresh_from_db()
+        self.assertEqual(Decimal("-5"), self.wallet.balance)
+        # Same result as the synchronous path
+        self.assertEqual(201, self.post_async('-1.00', prefer='').status_code)
+        self.wallet.refresh_from_db()
+        self.assertEqual(Decimal("-6"), self.wallet.balance)
+
+    def test_prefers_async(self):
+        factory = APIRequestFactory()
+        for prefer, expected in (('respond-async', True), ('wait=10, Respond-Async', True),
+                                 ('respond-async; foo=bar', True), ('return=minimal', False), ('', False)):
+            request = Request(factory.post('/', HTTP_PREFER=prefer))
+            self.assertEqual(expected, processing.prefers_async(request), msg=prefer)
+
+
+class WalletStatsTests(CommonApiTests):
+
+    def setUp(self):
+        self.user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username='staff_user', is_staff=True)
+        account = self.create_client_account(user_account=self.user)
+        self.wallet = self.create_client_wallet(account)
+        self.second_wallet = self.create_client_wallet(account)
+        self.other_wallet = self.create_client_wallet(
+            self.create_client_account(user_account=self.create_user_auth(username='other_user'))
+        )
+        self.today = timezone.localdate()
+        for client_wallet, amount, days_ago in (
+            (self.wallet, '10.00', 0), (self.wallet, '-4.00', 0), (self.wallet, '5.00', 1),
+            (self.wallet, '7.00', 40), (self.second_wallet, '-2.50', 1), (self.other_wallet, '1.00', 0),
+        ):
+            self.add_transaction(client_wallet, Decimal(amount), days_ago)
+        # Not completed deposits and withdraws
+        self.add_transaction(self.wallet, Decimal('100'), 0, done=False)
+        self.add_transaction(self.wallet, Decimal('-100'), 0, transaction_type=ClientWalletTransaction.Type.ERROR)
+        self.add_transaction(self.wallet, Decimal('0'), 0)
+        call_command('build_wallet_stats', since=self.today - timedelta(days=60), stdout=StringIO())
+        super().setUp()
+
+    def add_transaction(self, client_wallet: ClientWallet, amount: Decimal, days_ago: int, transaction_type=None,
+                        **kwargs) -> ClientWalletTransaction:
+        if transaction_type is None:
+            transaction_type = ClientWalletTransaction.Type.from_amount(amount)
+        created = self.create_client_transaction(
+            amount, client_wallet, transaction_type=transaction_type.value, **kwargs
+        )
+        # Noon of the day, date_created is set on creation
+        day = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), time(12)))
+        ClientWalletTransaction.objects.filter(pk=created.pk).update(date_created=day)
+        return created
+
+    def get_stats(self, url_name: str, kwargs: Optional[dict] = None, **params):
+        return self.client.get(reverse(url_name, kwargs=kwargs), params)
+
+    def test_wallet_stats(self):
+        self.client.force_login(self.user)
+        response = self.get_stats('api:client_wallet_api-stats', {'pk': self.wallet.pk})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(str(self.today - timedelta(days=29)), response.json()['since'])
+        self.assertEqual([
+            {'day': str(self.today - timedelta(days=1)), 'deposits_count': 1, 'deposits_total': '5.00',
+             'withdrawals_count': 0, 'withdrawals_total': '0.00'},
+            {'day': str(self.today), 'deposits_count': 1, 'deposits_total': '10.00',
+             'withdrawals_count': 1, 'withdrawals_total': '4.00'},
+        ], response.json()['days'])
+        self.assertEqual({'deposits_count': 2, 'deposits_total': '15.00', 'withdrawals_count': 1,
+                          'withdrawals_total': '4.00'}, response.json()['totals'])
+
+        response = self.get_stats(
+            'api:client_wallet_api-stats', {'pk': self.wallet.pk}, since=str(self.today - timedelta(days=45))
+        )
+        self.assertEqual('22.00', response.json()['totals']['deposits_total'])
+        self.assertEqual(404, self.get_stats('api:client_wallet_api-stats', {'pk': self.other_wallet.pk}).status_code)
+        for params in ({'since': 'yesterday'}, {'since': str(self.today + timedelta(days=1))},
+                       {'since': str(self.today - timedelta(days=366))}):
+            self.assertEqual(400, self.get_stats('api:client_wallet_api-stats', {'pk': self.wallet.pk}, **params)
+                             .status_code, msg=params)
+
+    def test_all_wallets_stats(self):
+        self.client.force_login(self.user)
+        self.assertEqual(403, self.get_stats('api:client_wallet_api-all-stats').status_code)
+        self.client.force_login(self.staff_user)
+        # The rollups of every wallet are summed by day with one query, plus session and user
+        with self.assertNumQueries(3):
+            response = self.get_stats('api:client_wallet_api-all-stats', since=str(self.today - timedelta(days=1)))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([
+            {'day': str(self.today - timedelta(days=1)), 'deposits_count': 1, 'deposits_total': '5.00',
+             'withdrawals_count': 1, 'withdrawals_total': '2.50'},
+            {'day': str(self.today), 'deposits_count': 2, 'deposits_total': '11.00',
+             'withdrawals_count': 1, 'withdrawals_total': '4.00'},
+        ], response.json()['days'])
+
+    def test_rebuild_is_idempotent(self):
+        rows = ClientWalletDailyStats.objects.count()
+        self.assertEqual(5, rows)
+        ClientWalletTransaction.objects.filter(client_wallet_account=self.second_wallet).delete()
+        self.add_transaction(self.wallet, Decimal('1.00'), 0)
+        call_command('build_wallet_stats', stdout=StringIO())
+        self.assertEqual(rows - 1, ClientWalletDailyStats.objects.count())
+        today_stats = ClientWalletDailyStats.objects.get(client_wallet=self.wallet, day=self.today)
+        self.assertEqual(2, today_stats.deposits_count)
+
+
+class LockNotAvailable(Exception):
+    """
+    Cause of the OperationalError raised by PostgreSQL for NOWAIT and lock_timeout
+    """
+    sqlstate = locking.LOCK_NOT_AVAILABLE
+
+
+class LockStrategyTests(CommonApiTests):
+
+    def setUp(self):
+        instrumentation.metrics.clear()
+        self.calls = 0
+        super().setUp()
+
+    def locked_until(self, attempt: int):
+        """
+        Function whose first attempts fail like a wallet lock that is not available
+        """
+        def function():
+            self.calls += 1
+            if self.calls < attempt:
+                raise OperationalError('could not obtain lock') from LockNotAvailable()
+            return 'done'
+        return function
+
+    def outcomes(self, strategy: str) -> dict:
+        counters = instrumentation.metrics.counters['wallet_lock_outcomes_total']
+        return {
+            outcome: counters.get((('strategy', strategy), ('outcome', outcome)), 0)
+            for outcome in (locking.ACQUIRED, locking.RETRIED, locking.LOCKED)
+        }
+
+    @override_settings(WALLET_LOCK_RETRIES=2, WALLET_LOCK_RETRY_DELAY_MS=0)
+    def test_retry(self):
+        self.assertEqual('done', locking.run(self.locked_until(3), locking.RETRY))
+        self.assertEqual(3, self.calls)
+        self.calls = 0
+        with self.assertRaises(locking.WalletLockedError):
+            locking.run(self.locked_until(4), locking.RETRY)
+        self.assertEqual(3, self.calls)
+        self.assertEqual({'acquired': 1, 'retried': 4, 'locked': 1}, self.outcomes(locking.RETRY))
+
+    def test_nowait_and_timeout_do_not_retry(self):
+        for strategy in (locking.NOWAIT, locking.TIMEOUT):
+            self.calls = 0
+            with self.assertRaises(locking.WalletLockedError):
+                locking.run(self.locked_until(2), strategy)
+            self.assertEqual(1, self.calls)
+            self.assertEqual({'acquired': 0, 'retried': 0, 'locked': 1}, self.outcomes(strategy))
+
+    def test_other_errors_are_raised(self):
+        def function():
+            raise OperationalError('server closed the connection unexpectedly')
+        with self.assertRaisesMessage(OperationalError, 'server closed'):
+            locking.run(function, locking.RETRY)
+        self.assertEqual({'acquired': 0, 'retried': 0, 'locked': 0}, self.outcomes(locking.RETRY))
+
+    @override_settings(WALLET_LOCK_STRATEGY='forever')
+    def test_unknown_strategy(self):
+        with self.assertRaises(ImproperlyConfigured):
+            locking.get_strategy()
+
+    def test_strategies_lock_wallets(self):
+        wallets = ClientWallet.objects.all()
+        self.assertFalse(balance.lock_wallets(wallets).query.select_for_update_nowait)
+        for strategy in (locking.NOWAIT, locking.RETRY):
+            self.assertTrue(balance.lock_wallets(wallets, strategy).query.select_for_update_nowait)
+        with transaction.atomic():
+            self.assertTrue(balance.lock_wallets(wallets, locking.TIMEOUT).query.select_for_update)
+
+
+class WriteProfilingTests(CommonApiTests):
+
+    def setUp(self):
+        self.user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username='staff_user', is_staff=True)
+        account = self.create_client_account(user_account=self.user)
+        self.wallets = [self.create_client_wallet(account) for _ in range(2)]
+        profiling.reset()
+        super().setUp()
+
+    def post_transactions(self, *wallets: ClientWallet) -> None:
+        self.client.force_login(self.user)
+        for client_wallet in wallets:
+            response = self.client.post(reverse('api:client_wallet_transaction_api-list'), data={
+                'amount': '1.00', 'client_wallet_account': str(client_wallet.pk)
+            }, format='json')
+            self.assertEqual(201, response.status_code)
+
+    def test_hot_wallets(self):
+        self.post_transactions(self.wallets[0], self.wallets[1], self.wallets[0])
+        # Failed writes are not aggregated
+        self.client.post(reverse('api:client_wallet_transaction_api-list'), data={
+            'amount': '1.00', 'client_wallet_account': str(uuid4())
+        }, format='json')
+        url = reverse('api:client_wallet_transaction_api-hot-wallets')
+        self.assertEqual(403, self.client.get(url).status_code)
+
+        self.client.force_login(self.staff_user)
+        response = self.client.get(url, {'order': 'lock'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('lock', response.json()['update_mode'])
+        wallets = {wallet['wallet_id']: wallet for wallet in response.json()['wallets']}
+        self.assertEqual({str(self.wallets[0].pk): 2, str(self.wallets[1].pk): 1},
+                         {wallet_id: wallet['transactions'] for wallet_id, wallet in wallets.items()})
+        phases = wallets[str(self.wallets[0].pk)]['phases']
+        self.assertEqual(list(profiling.PHASES), list(phases))
+        self.assertTrue(all(phase['total_seconds'] > 0 for phase in phases.values()))
+        self.assertEqual(1, len(self.client.get(url, {'limit': 1}).json()['wallets']))
+        self.assertEqual(400, self.client.get(url, {'order': 'unknown'}).status_code)
+        self.assertEqual(400, self.client.get(url, {'limit': 'all'}).status_code)
+        self.assertIn('wallet_write_phase_seconds_count{phase="lock"}', instrumentation.metrics.render())
+
+    @override_settings(WALLET_PROFILE_MAX_WALLETS=1)
+    def test_max_wallets(self):
+        self.post_transactions(self.wallets[0], self.wallets[1])
+        self.assertEqual(1, len(profiling.hot_wallets()))
+
+    def test_write_profile(self):
+        profile = profiling.WriteProfile()
+        for phase in profiling.PHASES:
+            profile.mark(phase)
+        profile.mark(profiling.LOCK)
+        profile.stop()
+        durations = profile.durations
+        self.assertTrue(all(duration >= 0 for duration in durations.values()))
+        profile.mark(profiling.INSERT)
+        self.assertEqual(durations, profile.durations)
+
+
+class InstrumentationTests(CommonApiTests):
+
+    def setUp(self):
+        self.user = self.create_user_auth()
+        self.staff_user = self.create_user_auth(username='staff_user', is_staff=True)
+        self.wallet = self.create_client_wallet(self.create_client_account(user_account=self.user))
+        instrumentation.metrics.clear()
+        super().setUp()
+
+    def metric(self, text: str, name: str, **labels: str) -> float:
+        """
+        Value of a sample of the metrics text, 0 when missing
+        """
+        sample = name + instrumentation.format_labels(tuple(labels.items()))
+        for line in text.splitlines():
+            if line.startswith(sample + ' '):
+                return float(line.split()[-1])
+        return 0
+
+    def test_metrics(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            self.assertEqual(200, self.client.get(reverse('api:client_wallet_api-list')).status_code)
+        self.assertEqual(403, self.client.get(reverse('metrics')).status_code)
+
+        self.client.force_login(self.staff_user)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        view = 'api:client_wallet_api-list'
+        self.assertEqual(2, self.metric(text, 'http_requests_total', view=view, method='GET', status='200'))
+        self.assertEqual(2, self.metric(text, 'http_request_duration_seconds_count', view=view))
+        self.assertEqual(2, self.metric(text, 'http_request_duration_seconds_bucket', view=view, le='+Inf'))
+        # Session, user, ownership and the wallet list of each request
+        self.assertGreaterEqual(self.metric(text, 'db_queries_total', view=view), 6)
+        if connection.vendor == 'postgresql':
+            # SQLite cursors do not count the rows of a SELECT
+            self.assertGreaterEqual(self.metric(text, 'db_rows_total', view=view), 2)
+        self.assertIn('# TYPE db_rows_total counter', text)
+        self.assertIn('# TYPE db_lock_wait_seconds_total counter', text)
+        self.assertEqual(1, self.metric(text, 'http_requests_total', view='metrics', method='GET', status='403'))
+
+    async def test_asgi_requests_count_queries(self):
+        await self.async_client.aforce_login(self.user)
+        view = 'api:client_wallet_transaction_api-list'
+        response = await self.async_client.get(reverse(view))
+        self.assertEqual(200, response.status_code)
+        text = instrumentation.metrics.render()
+        self.assertEqual(1, self.metric(text, 'http_requests_total', view=view, method='GET', status='200'))
+        # The sync view and middlewares run in another thread
+        self.assertGreaterEqual(self.metric(text, 'db_queries_total', view=view), 3)
+
+    @override_settings(INSTRUMENTATION_METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(403, self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code)
+        self.assertEqual(200, self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code)
+
+    def test_slow_requests_are_logged(self):
+        self.client.force_login(self.user)
+        url = reverse('api:client_wallet_api-list')
+        with self.assertNoLogs('commons.instrumentation'):
+            self.client.get(url)
+        with override_settings(INSTRUMENTATION_SLOW_REQUEST_MS=0.001), \
+                self.assertLogs('commons.instrumentation', 'WARNING') as logs:
+            self.client.get(url)
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('api:client_wallet_api-list', logs.output[0])
+        # Fingerprints, without the user id
+        self.assertIn('FROM "api_clientwallet"', logs.output[0])
+        self.assertNotIn(f'= {self.user.pk}', logs.output[0])
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            'SELECT "a" FROM "t" WHERE "t"."id" IN (...) AND "t"."name" = ? LIMIT ?',
+            instrumentation.fingerprint(
+                'SELECT "a"  FROM "t"\n WHERE "t"."id" IN (1, 2, %s) AND "t"."name" = \'it\'\'s\' LIMIT 21'
+            )
+        )
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    """
+    Benchmarks are run with tiny sizes, only to check they keep working.
+    """
+
+    def test_benchmark_balance_updates(self):
+        out = StringIO()
+        call_command('benchmark_balance_updates', threads=1, transactions=3, shards=2, stdout=out, stderr=StringIO())
+        self.assertIn('lock x1: 3 ops', out.getvalue())
+        self.assertIn('atomic x1: 3 ops', out.getvalue())
+        self.assertIn('atomic 2 shards x1: 3 ops', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
+
+    def test_only_created_users_are_deleted(self):
+        user = User.objects.create_user(username='benchmark_fan')
+        call_command('benchmark_transaction_create', transactions=1, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(['benchmark_fan'], list(User.objects.values_list('username', flat=True)))
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+
+    def test_benchmark_transaction_create(self):
+        out = StringIO()
+        call_command('benchmark_transaction_create', transactions=3, stdout=out, stderr=StringIO())
+        self.assertIn('create lock: 3 ops', out.getvalue())
+        self.assertIn('create atomic: 3 ops', out.getvalue())
+        self.assertIn('queries/op', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
+
+    def test_benchmark_transfers(self):
+        out = StringIO()
+        call_command('benchmark_transfers', threads=1, transfers=5, wallets=3, stdout=out, stderr=StringIO())
+        self.assertIn('transfer 3 wallets x1: 5 ops', out.getvalue())
+        self.assertIn('0 deadlocks', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
+
+    def test_benchmark_async_views(self):
+        out = StringIO()
+        call_command('benchmark_async_views', requests=2, concurrency=2, endpoints=['username', 'wallet_detail'],
+                     stdout=out)
+        self.assertIn('username sync: 2 ops', out.getvalue())
+        self.assertIn('wallet_detail async: 2 ops', out.getvalue())
+        self.assertIn('0 errors', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
+
+    def test_benchmark_num_accounts(self):
+        out = StringIO()
+        call_command('benchmark_num_accounts', users=[3, 5], requests=2, page_size=2, stdout=out)
+        self.assertIn('5 users first page: 2 ops', out.getvalue())
+        self.assertIn('5 users has_account first page: 2 ops', out.getvalue())
+        self.assertIn('5 rows', out.getvalue())
+        self.assertIn('0 errors', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
+
+    def test_benchmark_serializers(self):
+        out = StringIO()
+        call_command('benchmark_serializers', transactions=5, repeat=2, stdout=out)
+        self.assertIn('model serializer x5: 2 ops', out.getvalue())
+        self.assertIn('values serializer + render x5: 2 ops', out.getvalue())
+        self.assertIn('0 errors', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
+
+    def test_benchmark_api(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f'{directory}/results.json'
+            out = StringIO()
+            call_command('benchmark_api', users=2, transactions_per_wallet=2, threads=1, requests=2, seed=1,
+                         output=output, stdout=out)
+            for name in ('username', 'num_accounts', 'transaction_export', 'transaction_bulk', 'transfer'):
+                self.assertIn(f'{name}: 2 ops', out.getvalue())
+            self.assertNotIn('1 errors', out.getvalue())
+            with open(output) as file:
+                report = json.load(file)
+            self.assertEqual(2, report['results']['wallet_detail']['operations'])
+
+            # A much faster baseline
+            for result in report['results'].values():
+                result['per_second'] *= 100
+            with open(output, 'w') as file:
+                json.dump(report, file)
+            err = StringIO()
+            with self.assertRaisesRegex(CommandError, 'regressions against the baseline'):
+                call_command('benchmark_api', users=1, transactions_per_wallet=1, threads=1, requests=1,
+                             scenarios=['username'], compare=output, stdout=StringIO(), stderr=err)
+            self.assertIn('username:', err.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_').exists())
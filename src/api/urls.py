@@ -2,6 +2,8 @@ from django.urls import include
 from django.urls import path
 from rest_framework import routers
 
+from . import async_views
+
 from .views import ClientAccountViewSet
 from .views import GetNumClientAccounts
 from .views import ClientWalletTransactionSet
@@ -26,5 +28,12 @@ urlpatterns = [
     path('get_username/', GetCurrentUserUsername.as_view(), name="get_username"),
     path('get_user_id/', GetCurrentUserId.as_view(), name="get_user_id"),
     path('get_client_id/', GetCurrentClientId.as_view(), name="get_client_id"),
-    path('get_num_accounts/', GetNumClientAccounts.as_view(), name="get_client_id"),
+    path('get_num_accounts/', GetNumClientAccounts.as_view(), name="get_num_accounts"),
+    # Async versions of the read endpoints above, see api.async_views
+    path('async/get_username/', async_views.get_current_user_username, name="async_get_username"),
+    path('async/get_user_id/', async_views.get_current_user_id, name="async_get_user_id"),
+    path('async/get_client_id/', async_views.get_current_client_id, name="async_get_client_id"),
+    path('async/get_num_accounts/', async_views.get_num_client_accounts, name="async_get_num_accounts"),
+    path('async/client_wallet/', async_views.client_wallet_list, name="async_client_wallet_list"),
+    path('async/client_wallet/<uuid:pk>/', async_views.client_wallet_detail, name="async_client_wallet_detail"),
 ]
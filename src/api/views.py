@@ -1,28 +1,58 @@
 import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.db.models import Count
-from django.http import Http404
-from django.shortcuts import get_object_or_404
+from django.db.models import Count, Exists, F, OuterRef, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 
 from rest_framework import authentication
 from rest_framework import mixins
 from rest_framework import permissions
+from rest_framework import serializers
 from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 
+from commons.filters import QueryParamsFilterBackend
+from commons.mixins import ValuesReadMixin
+from commons.pagination import DateCreatedCursorPagination, IdCursorPagination
 from commons.permissions import AnonCreateAndUpdateOwnerOnly, ListStaffOnly, IsStaff
-from commons.utils import ClassUtils
-from .models import ClientAccount, WalletTransaction
+from . import balance
+from . import exports
+from . import cache
+from . import idempotency
+from . import ledger
+from . import locking
+from . import ownership
+from . import processing
+from . import profiling
+from . import stats
+from .models import ClientAccount
 from .models import ClientWallet
 from .models import ClientWalletTransaction
 from .serializers import ClientAccountSerializer
+from .serializers import ClientWalletFilterSerializer
 from .serializers import ClientWalletSerializer
+from .serializers import ClientWalletTransactionBulkSerializer
+from .serializers import ClientWalletTransactionFilterSerializer
 from .serializers import ClientWalletTransactionSerializer
+from .serializers import ClientWalletTransferSerializer
+from .serializers import StaffClientAccountSerializer
+from .serializers import UserAccountsFilterSerializer
 from .serializers import UserSerializer
+from .serializers import WalletDailyStatsSerializer
+from .serializers import WalletStatsRangeSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +69,7 @@ class UserViewSet(mixins.CreateModelMixin,
     """
     permission_classes = (AnonCreateAndUpdateOwnerOnly, ListStaffOnly,)
     serializer_class = UserSerializer
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -56,6 +87,12 @@ class ClientAccountViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ClientAccountSerializer
+    pagination_class = DateCreatedCursorPagination
+
+    def get_serializer_class(self):
+        if self.request.user.is_staff:
+            return StaffClientAccountSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -67,17 +104,105 @@ class ClientAccountViewSet(viewsets.ModelViewSet):
         return super().update(request, *args, **kwargs)
 
 
-class ClientWalletViewSet(viewsets.ModelViewSet):
+class ClientWalletViewSet(ValuesReadMixin, viewsets.ModelViewSet):
     """
     Regular users could only interact with their own wallets.
+    list and retrieve are serialized from values() rows, see commons.mixins.ValuesReadMixin.
     """
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ClientWalletSerializer
+    pagination_class = DateCreatedCursorPagination
+    filter_backends = (QueryParamsFilterBackend,)
+    filter_serializer_class = ClientWalletFilterSerializer
+    values_columns = {"balance": "computed_balance"}
 
     def get_queryset(self):
+        wallets = ClientWallet.objects.with_total_balance()
+        if self.action == 'retrieve':
+            # Stored with the cached representation
+            wallets = wallets.annotate(owner_id=F('client_account__user_account_id'))
         if self.request.user.is_staff:
-            return ClientWallet.objects.all()
-        return ClientWallet.objects.filter(client_account__user_account_id=self.request.user.pk)
+            return wallets
+        return wallets.filter(id__in=ownership.for_request(self.request).wallet_ids)
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        """
+        Read-through cache keyed by wallet id, see api.cache
+        """
+        entry = cache.get_wallet(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if entry is not None and (request.user.is_staff or entry["owner_id"] == request.user.pk):
+            return Response(entry["data"])
+        if self.use_values_read():
+            values_serializer = self.get_values_serializer()
+            row = self.get_values_object(values_serializer, "owner_id")
+            wallet_id, owner_id, data = row["id"], row["owner_id"], values_serializer.to_representation(row)
+        else:
+            client_wallet = self.get_object()
+            wallet_id, owner_id = client_wallet.pk, client_wallet.owner_id
+            data = self.get_serializer(client_wallet).data
+        cache.set_wallet(wallet_id, owner_id, data)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], permission_classes=(IsStaff,))
+    def cache_stats(self, request, *args, **kwargs) -> Response:
+        """
+        Wallet cache hits and misses, staff users only.
+        """
+        return Response(cache.stats())
+
+    @action(detail=True, methods=['get'])
+    def balance_at(self, request, *args, **kwargs) -> Response:
+        """
+        Wallet balance at the given date (?date=ISO 8601, now by default) from its ledger:
+        the latest snapshot before that date plus the transactions created after it.
+        """
+        client_wallet = self.get_object()
+        moment = request.query_params.get("date")
+        try:
+            moment = serializers.DateTimeField().to_internal_value(moment) if moment else timezone.now()
+        except serializers.ValidationError as error:
+            raise ValidationError({"date": error.detail})
+        return Response({
+            "id": client_wallet.id,
+            "date": serializers.DateTimeField().to_representation(moment),
+            "balance": serializers.DecimalField(max_digits=65, decimal_places=2).to_representation(
+                ledger.balance_at(client_wallet.id, moment)
+            ),
+        })
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, *args, **kwargs) -> Response:
+        """
+        Deposits and withdraws of the wallet per day, between ?since= and ?until= (dates),
+        read from the daily rollups, see api.stats.
+        """
+        client_wallet = self.get_object()
+        since, until = self.get_stats_range()
+        return self.stats_response(stats.wallet_days(client_wallet.pk, since, until), since, until,
+                                   wallet=client_wallet.pk)
+
+    @action(detail=False, methods=['get'], permission_classes=(IsStaff,), url_path='stats', url_name='all-stats')
+    def all_stats(self, request, *args, **kwargs) -> Response:
+        """
+        Deposits and withdraws of every wallet per day, staff users only, see stats.
+        """
+        since, until = self.get_stats_range()
+        return self.stats_response(stats.all_wallets_days(since, until), since, until)
+
+    def get_stats_range(self) -> tuple:
+        range_serializer = WalletStatsRangeSerializer(data=self.request.query_params)
+        range_serializer.is_valid(raise_exception=True)
+        return range_serializer.validated_data["since"], range_serializer.validated_data["until"]
+
+    @staticmethod
+    def stats_response(rows: list, since, until, **extra) -> Response:
+        return Response({
+            **extra,
+            "since": since,
+            "until": until,
+            "totals": WalletDailyStatsSerializer(stats.totals(rows)).data,
+            "days": WalletDailyStatsSerializer(rows, many=True).data,
+        })
 
     def update(self, request, *args, **kwargs):
         """Only allowed for superusers"""
@@ -87,56 +212,326 @@ class ClientWalletViewSet(viewsets.ModelViewSet):
         return super().update(request, *args, **kwargs)
 
 
-class ClientWalletTransactionSet(mixins.CreateModelMixin,
+class ClientWalletTransactionSet(ValuesReadMixin,
+                                 mixins.CreateModelMixin,
                                  mixins.RetrieveModelMixin,
                                  mixins.ListModelMixin,
                                  viewsets.GenericViewSet):
     """
     Regular users could only interact with their own wallets.
+    list and retrieve are serialized from values() rows, see commons.mixins.ValuesReadMixin.
     """
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ClientWalletTransactionSerializer
+    pagination_class = DateCreatedCursorPagination
+    filter_backends = (QueryParamsFilterBackend,)
+    filter_serializer_class = ClientWalletTransactionFilterSerializer
+    filter_actions = ('list', 'export')
+    # None uses the WALLET_BALANCE_UPDATE_MODE setting, see api.balance
+    balance_update_mode = None
+    # None uses the WALLET_LOCK_STRATEGY setting, see api.locking
+    lock_strategy = None
+
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return ClientWalletTransactionBulkSerializer
+        if self.action == 'transfer':
+            return ClientWalletTransferSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         if self.request.user.is_staff:
             return ClientWalletTransaction.objects.all()
-        try:
-            return ClientWalletTransaction.objects.filter(
-                client_wallet_account__client_account__user_account_id=self.request.user.pk
-            )
-        except (ClientAccount.DoesNotExist, ClientWalletTransaction.DoesNotExist):
-            raise Http404
+        return ClientWalletTransaction.objects.filter(
+            client_wallet_account_id__in=ownership.for_request(self.request).wallet_ids
+        )
 
+    @idempotency.idempotent
     def create(self, request, *args, **kwargs) -> Response:
         """
+        Retries sent with the same Idempotency-Key header get the first response back,
+        see api.idempotency.
+        Depending on the lock strategy a locked wallet answers a 409 with a Retry-After
+        header, see api.locking.
+        With the `Prefer: respond-async` header the transaction is only inserted, as
+        pending, and the response is a 202, see api.processing.
+        Both paths follow the same balance rule: in atomic mode a withdraw larger than the
+        balance is rejected (a 400, or an ERROR transaction once processed), in lock mode
+        it is applied and the balance may go negative.
+
         * Docs
         ** Transaction atomic:
         https://docs.djangoproject.com/en/3.2/topics/db/transactions/#controlling-transactions-explicitly
         :return: A django rest framework response
         """
+        profile = profiling.WriteProfile()
+        profile.mark(profiling.VALIDATION)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        wallet_token = request.data.get("client_wallet_account")
+        wallet_id = serializer.validated_data["client_wallet_account"]
         amount = serializer.validated_data.get("amount", 0)
-        if amount > 0:
-            serializer.validated_data["transaction_type"] = ClientWalletTransaction.Type.DEPOSIT.value
-        elif amount < 0:
-            serializer.validated_data["transaction_type"] = ClientWalletTransaction.Type.WITHDRAW.value
-        else:
-            serializer.validated_data["transaction_type"] = ClientWalletTransaction.Type.TESTING.value
-        with transaction.atomic():
-            client_wallet = ClientWallet.objects.select_for_update().get(id=wallet_token)
-            if serializer.validated_data.get('transaction_type') not in [
-                WalletTransaction.Type.TESTING,
-                WalletTransaction.Type.ERROR
-            ]:
-                client_wallet.balance += amount
-            client_wallet.save()
+        serializer.validated_data["transaction_type"] = ClientWalletTransaction.Type.from_amount(amount).value
+        if processing.prefers_async(request):
+            return self.create_pending(serializer, wallet_id)
+
+        def insert(client_wallet: ClientWallet) -> None:
+            serializer.validated_data["client_wallet_account"] = client_wallet
+            # An attempt retried by the retry lock strategy inserts again
+            serializer.instance = None
             self.perform_create(serializer)
+
+        try:
+            # The wallet owner is checked by the same query that fetches (and locks) the wallet
+            balance.record_transaction(
+                wallet_id, amount, insert, mode=self.balance_update_mode,
+                owner_id=None if request.user.is_staff else request.user.pk, profile=profile,
+                lock_strategy=self.lock_strategy
+            )
+        except balance.NegativeBalanceError as error:
+            raise ValidationError({"amount": [error.message]})
+        except locking.WalletLockedError:
+            raise locking.WalletLocked
+        except ClientWallet.DoesNotExist:
+            self.wallet_not_found(serializer, wallet_id)
+        profiling.record(wallet_id, profile)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def create_pending(self, serializer: ClientWalletTransactionSerializer, wallet_id) -> Response:
+        """
+        Async create: the wallet owner is checked and the transaction inserted with
+        done=False, the process_transactions worker applies it to the wallet balance.
+        """
+        if self.request.user.is_staff:
+            allowed = ClientWallet.objects.filter(id=wallet_id).exists()
+        else:
+            allowed = wallet_id in ownership.for_request(self.request).wallet_ids
+        if not allowed:
+            self.wallet_not_found(serializer, wallet_id)
+        serializer.validated_data["client_wallet_account"] = ClientWallet(pk=wallet_id)
+        serializer.validated_data["done"] = False
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={
+            "Location": reverse(
+                "api:client_wallet_transaction_api-detail", kwargs={"pk": serializer.instance.pk}, request=self.request
+            ),
+            processing.PREFERENCE_APPLIED_HEADER: processing.RESPOND_ASYNC,
+        })
+
+    @staticmethod
+    def wallet_not_found(serializer: ClientWalletTransactionSerializer, wallet_id) -> None:
+        """
+        :raise Http404: the wallet exists, but it is not owned by the user
+        :raise ValidationError: unknown wallet
+        """
+        if ClientWallet.objects.filter(id=wallet_id).exists():
+            raise Http404
+        raise ValidationError({"client_wallet_account": [
+            serializer.fields["client_wallet_account"].error_messages["does_not_exist"].format(pk_value=wallet_id)
+        ]})
+
+    @action(detail=False, methods=['get'], permission_classes=(IsStaff,))
+    def hot_wallets(self, request, *args, **kwargs) -> Response:
+        """
+        Wallets with the most time spent in each phase of their transaction writes, staff
+        users only, see api.profiling. ?order=total (default) or a phase, ?limit=20.
+        """
+        try:
+            limit = int(request.query_params.get("limit", 20))
+            wallets = profiling.hot_wallets(max(limit, 0), request.query_params.get("order", "total"))
+        except ValueError as error:
+            raise ValidationError({"detail": [str(error)]})
+        return Response({
+            "update_mode": balance.get_update_mode(self.balance_update_mode),
+            "phases": profiling.PHASES,
+            "wallets": wallets,
+        })
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs) -> StreamingHttpResponse:
+        """
+        Stream every transaction (of the user wallets for regular users) as CSV or JSON Lines,
+        ?output=csv (default) or ?output=ndjson, with the list filters. See api.exports.
+        The output param is not called format, rest framework uses it to choose a renderer.
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in exports.FORMATS:
+            raise ValidationError({"output": [f"Use one of: {', '.join(exports.FORMATS)}."]})
+        transactions = self.filter_queryset(self.get_queryset())
+        if isinstance(request._request, ASGIRequest):
+            lines = exports.aiter_lines(transactions, output)
+        else:
+            lines = exports.iter_lines(transactions, output)
+        response = StreamingHttpResponse(lines, content_type=exports.FORMATS[output].content_type)
+        response['Content-Disposition'] = f'attachment; filename="transactions.{output}"'
+        return response
+
+    @action(detail=False, methods=['post'])
+    @idempotency.idempotent
+    def bulk(self, request, *args, **kwargs) -> Response:
+        """
+        Create a list of transactions in a single request.
+
+        Transactions are grouped by wallet: each affected wallet is fetched (and locked in
+        lock mode, see api.balance) once, its balance is updated with the sum of the amounts
+        and every row is inserted with bulk_create, all of it inside one atomic block.
+
+        The response has one result per item, in the same order as the request.
+        Valid items are created even when other items fail:
+            - 201: all items were created.
+            - 207: some items were created.
+            - 400: no item was created.
+        In atomic mode a wallet without enough balance rejects all of its items.
+        Supports the Idempotency-Key header, like create.
+        :return: A django rest framework response
+        """
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"non_field_errors": ["Expected a non empty list of transactions."]})
+        if len(items) > settings.WALLET_BULK_MAX_TRANSACTIONS:
+            raise ValidationError({"non_field_errors": [
+                f"Ensure this list has no more than {settings.WALLET_BULK_MAX_TRANSACTIONS} transactions."
+            ]})
+
+        results = [None] * len(items)
+        validated_items = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                validated_items.append((index, serializer.validated_data))
+            else:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST,
+                                  "errors": serializer.errors}
+
+        created = self.run_bulk_create(validated_items, results)
+
+        for index, instance in created:
+            results[index] = {"index": index, "status": status.HTTP_201_CREATED,
+                              "data": self.get_serializer(instance).data}
+
+        if len(created) == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(results, status=response_status)
+
+    def run_bulk_create(self, validated_items: list, results: list) -> list:
+        """
+        perform_bulk_create in an atomic block, run again by the retry lock strategy.
+        """
+        strategy = locking.get_strategy(self.lock_strategy)
+
+        def attempt() -> list:
+            with transaction.atomic():
+                return self.perform_bulk_create(validated_items, results, strategy)
+
+        try:
+            return locking.run(attempt, strategy)
+        except locking.WalletLockedError:
+            raise locking.WalletLocked
+
+    def perform_bulk_create(self, validated_items: list, results: list, strategy: str = locking.WAIT) -> list:
+        """
+        Fetch (and lock in lock mode) every affected wallet with a single query, apply the
+        summed amount of each wallet and insert all the transactions.
+        Must be called inside an atomic block.
+
+        :param validated_items: (index, validated_data) tuples
+        :param results: per item results, filled with a 404 for unknown or not owned wallets
+            and a 400 for wallets without enough balance (atomic mode only)
+        :param strategy: lock strategy, see api.locking
+        :return: (index, transaction) tuples of the created transactions
+        """
+        mode = balance.get_update_mode(self.balance_update_mode)
+        wallet_ids = {data["client_wallet_account"] for index, data in validated_items}
+        if not self.request.user.is_staff:
+            wallet_ids &= ownership.for_request(self.request).wallet_ids
+        wallets = ClientWallet.objects.filter(id__in=wallet_ids)
+        if mode == balance.LOCK:
+            wallets = balance.lock_wallets(wallets, strategy)
+        wallets = {wallet.id: wallet for wallet in wallets}
+
+        created = []
+        deltas = defaultdict(Decimal)
+        for index, data in validated_items:
+            client_wallet = wallets.get(data["client_wallet_account"])
+            if client_wallet is None:
+                results[index] = {"index": index, "status": status.HTTP_404_NOT_FOUND,
+                                  "errors": {"detail": NotFound.default_detail}}
+                continue
+            transaction_type = ClientWalletTransaction.Type.from_amount(data["amount"])
+            if transaction_type.affects_balance:
+                deltas[client_wallet.id] += data["amount"]
+            created.append((index, ClientWalletTransaction(
+                **{**data, "client_wallet_account": client_wallet},
+                transaction_type=transaction_type.value
+            )))
+
+        rejected_wallets, missing_wallets = self.apply_bulk_deltas(wallets, deltas, mode, strategy)
+        for index, instance in created:
+            if instance.client_wallet_account_id in rejected_wallets:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST,
+                                  "errors": {"amount": [balance.NegativeBalanceError.message]}}
+            elif instance.client_wallet_account_id in missing_wallets:
+                results[index] = {"index": index, "status": status.HTTP_404_NOT_FOUND,
+                                  "errors": {"detail": NotFound.default_detail}}
+        created = [
+            (index, instance) for index, instance in created
+            if instance.client_wallet_account_id not in rejected_wallets | missing_wallets
+        ]
+        ClientWalletTransaction.objects.bulk_create([instance for index, instance in created])
+        return created
+
+    @action(detail=False, methods=['post'])
+    @idempotency.idempotent
+    def transfer(self, request, *args, **kwargs) -> Response:
+        """
+        Move an amount from a wallet of the user (any wallet for staff users) to another
+        wallet. The withdraw and the deposit are created together or not at all, see
+        api.balance.transfer. Supports the Idempotency-Key header, like create.
+        :return: A django rest framework response with both transactions
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            withdraw, deposit = balance.transfer(
+                serializer.validated_data["source_wallet"], serializer.validated_data["target_wallet"],
+                serializer.validated_data["amount"], description=serializer.validated_data.get("description"),
+                owner_id=None if request.user.is_staff else request.user.pk, lock_strategy=self.lock_strategy
+            )
+        except ClientWallet.DoesNotExist:
+            raise Http404
+        except balance.NegativeBalanceError as error:
+            raise ValidationError({"amount": [error.message]})
+        except locking.WalletLockedError:
+            raise locking.WalletLocked
+        return Response({
+            "withdraw": ClientWalletTransactionSerializer(withdraw).data,
+            "deposit": ClientWalletTransactionSerializer(deposit).data,
+        }, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def apply_bulk_deltas(wallets: dict, deltas: dict, mode: str, strategy: str = locking.WAIT) -> tuple:
+        """
+        The balance of the rejected and missing wallets is not changed.
+
+        :return: ids of the wallets without enough balance (atomic mode only) and ids of the
+            wallets deleted after they were fetched (atomic mode or sharded wallets)
+        """
+        rejected_wallets = set()
+        missing_wallets = set()
+        for wallet_id in sorted(deltas):
+            try:
+                balance.add_amount(wallets[wallet_id], deltas[wallet_id], mode=mode, strategy=strategy)
+            except balance.NegativeBalanceError:
+                rejected_wallets.add(wallet_id)
+            except ClientWallet.DoesNotExist:
+                missing_wallets.add(wallet_id)
+        return rejected_wallets, missing_wallets
+
 
 class GetCurrentUserUsername(APIView):
     """
@@ -173,26 +568,39 @@ class GetCurrentClientId(APIView):
     renderer_classes = (JSONRenderer,)
 
     def get(self, request):
-        client = get_object_or_404(ClientAccount, user_account=request.user.pk)
-        json_response = {"id": client.id}
+        client_account_id = ownership.for_request(request).client_account_id
+        if client_account_id is None:
+            raise Http404
+        json_response = {"id": client_account_id}
         return Response(json_response)
 
 
+def get_user_accounts(query_params) -> QuerySet:
+    """
+    id, username and number of client accounts of each user, as dicts: one query with a
+    correlated count per returned user, model instances are never built.
+
+    :raise ValidationError: invalid UserAccountsFilterSerializer query params
+    """
+    client_accounts = ClientAccount.objects.filter(user_account_id=OuterRef('pk'))
+    users = User.objects.annotate(has_account=Exists(client_accounts))
+    users = UserAccountsFilterSerializer.filter_from_query_params(users, query_params)
+    return users.annotate(num_accounts=Coalesce(Subquery(
+        client_accounts.values('user_account_id').annotate(total=Count('id')).values('total')
+    ), Value(0))).values('id', 'username', 'num_accounts')
+
+
 class GetNumClientAccounts(APIView):
     """
-    Sample view to see users with account in JSON format.
-    It uses Django Aggregation.
+    Number of client accounts of each user in JSON format, paginated by user id.
+    ?has_account=true|false only returns the users with or without an account.
     """
     authentication_classes = (authentication.SessionAuthentication, authentication.BasicAuthentication,)
     permission_classes = (IsStaff,)
     renderer_classes = (JSONRenderer,)
+    pagination_class = IdCursorPagination
 
     def get(self, request):
-        users = User.objects.annotate(num_accounts=Count('clientaccount'))
-        json_response = []
-        allowed_data = ['id', 'username', 'num_accounts']
-        for user in users:
-            json_response.append(
-                ClassUtils.get_class_instance_properties_as_dict(user, allowed_data)
-            )
-        return Response(json_response)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(get_user_accounts(request.query_params), request, view=self)
+        return paginator.get_paginated_response(page)
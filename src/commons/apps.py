@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class CommonsConfig(AppConfig):
     name = 'commons'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import instrumentation
+
+        connection_created.connect(instrumentation.connection_created, dispatch_uid='instrumentation_queries')
@@ -0,0 +1,19 @@
+from rest_framework.filters import BaseFilterBackend
+
+
+class QueryParamsFilterBackend(BaseFilterBackend):
+    """
+    Filter list actions with the query params validated by view.filter_serializer_class.
+    Views can filter other actions too listing them in filter_actions.
+
+    The filter serializer maps each of its fields to a queryset lookup with a `lookups`
+    dict, ex. {'date_created_after': 'date_created__gte'}. Invalid params return a 400.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filter_serializer_class = getattr(view, 'filter_serializer_class', None)
+        if filter_serializer_class is None or getattr(view, 'action', None) not in getattr(
+            view, 'filter_actions', ('list',)
+        ):
+            return queryset
+        return filter_serializer_class.filter_from_query_params(queryset, request.query_params)
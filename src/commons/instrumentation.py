@@ -0,0 +1,261 @@
+"""
+Per-request instrumentation: latency, database time, number of queries, rows and lock wait
+time of each view, exposed as Prometheus text by metrics_view and logged for slow requests.
+
+InstrumentationMiddleware must be the first middleware, so the time and queries of the
+other middlewares (ex. session and authentication) are included. Queries are measured by
+measure_query, an execute_wrapper added to every database connection when it is created
+(CommonsConfig.ready). It adds them to the QueryStats of the current request, kept in a
+context variable, so under ASGI it also counts the queries of the sync middlewares and
+views, which run in other threads (sync_to_async copies the context):
+    - rows: cursor rowcount, the rows returned by SELECT (PostgreSQL) or changed by writes.
+    - lock wait: time of the SELECT ... FOR UPDATE statements (select_for_update), which
+      includes the wait for the row locks held by concurrent writers.
+
+Metrics are kept in memory by each process: scrape every worker, or run one per container.
+Requests slower than INSTRUMENTATION_SLOW_REQUEST_MS are logged as warnings with the
+fingerprints of their queries (literals replaced by ?), slowest first.
+
+* Docs
+** Database instrumentation: https://docs.djangoproject.com/en/5.2/topics/db/instrumentation/
+** Prometheus text format: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import hmac
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERIES_LOGGED = 10
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    """
+    The statement with its literals and placeholders replaced by ?, IN lists collapsed.
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql.replace('%s', '?'))
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """
+    connection.execute_wrapper that measures the queries of a request.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.lock_wait = 0.0
+        self.statements: List[Tuple[str, float]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.duration += duration
+            self.rows += max(getattr(context['cursor'], 'rowcount', 0) or 0, 0)
+            if 'FOR UPDATE' in sql:
+                self.lock_wait += duration
+            self.statements.append((sql, duration))
+
+    def slowest_fingerprints(self, limit: int = SLOW_QUERIES_LOGGED) -> List[Tuple[str, int, float]]:
+        """
+        :return: (fingerprint, executions, total seconds), slowest first
+        """
+        totals = defaultdict(lambda: [0, 0.0])
+        for sql, duration in self.statements:
+            total = totals[fingerprint(sql)]
+            total[0] += 1
+            total[1] += duration
+        return sorted(
+            ((sql, count, duration) for sql, (count, duration) in totals.items()), key=lambda item: -item[2]
+        )[:limit]
+
+
+class Registry:
+    """
+    In memory counters and histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        self.histograms: Dict[str, Dict[tuple, List[float]]] = {}
+        self.buckets: Dict[str, tuple] = {}
+
+    def describe(self, name: str, metric_type: str, text: str) -> None:
+        self.help[name] = (metric_type, text)
+
+    def increment(self, name: str, labels: tuple, amount: float = 1) -> None:
+        with self.lock:
+            self.counters[name][labels] += amount
+
+    def observe(self, name: str, labels: tuple, value: float, buckets: tuple = LATENCY_BUCKETS) -> None:
+        """
+        Histogram observation: one count per bucket (the last one is +Inf), then sum.
+        """
+        with self.lock:
+            self.buckets.setdefault(name, buckets)
+            series = self.histograms.setdefault(name, {}).setdefault(labels, [0] * (len(buckets) + 2))
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[len(buckets)] += 1
+            series[-1] += value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (metric_type, text) in self.help.items():
+                lines += [f'# HELP {name} {text}', f'# TYPE {name} {metric_type}']
+                for labels, value in self.counters.get(name, {}).items():
+                    lines.append(f'{name}{format_labels(labels)} {value:g}')
+                for labels, series in self.histograms.get(name, {}).items():
+                    for bound, count in zip((*self.buckets[name], '+Inf'), series):
+                        lines.append(f'{name}_bucket{format_labels((*labels, ("le", str(bound))))} {count}')
+                    lines.append(f'{name}_count{format_labels(labels)} {series[-2]}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {series[-1]:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+    def escape(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}' if labels else ''
+
+
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar('current_stats', default=None)
+
+
+def measure_query(execute, sql, params, many, context):
+    """
+    execute_wrapper of every connection, queries outside a request are not measured.
+    """
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def connection_created(sender, connection, **kwargs) -> None:
+    # Wrappers are kept when the connection is reopened
+    if measure_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(measure_query)
+
+
+metrics = Registry()
+metrics.describe('http_requests_total', 'counter', 'Requests by view, method and response status.')
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency by view.')
+metrics.describe('db_queries_total', 'counter', 'Database queries by view.')
+metrics.describe('db_query_duration_seconds_total', 'counter', 'Database time by view.')
+metrics.describe('db_rows_total', 'counter', 'Rows returned or changed by the queries of each view.')
+metrics.describe('db_lock_wait_seconds_total', 'counter', 'Time of the SELECT ... FOR UPDATE queries by view.')
+
+
+def view_name(request: HttpRequest) -> str:
+    """
+    Url name of the resolved view (ex. api:client_wallet_api-list), bounded label values.
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unresolved'
+    return resolver_match.view_name
+
+
+def record(request: HttpRequest, response: HttpResponse, elapsed: float, stats: Optional[QueryStats]) -> None:
+    view = (('view', view_name(request)),)
+    metrics.increment('http_requests_total', (*view, ('method', request.method), ('status', response.status_code)))
+    metrics.observe('http_request_duration_seconds', view, elapsed)
+    if stats is not None:
+        metrics.increment('db_queries_total', view, stats.queries)
+        metrics.increment('db_query_duration_seconds_total', view, stats.duration)
+        metrics.increment('db_rows_total', view, stats.rows)
+        metrics.increment('db_lock_wait_seconds_total', view, stats.lock_wait)
+
+    threshold = settings.INSTRUMENTATION_SLOW_REQUEST_MS
+    if threshold and elapsed * 1000 >= threshold:
+        message = f"Slow request {request.method} {request.path} ({view[0][1]}): {elapsed * 1000:.0f}ms"
+        if stats is not None:
+            message += (
+                f", {stats.queries} queries in {stats.duration * 1000:.0f}ms, {stats.rows} rows, "
+                f"lock wait {stats.lock_wait * 1000:.0f}ms"
+            )
+            message += ''.join(
+                f"\n  {count}x {duration * 1000:.1f}ms {sql}" for sql, count, duration in stats.slowest_fingerprints()
+            )
+        logger.warning(message)
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(self.get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        record(request, response, time.perf_counter() - start, stats)
+        return response
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Metrics in the Prometheus text format, for staff users or requests with the
+    INSTRUMENTATION_METRICS_TOKEN bearer token (scrapers).
+    """
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    authorized = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    if not authorized and not request.user.is_staff:
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
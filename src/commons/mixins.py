@@ -0,0 +1,50 @@
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+from .serializers import ValuesSerializer
+
+
+class ValuesReadMixin:
+    """
+    list and retrieve of a generic view answered from values() rows with a ValuesSerializer
+    of the view serializer class, see commons.serializers. The response is the same, but
+    neither model instances nor serializer fields are built per row.
+
+    values_read_actions selects the actions per view, () disables the fast path.
+    values_columns maps the fields whose source is not a concrete model field to the
+    queryset annotation holding it. Object permissions get the row dict, not an instance.
+    """
+    values_read_actions = ('list', 'retrieve')
+    values_columns = {}
+
+    def use_values_read(self) -> bool:
+        return self.action in self.values_read_actions
+
+    def get_values_serializer(self) -> ValuesSerializer:
+        return ValuesSerializer(self.get_serializer_class(), self.values_columns, self.get_serializer_context())
+
+    def get_values_object(self, values_serializer: ValuesSerializer, *extra_columns: str) -> dict:
+        """
+        get_object for values() rows.
+        """
+        queryset = values_serializer.values(self.filter_queryset(self.get_queryset()), *extra_columns)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, row)
+        return row
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_values_read():
+            return super().list(request, *args, **kwargs)
+        values_serializer = self.get_values_serializer()
+        queryset = values_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.many(page))
+        return Response(values_serializer.many(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_values_read():
+            return super().retrieve(request, *args, **kwargs)
+        values_serializer = self.get_values_serializer()
+        return Response(values_serializer.to_representation(self.get_values_object(values_serializer)))
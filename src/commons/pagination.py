@@ -0,0 +1,54 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class DateCreatedCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination, newest first. Each page is a range query over a
+    (date_created, id) index of the model, so its cost does not depend on the table size
+    or on the page number.
+    Rows created at the same time are ordered by id: ids are random UUIDs, so their order
+    is stable between pages but it is not the insertion order.
+
+    * Docs
+    ** Cursor pagination: https://www.django-rest-framework.org/api-guide/pagination/#cursorpagination
+    """
+    ordering = ('-date_created', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class IdCursorPagination(DateCreatedCursorPagination):
+    """
+    Cursor pagination by primary key, oldest first, ex. users (date_joined is not indexed).
+    Rows may be dicts (values() querysets).
+    """
+    ordering = ('id',)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of big tables. Counting an unfiltered PostgreSQL table
+    scans all of it, so above estimate_threshold rows the planner estimate
+    (pg_class.reltuples) is used instead. Filtered querysets, small tables and other
+    databases use the exact count.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
@@ -0,0 +1,124 @@
+"""
+Faster ModelSerializers.
+
+CachedFieldsMixin builds the fields of a serializer class once.
+
+ValuesSerializer is a read-only fast path of ModelSerializer representations.
+
+A ModelSerializer builds each representation field by field: it walks its bound fields,
+gets each attribute from a model instance and calls the field to_representation. For list
+responses that machinery, plus building the model instances, costs more than the query.
+ValuesSerializer compiles the readable fields of a serializer once into (name, column,
+encoder) triples and applies them to values() rows, with inlined encoders for decimals,
+datetimes and primary keys. The output is the same as the serializer output.
+
+Only plain readable fields are supported: model fields, primary key related fields and
+fields whose source is an annotation named in `columns`. Fields of other types keep
+their own to_representation.
+"""
+import copy
+import decimal
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+
+class CachedFieldsMixin:
+    """
+    ModelSerializer whose fields are built once per class, then deep copied for each
+    instance like the declared fields are, instead of introspecting the model on every
+    instantiation. The fields must not depend on the instance or the context: serializers
+    with fields that vary per request need one class per variant.
+    """
+
+    def get_fields(self):
+        serializer_class = type(self)
+        fields = serializer_class.__dict__.get('_cached_fields')
+        if fields is None:
+            fields = super().get_fields()
+            # Concurrent first instantiations may both build them, the result is the same
+            serializer_class._cached_fields = fields
+        return copy.deepcopy(fields)
+
+
+def decimal_encoder(field: serializers.DecimalField) -> Callable:
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def encode(value) -> str:
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return encode
+
+
+def datetime_encoder(field: serializers.DateTimeField) -> Callable:
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', timezone.get_current_timezone() if settings.USE_TZ else None)
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def encode(value) -> str:
+        if timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return encode
+
+
+def get_encoder(field: serializers.Field) -> Callable:
+    if isinstance(field, serializers.DecimalField):
+        return decimal_encoder(field)
+    if isinstance(field, serializers.DateTimeField):
+        return datetime_encoder(field)
+    if isinstance(field, serializers.UUIDField) and field.uuid_format == 'hex_verbose':
+        return str
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        # The json renderer encodes the primary key (ex. UUID) like the serializer output
+        return lambda value: value
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """
+    Representation of values() rows with the output of serializer_class.
+
+    :param columns: values() column of the fields whose source is not a concrete model
+        field (ex. an annotation), by field name
+    """
+
+    def __init__(self, serializer_class: Type[serializers.ModelSerializer], columns: Optional[Dict[str, str]] = None,
+                 context: Optional[dict] = None):
+        columns = columns or {}
+        serializer = serializer_class(context=context or {})
+        self.fields: List[Tuple[str, str, Callable]] = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column = columns.get(name, field.source)
+            if name not in columns and isinstance(field, serializers.RelatedField):
+                column = serializer_class.Meta.model._meta.get_field(field.source).attname
+            self.fields.append((name, column, get_encoder(field)))
+        self.columns = tuple(dict.fromkeys(column for _, column, _ in self.fields))
+
+    def values(self, queryset: QuerySet, *extra_columns: str) -> QuerySet:
+        return queryset.values(*self.columns, *extra_columns)
+
+    def to_representation(self, row: dict) -> dict:
+        return {
+            name: None if row[column] is None else encode(row[column]) for name, column, encode in self.fields
+        }
+
+    def many(self, rows: Iterable[dict]) -> List[dict]:
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
@@ -22,11 +22,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'commons.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.ownership.ClientOwnershipMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,6 +71,15 @@ DATABASES = {
     },
 }
 
+# Local memory by default, ex. DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# and DJANGO_CACHE_LOCATION=redis://redis:6379 to share the cache between processes
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -122,3 +133,50 @@ USE_I18N = True
 USE_TZ = True
 
 STATIC_URL = '/static/'
+
+# Wallets
+
+# How transactions update the wallet balance: lock or atomic, see api.balance
+WALLET_BALANCE_UPDATE_MODE = os.environ.get('WALLET_BALANCE_UPDATE_MODE', 'lock')
+
+# Max number of transactions accepted by a single bulk request
+WALLET_BULK_MAX_TRANSACTIONS = int(os.environ.get('WALLET_BULK_MAX_TRANSACTIONS', 5000))
+
+# Default number of transactions between two wallet balance snapshots, see api.ledger
+WALLET_SNAPSHOT_EVERY = int(os.environ.get('WALLET_SNAPSHOT_EVERY', 1000))
+
+# Seconds an Idempotency-Key is kept before purge_idempotency_keys deletes it, see api.idempotency
+WALLET_IDEMPOTENCY_KEY_TTL = int(os.environ.get('WALLET_IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Cache of the wallet detail endpoint: CACHES alias and seconds an entry is kept (0 disables it), see api.cache.
+# It is only enabled when the alias is a backend shared by every process, ex. Redis
+WALLET_CACHE_ALIAS = os.environ.get('WALLET_CACHE_ALIAS', 'default')
+WALLET_CACHE_TIMEOUT = int(os.environ.get('WALLET_CACHE_TIMEOUT', 60))
+
+# Seconds the account and wallet ids of a user are cached across requests (0: once per request), see api.ownership.
+# It is only enabled when WALLET_CACHE_ALIAS is a backend shared by every process, ex. Redis
+WALLET_OWNERSHIP_CACHE_TIMEOUT = int(os.environ.get('WALLET_OWNERSHIP_CACHE_TIMEOUT', 0))
+
+# What writes do when a wallet is locked: wait, timeout, nowait or retry, see api.locking
+WALLET_LOCK_STRATEGY = os.environ.get('WALLET_LOCK_STRATEGY', 'wait')
+# Max lock wait of the timeout strategy, in milliseconds
+WALLET_LOCK_TIMEOUT_MS = int(os.environ.get('WALLET_LOCK_TIMEOUT_MS', 2000))
+# Retries of the retry strategy and max delay of the first one, in milliseconds (doubled on every retry)
+WALLET_LOCK_RETRIES = int(os.environ.get('WALLET_LOCK_RETRIES', 3))
+WALLET_LOCK_RETRY_DELAY_MS = int(os.environ.get('WALLET_LOCK_RETRY_DELAY_MS', 50))
+# Retry-After seconds of the 409 responses to writes of locked wallets
+WALLET_LOCK_RETRY_AFTER = int(os.environ.get('WALLET_LOCK_RETRY_AFTER', 1))
+
+# Max number of days of a wallet statistics request, see api.stats
+WALLET_STATS_MAX_DAYS = int(os.environ.get('WALLET_STATS_MAX_DAYS', 366))
+
+# Max number of wallets whose write phases are aggregated by each process (0 disables it), see api.profiling
+WALLET_PROFILE_MAX_WALLETS = int(os.environ.get('WALLET_PROFILE_MAX_WALLETS', 1000))
+
+# Instrumentation
+
+# Requests slower than this many milliseconds are logged with their queries (0 disables it), see commons.instrumentation
+INSTRUMENTATION_SLOW_REQUEST_MS = int(os.environ.get('INSTRUMENTATION_SLOW_REQUEST_MS', 1000))
+
+# Bearer token of the metrics scrapers, staff users only when empty
+INSTRUMENTATION_METRICS_TOKEN = os.environ.get('INSTRUMENTATION_METRICS_TOKEN', '')
@@ -2,9 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views import debug
 
+from commons.instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('api/v1/', include('api.urls'), name='api'),
+    path('metrics', metrics_view, name='metrics'),
     path('hihi-django', debug.default_urlconf),
 ]